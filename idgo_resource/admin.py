@@ -17,7 +17,15 @@
 from django.contrib import admin
 # from idgo_resource.models import Resource
 from idgo_resource.models import ResourceFormats
+from idgo_resource.models import StorageUsage
 
 
 # admin.site.register(Resource)
 admin.site.register(ResourceFormats)
+
+
+@admin.register(StorageUsage)
+class StorageUsageAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'object_id', 'bytes_used', 'quota', 'updated')
+    list_filter = ('scope',)
+    readonly_fields = ('bytes_used', 'updated')
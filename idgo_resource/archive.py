@@ -0,0 +1,189 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import os
+import shutil
+import stat
+import zipfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from idgo_resource.ckan.store import content_type
+from idgo_resource import compression
+from idgo_resource.ckan.store import DIRECTORY_STORAGE
+from idgo_resource.ckan.store import index_directory
+from idgo_resource.ckan.store import read_index
+from idgo_resource.ckan.store import synchronize
+from idgo_resource.ckan.store import write_index
+from idgo_resource import logger
+from idgo_resource.models import Resource
+from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource.storage import local_copy
+from idgo_resource import usage
+
+
+ARCHIVE_MAX_SIZE = getattr(settings, 'RESOURCE_ARCHIVE_MAX_SIZE', 10737418240)  # Default: 10Gio
+ARCHIVE_MAX_ENTRIES = getattr(settings, 'RESOURCE_ARCHIVE_MAX_ENTRIES', 100000)
+ARCHIVE_MAX_RATIO = getattr(settings, 'RESOURCE_ARCHIVE_MAX_RATIO', 200)
+
+CHUNK_SIZE = 1048576
+# Nombre d'entrées extraites entre deux écritures de l'index
+INDEX_FLUSH_EVERY = 500
+
+
+class ArchiveError(Exception):
+    """L'archive est invalide ou dépasse les limites autorisées."""
+
+
+def safe_target(location, name):
+    """Retourner le chemin d'extraction de `name`, sans sortir de `location`."""
+    if os.path.isabs(name) or '\\' in name:
+        raise ArchiveError("Chemin non autorisé : {name}".format(name=name))
+    target = os.path.realpath(os.path.join(location, name))
+    if os.path.commonpath([target, location]) != location or target == location:
+        raise ArchiveError("Chemin non autorisé : {name}".format(name=name))
+    return target
+
+
+def _is_reserved(name):
+    """Les noms préfixés par `_` ou `.` sont réservés (index, fichiers temporaires)."""
+    return any(part.startswith(('_', '.')) for part in name.split('/') if part)
+
+
+def _is_symlink(info):
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+def _copy(src, dst, limit):
+    """Copier par blocs en s'interrompant dès que `limit` octets sont dépassés."""
+    written = 0
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return written
+        written += len(chunk)
+        if written > limit:
+            raise ArchiveError("Le contenu décompressé dépasse la taille annoncée.")
+        dst.write(chunk)
+
+
+def extract(source, location, clear=False, on_entry=None):
+    """Extraire une archive ZIP entrée par entrée dans `location`.
+
+    La mémoire consommée est bornée par la taille d'un bloc ; les tailles
+    et taux de compression sont vérifiés avant et pendant l'extraction
+    (protection contre les bombes de décompression) et aucune entrée ne
+    peut être écrite hors de `location`. L'index du répertoire est mis
+    à jour au fur et à mesure.
+    """
+
+    location = os.path.realpath(location)
+    if clear and os.path.isdir(location):
+        shutil.rmtree(location)
+    os.makedirs(location, exist_ok=True)
+
+    index = read_index(location)
+    if index is None:
+        index = index_directory(location)
+
+    with zipfile.ZipFile(source) as archive:
+        infos = [info for info in archive.infolist() if not info.filename.endswith('/')]
+        if len(infos) > ARCHIVE_MAX_ENTRIES:
+            raise ArchiveError("L'archive contient trop de fichiers ({count}).".format(count=len(infos)))
+
+        total = 0
+        for count, info in enumerate(infos, 1):
+            if _is_symlink(info):
+                logger.warning("Archive entry \"{name}\" is a symlink: skipped.".format(name=info.filename))
+                continue
+            if _is_reserved(info.filename):
+                logger.warning("Archive entry \"{name}\" has a reserved name: skipped.".format(name=info.filename))
+                continue
+            if info.file_size > ARCHIVE_MAX_RATIO * max(info.compress_size, 1):
+                raise ArchiveError("Taux de compression suspect : {name}".format(name=info.filename))
+            if total + info.file_size > ARCHIVE_MAX_SIZE:
+                raise ArchiveError("Le contenu de l'archive dépasse la taille autorisée.")
+
+            target = safe_target(location, info.filename)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            compression.invalidate(target)
+            tmp = os.path.join(os.path.dirname(target), '.{}.part'.format(os.path.basename(target)))
+            try:
+                with archive.open(info) as src, open(tmp, 'wb') as dst:
+                    total += _copy(src, dst, info.file_size)
+                os.replace(tmp, target)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+            relative_path = os.path.relpath(target, location)
+            index[relative_path] = {
+                'content_type': content_type(target),
+                'size': info.file_size,
+            }
+            if count % INDEX_FLUSH_EVERY == 0:
+                write_index(location, index)
+            if on_entry:
+                on_entry(relative_path, count, len(infos))
+
+    write_index(location, index)
+    return index
+
+
+def ingest(resource_pk, source=None, user_pk=None, clear=False, redis_key=None):
+    """Alimenter le répertoire de stockage d'une ressource à partir d'une archive.
+
+    `source` est le chemin d'une archive (par exemple un fichier déposé sur
+    le FTP) ; à défaut, l'archive enregistrée dans la `StorageResource` de
+    la ressource est utilisée. La ressource CKAN est synchronisée une seule
+    fois, à la fin de l'extraction.
+    """
+
+    resource = Resource.objects.get(pk=resource_pk)
+    location = os.path.join(DIRECTORY_STORAGE, str(resource.pk))
+
+    def notify(**event):
+        if redis_key:
+            RedisHandler().publish(redis_key, **event)
+
+    def on_entry(relative_path, count, total):
+        if count == total or count % 100 == 0:
+            notify(stage='extract', progress=int(80 * count / total))
+
+    try:
+        notify(stage='extract', progress=0)
+        if source:
+            index = extract(source, location, clear=clear, on_entry=on_entry)
+        else:
+            file_path = resource.storageresource.file_path
+            with local_copy(file_path.storage, file_path.name) as path:
+                index = extract(path, location, clear=clear, on_entry=on_entry)
+        notify(stage='compress', progress=80)
+        for relative_path in index:
+            compression.compress(os.path.join(location, relative_path))
+        # Les variantes compressées modifient le répertoire après l'écriture de l'index.
+        write_index(location, index)
+        usage.account(resource.pk)
+        notify(stage='publish', progress=90)
+        user = get_user_model().objects.filter(pk=user_pk).first()
+        synchronize(resource, with_user=user)
+    except Exception as e:
+        logger.exception("Archive ingestion failed for resource \"{pk}\".".format(pk=resource.pk))
+        notify(stage='failed', failed_stage='ingest', error=str(e))
+        raise
+    notify(stage='done', progress=100)
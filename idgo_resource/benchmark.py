@@ -0,0 +1,171 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import json
+import os
+import resource as rlimit
+from socketserver import ThreadingMixIn
+import threading
+import time
+from uuid import uuid4
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Convertir une taille du type `512`, `1K`, `20M` ou `2G` en octets."""
+    value = str(value).strip().upper()
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def write_csv(filename, size):
+    """Écrire un fichier CSV d'environ `size` octets, par blocs de 1000 lignes."""
+    line = '{id},Élément {id},{value},2020-01-{day:02d}\n'
+    with open(filename, 'wb') as f:
+        written = f.write(b'id,nom,valeur,date\n')
+        index = 0
+        while written < size:
+            block = ''.join(
+                line.format(id=i, value=i * 0.5, day=i % 28 + 1)
+                for i in range(index, index + 1000)).encode('utf-8')
+            written += f.write(block[:size - written])
+            index += 1000
+
+
+def generate_tree(location, count, size, depth=2, width=16):
+    """Générer `count` fichiers CSV de `size` octets répartis dans des sous-répertoires."""
+    filenames = []
+    for index in range(count):
+        parts = [str((index // width ** level) % width) for level in range(depth)]
+        directory = os.path.join(location, *parts)
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, 'file_{index}.csv'.format(index=index))
+        write_csv(filename, size)
+        filenames.append(filename)
+    return filenames
+
+
+def peak_rss():
+    """Pic de mémoire résidente du processus, en octets."""
+    return rlimit.getrusage(rlimit.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class Stage(object):
+    """Mesures d'une étape : latences, requêtes SQL et pic de mémoire."""
+
+    def __init__(self, name):
+        self.name = name
+        self.timings = []
+        self.queries = []
+        self.rss_before = peak_rss()
+        self.rss_after = self.rss_before
+
+    @contextmanager
+    def measure(self):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            yield
+            self.timings.append(time.perf_counter() - start)
+        self.queries.append(len(ctx.captured_queries))
+        self.rss_after = peak_rss()
+
+    def report(self):
+        return {
+            'stage': self.name,
+            'runs': len(self.timings),
+            'p50_ms': percentile(self.timings, 50) * 1000,
+            'p95_ms': percentile(self.timings, 95) * 1000,
+            'p99_ms': percentile(self.timings, 99) * 1000,
+            'max_ms': max(self.timings or [0]) * 1000,
+            'queries': sum(self.queries) / max(len(self.queries), 1),
+            'peak_rss_mb': self.rss_after / 1048576,
+            'rss_growth_mb': (self.rss_after - self.rss_before) / 1048576,
+        }
+
+
+class CkanStubHandler(BaseHTTPRequestHandler):
+    """API d'action CKAN minimale répondant avec succès à tous les appels."""
+
+    packages = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, result):
+        body = json.dumps({'success': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _action(self):
+        return self.path.split('?')[0].rstrip('/').split('/')[-1]
+
+    def do_GET(self):
+        self.handle_action(self._action(), {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        # Le corps (éventuellement multipart) est lu par blocs puis ignoré
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 1048576)))
+        self.handle_action(self._action(), {})
+
+    def handle_action(self, action, data):
+        if action == 'user_show':
+            self._respond({'id': str(uuid4()), 'name': 'benchmark', 'apikey': str(uuid4())})
+        elif action in ('package_show', 'package_update', 'package_patch'):
+            self._respond({'id': str(uuid4()), 'name': 'benchmark', 'resources': []})
+        elif action.startswith('resource_'):
+            self._respond({'id': str(uuid4()), 'url': '', 'views': []})
+        else:
+            self._respond({})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@contextmanager
+def ckan_stub(port=0):
+    """Démarrer une API CKAN locale ; renvoie son URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), CkanStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{port}/'.format(port=server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,136 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from concurrent.futures import ThreadPoolExecutor
+import os.path
+
+from django.conf import settings
+from django.db import transaction
+
+from idgo_resource import logger
+from idgo_resource.mime import guess_type
+from idgo_resource.models import Ftp
+from idgo_resource.models import Resource
+from idgo_resource.models import ResourceFormats
+from idgo_resource.models import Upload
+from idgo_resource import usage
+
+
+BULK_MAX_WORKERS = getattr(settings, 'RESOURCE_BULK_MAX_WORKERS', 4)
+
+
+def find_format(formats, content_type, filename):
+    """Retrouver le format correspondant au type MIME ou à l'extension du fichier."""
+    extension = filename.split('.')[-1]
+    for item in formats:
+        if (content_type and item.mimetype and content_type in item.mimetype) \
+                or item.extension == extension:
+            return item
+
+
+def _prepare_upload(uploaded_file):
+    field = Upload._meta.get_field('file_path')
+    name = field.generate_filename(None, uploaded_file.name)
+    name = field.storage.save(name, uploaded_file, max_length=field.max_length)
+    return {
+        'name': name,
+        'title': uploaded_file.name,
+        'content_type': uploaded_file.content_type,
+    }
+
+
+def _prepare_ftp(file_path):
+    return {
+        'name': file_path,
+        'title': os.path.basename(file_path),
+        'content_type': guess_type(file_path),
+    }
+
+
+def prepare(items, func):
+    """Préparer les fichiers en parallèle (enregistrement, détection du type MIME).
+
+    Si la préparation d'un fichier échoue, les fichiers déjà enregistrés
+    sont supprimés avant que l'erreur ne soit levée.
+    """
+    with ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS) as executor:
+        futures = [executor.submit(func, item) for item in items]
+    entries, error = [], None
+    for future in futures:
+        try:
+            entries.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error:
+        if func is _prepare_upload:
+            discard_uploads(entries)
+        raise error
+    return entries
+
+
+def discard_uploads(entries):
+    """Supprimer du stockage les fichiers téléversés qu'aucune ressource ne référence."""
+    storage = Upload._meta.get_field('file_path').storage
+    for entry in entries:
+        try:
+            storage.delete(entry['name'])
+        except Exception:
+            logger.exception("Unable to delete \"{name}\".".format(name=entry['name']))
+
+
+@transaction.atomic
+def create_resources(dataset, entries, RelatedModel, resource_type='raw'):
+    """Créer en une seule transaction les ressources et leurs fichiers liés."""
+
+    formats = list(ResourceFormats.objects.order_by('pk'))
+
+    resources = Resource.objects.bulk_create([
+        Resource(
+            dataset=dataset,
+            title=entry['title'],
+            format_type=find_format(formats, entry['content_type'], entry['name']),
+            resource_type=resource_type,
+        ) for entry in entries
+    ])
+
+    # PostgreSQL renvoie les clés primaires des lignes insérées
+    RelatedModel.objects.bulk_create([
+        RelatedModel(resource=resource, file_path=entry['name'])
+        for resource, entry in zip(resources, entries)
+    ])
+
+    # `bulk_create` n'émet pas de signal : les compteurs de stockage sont mis à jour ici
+    for resource in resources:
+        usage.account(resource.pk)
+
+    logger.info("{count} resources have been created in bulk.".format(count=len(resources)))
+    return resources
+
+
+def create_upload_resources(dataset, uploaded_files, **kwargs):
+    entries = prepare(uploaded_files, _prepare_upload)
+    try:
+        return create_resources(dataset, entries, Upload, **kwargs)
+    except Exception:
+        # Les fichiers sont enregistrés hors de la transaction annulée
+        discard_uploads(entries)
+        raise
+
+
+def create_ftp_resources(dataset, file_paths, **kwargs):
+    entries = prepare(file_paths, _prepare_ftp)
+    return create_resources(dataset, entries, Ftp, **kwargs)
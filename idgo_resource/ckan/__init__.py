@@ -15,8 +15,10 @@
 
 
 from idgo_resource.ckan.store import synchronize as synchronize_store
+from idgo_resource.ckan.upload import publish as publish_upload
 
 
 __all__ = [
+    publish_upload,
     synchronize_store,
 ]
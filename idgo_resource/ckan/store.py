@@ -14,12 +14,11 @@
 # under the License.
 
 
+import hashlib
 import io
 import json
 import os.path
 from functools import reduce
-import magic
-from mimetypes import MimeTypes
 import os
 import pathlib
 from urllib.parse import urljoin
@@ -30,33 +29,95 @@ from django.urls import reverse
 
 from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.ckan_module import CkanUserHandler
+from idgo_resource.ckan.throttle import throttle
+from idgo_resource.compression import is_variant
+from idgo_resource.locks import idempotency_key
+from idgo_resource.locks import ResourceLock
+from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.mime import guess_type
 
 
 DIRECTORY_STORAGE = settings.DIRECTORY_STORAGE
 DOMAIN = settings.DOMAIN_NAME
 
-Mime = magic.Magic(mime=True)
+
+# Index des fichiers d'un répertoire de stockage, tenu à jour lors de
+# l'ingestion d'archives (les fichiers préfixés par `_` ne sont pas listés).
+# L'index est ignoré dès que le répertoire a été modifié après son écriture
+# (fichiers déposés ou supprimés par un autre moyen que l'ingestion).
+# Seule la date de modification du répertoire racine est comparée : un
+# fichier ajouté dans un sous-répertoire existant n'invalide pas l'index.
+INDEX_FILENAME = '_index.json'
+
+
+def content_type(filename):
+    return guess_type(filename)
+
+
+def read_index(location):
+    """Lire l'index du répertoire ; `None` s'il est absent, invalide ou périmé."""
+    filename = os.path.join(location, INDEX_FILENAME)
+    try:
+        if os.stat(filename).st_mtime_ns < os.stat(location).st_mtime_ns:
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_index(location, index):
+    filename = os.path.join(location, INDEX_FILENAME)
+    tmp = '{}.tmp'.format(filename)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp, filename)
+    # Le renommage modifie le répertoire : l'index doit rester plus récent.
+    os.utime(filename)
+
+
+def index_directory(location):
+    """Construire l'index des fichiers présents dans le répertoire."""
+    index = {}
+    for filename in pathlib.Path(location).glob('**/[!_\.]*'):
+        if not filename.is_dir() and not is_variant(filename):
+            index[str(filename.relative_to(location))] = {
+                'content_type': content_type(filename),
+                'size': filename.stat().st_size,
+            }
+    return index
 
 
 def iterate(location, base_url=None):
+    index = read_index(location)
+    if index is None:
+        index = index_directory(location)
+
     files = []
-    for filename in pathlib.Path(location).glob('**/[!_\.]*'):
-        if not filename.is_dir():
-            href = reduce(
-                urljoin, [DOMAIN, base_url, str(filename.relative_to(location))])
-            content_type = MimeTypes().guess_type(str(filename))[0] \
-                or Mime.from_file(str(filename))
-            size = filename.stat().st_size
-
-            files.append({
-                'content_type': content_type,
-                'href': href,
-                'size': size,
-            })
+    for relative_path, entry in sorted(index.items()):
+        href = reduce(urljoin, [DOMAIN, base_url, relative_path])
+        files.append({
+            'content_type': entry['content_type'],
+            'href': href,
+            'size': entry['size'],
+        })
     return files
 
 
 def synchronize(instance, with_user=None):
+    """Synchroniser dans CKAN la page de la ressource listant les fichiers du répertoire.
+
+    Comme pour la publication des fichiers, la synchronisation est exécutée
+    sous le verrou de la ressource et n'a pas lieu si la page est inchangée ;
+    renvoie `False` dans ce cas.
+    """
+    with ResourceLock(str(instance.ckan_id)) as lock:
+        instance = type(instance).objects.select_related('dataset').get(pk=instance.pk)
+        return _synchronize(instance, lock, with_user=with_user)
+
+
+def _synchronize(instance, lock, with_user=None):
 
     ckan_package = CkanHandler.get_package(str(instance.dataset.ckan_id))
     username = with_user and with_user.username or instance.dataset.editor.username
@@ -64,7 +125,7 @@ def synchronize(instance, with_user=None):
 
     location = os.path.join(DIRECTORY_STORAGE, str(instance.pk))
 
-    base_url = reverse('resource:directory_storage', kwargs={
+    base_url = reverse('idgo_resource:directory_storage', kwargs={
         'dataset_id': instance.dataset.pk,
         'resource_id': instance.pk
     })
@@ -72,7 +133,6 @@ def synchronize(instance, with_user=None):
     files = iterate(location, base_url=base_url)
     html = render_to_string(
         'resource/store/ckan_resource_template.html', context={'files': files})
-    upload = io.BytesIO(html.encode('utf-8'))
 
     data = {
         'id': str(instance.ckan_id),
@@ -82,8 +142,7 @@ def synchronize(instance, with_user=None):
         'lang': instance.language,
         'data_type': instance.resource_type,
         'view_type': 'text_view',
-        'upload': upload,
-        'size': '',
+        'size': sum(entry['size'] for entry in files),
         'mimetype': 'text/html',
         'format': '',
         'api': '{}',
@@ -93,5 +152,18 @@ def synchronize(instance, with_user=None):
         'restricted': json.dumps({'level': 'public'}),
     }
 
-    with CkanUserHandler(apikey=apikey) as ckan:
-        ckan.publish_resource(ckan_package, **data)
+    key = idempotency_key(
+        hashlib.sha256(html.encode('utf-8')).hexdigest(),
+        dict(data, package=str(instance.dataset.ckan_id)))
+    if lock.is_done(key):
+        logger.info("CKAN Resource \"{pk}\" is up to date.".format(pk=instance.ckan_id))
+        metrics.increment('resource_events_total', action='coalesced')
+        return False
+
+    data['upload'] = io.BytesIO(html.encode('utf-8'))
+    with CkanUserHandler(apikey=apikey) as ckan, throttle('publish_resource', apikey):
+        lock.verify()
+        with metrics.timer('ckan_request_duration_seconds', action='synchronize_store'):
+            ckan.publish_resource(ckan_package, **data)
+    lock.mark_done(key)
+    return True
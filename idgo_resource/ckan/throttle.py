@@ -0,0 +1,214 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from contextlib import contextmanager
+import hashlib
+import random
+import time
+from uuid import uuid4
+
+from django.conf import settings
+
+from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+THROTTLE_ENABLED = getattr(settings, 'RESOURCE_CKAN_THROTTLE', True)
+
+# Seau à jetons partagé par tous les processus, par action de l'API CKAN
+# (requêtes par seconde, rafale maximum) et par clé d'API utilisateur.
+ENDPOINT_RATE = getattr(settings, 'RESOURCE_CKAN_RATE', 10)
+ENDPOINT_BURST = getattr(settings, 'RESOURCE_CKAN_BURST', 20)
+KEY_RATE = getattr(settings, 'RESOURCE_CKAN_KEY_RATE', 2)
+KEY_BURST = getattr(settings, 'RESOURCE_CKAN_KEY_BURST', 5)
+
+# Nombre d'appels simultanés par action, ajusté selon la réponse de CKAN :
+# augmentation additive tant que CKAN répond normalement, réduction
+# multiplicative sur une réponse 429 ou 5xx, une erreur réseau ou un pic de latence.
+CONCURRENCY_INITIAL = getattr(settings, 'RESOURCE_CKAN_CONCURRENCY', 4)
+CONCURRENCY_MIN = getattr(settings, 'RESOURCE_CKAN_CONCURRENCY_MIN', 1)
+CONCURRENCY_MAX = getattr(settings, 'RESOURCE_CKAN_CONCURRENCY_MAX', 16)
+CONCURRENCY_DECREASE = 0.5
+# Un appel est un pic de latence s'il dure plus de `LATENCY_FACTOR` fois
+# la moyenne mobile des appels précédents.
+LATENCY_FACTOR = getattr(settings, 'RESOURCE_CKAN_LATENCY_FACTOR', 3)
+LATENCY_ALPHA = 0.2
+
+# Attente maximum d'un jeton ou d'un créneau (secondes)
+THROTTLE_WAIT = getattr(settings, 'RESOURCE_CKAN_THROTTLE_WAIT', 300)
+# Durée au-delà de laquelle le créneau d'un processus défaillant est libéré
+SLOT_TIMEOUT = getattr(settings, 'RESOURCE_CKAN_SLOT_TIMEOUT', 600)
+
+BUCKET_KEY = 'idgo_resource:ckan:bucket:{name}'
+SLOTS_KEY = 'idgo_resource:ckan:slots:{endpoint}'
+STATE_KEY = 'idgo_resource:ckan:state:{endpoint}'
+
+# Prélèvement d'un jeton dans chacun des seaux, ou aucun ; renvoie
+# l'attente nécessaire (secondes) si l'un des seaux est vide.
+BUCKET_SCRIPT = """
+redis.replicate_commands()
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    available = math.min(burst, available + (now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return '0'
+"""
+
+# Prise d'un créneau si le nombre d'appels en cours est sous la limite courante
+ACQUIRE_SCRIPT = """
+redis.replicate_commands()
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[2])
+if redis.call('ZCARD', KEYS[1]) < math.floor(limit) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Libération du créneau et ajustement de la limite (AIMD)
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local latency = tonumber(ARGV[2])
+local overloaded = ARGV[3] == '1'
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[4])
+local average = tonumber(redis.call('HGET', KEYS[2], 'latency')) or latency
+if overloaded or latency > average * tonumber(ARGV[7]) then
+    limit = math.max(tonumber(ARGV[5]), limit * tonumber(ARGV[8]))
+else
+    limit = math.min(tonumber(ARGV[6]), limit + 1 / limit)
+end
+if not overloaded then
+    average = average + tonumber(ARGV[9]) * (latency - average)
+end
+redis.call('HSET', KEYS[2], 'limit', limit, 'latency', average)
+return tostring(limit)
+"""
+
+
+class ThrottleTimeout(Exception):
+    """Aucun jeton ou créneau d'appel à CKAN n'a pu être obtenu dans le délai imparti."""
+
+
+def is_overloaded(exception):
+    """Déterminer si l'erreur traduit une surcharge de CKAN (429, 5xx, réseau)."""
+    if exception is None:
+        return False
+    response = getattr(exception, 'response', None)
+    status = getattr(exception, 'status_code', None) \
+        or getattr(exception, 'status', None) \
+        or getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(exception, OSError)  # Délai dépassé, connexion refusée, etc.
+
+
+def _pause(seconds, deadline, endpoint):
+    if time.monotonic() + seconds > deadline:
+        raise ThrottleTimeout("CKAN action \"{endpoint}\" is throttled.".format(endpoint=endpoint))
+    time.sleep(seconds)
+
+
+@contextmanager
+def throttle(endpoint, apikey=None):
+    """Encadrer un appel à l'API CKAN par le limiteur de débit et de concurrence.
+
+    Attend un jeton dans les seaux de l'action `endpoint` et de la clé `apikey`,
+    puis un créneau d'appel ; la durée et l'issue de l'appel ajustent ensuite
+    le nombre d'appels simultanés autorisés pour l'action.
+    """
+    if not THROTTLE_ENABLED:
+        yield
+        return
+
+    redis = RedisHandler()
+    client = redis.client
+    deadline = time.monotonic() + THROTTLE_WAIT
+    started = time.monotonic()
+
+    keys = [BUCKET_KEY.format(name=endpoint)]
+    args = [ENDPOINT_RATE, ENDPOINT_BURST]
+    if apikey:
+        digest = hashlib.sha256(apikey.encode('utf-8')).hexdigest()[:16]
+        keys.append(BUCKET_KEY.format(name='key:{}'.format(digest)))
+        args += [KEY_RATE, KEY_BURST]
+
+    bucket_script = client.register_script(BUCKET_SCRIPT)
+    while True:
+        wait = float(bucket_script(keys=keys, args=args))
+        if not wait:
+            break
+        _pause(wait, deadline, endpoint)
+
+    slots_key = SLOTS_KEY.format(endpoint=endpoint)
+    state_key = STATE_KEY.format(endpoint=endpoint)
+    holder = str(uuid4())
+    acquire_script = client.register_script(ACQUIRE_SCRIPT)
+    interval = 0.05
+    while not acquire_script(
+            keys=[slots_key, state_key], args=[holder, CONCURRENCY_INITIAL, SLOT_TIMEOUT]):
+        _pause(interval * (1 + random.random()), deadline, endpoint)
+        interval = min(interval * 2, 1)
+
+    metrics.observe('ckan_throttle_wait_seconds', time.monotonic() - started, action=endpoint)
+
+    error = None
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        latency = time.monotonic() - started
+        overloaded = is_overloaded(error)
+        limit = float(client.register_script(RELEASE_SCRIPT)(
+            keys=[slots_key, state_key],
+            args=[
+                holder, latency, overloaded and '1' or '0',
+                CONCURRENCY_INITIAL, CONCURRENCY_MIN, CONCURRENCY_MAX,
+                LATENCY_FACTOR, CONCURRENCY_DECREASE, LATENCY_ALPHA,
+            ]))
+        if overloaded:
+            logger.warning("CKAN action \"{endpoint}\" overloaded, concurrency reduced to {limit}.".format(
+                endpoint=endpoint, limit=int(limit)))
+        metrics.gauge('ckan_concurrency_limit', limit, action=endpoint)
@@ -0,0 +1,105 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import json
+
+from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.ckan_module import CkanUserHandler
+from idgo_resource.ckan.throttle import throttle
+from idgo_resource.locks import idempotency_key
+from idgo_resource.locks import ResourceLock
+from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.storage import content_digest
+from idgo_resource.storage import file_digest
+
+
+def get_related_file(instance):
+    """Retourner l'instance `Upload` ou `Ftp` liée à la ressource."""
+    for related_attr in ('upload', 'ftp'):
+        if hasattr(instance, related_attr):
+            return getattr(instance, related_attr)
+
+
+def publish(instance, filename=None, with_user=None):
+    """Publier dans CKAN le fichier d'une ressource de type Upload ou Ftp.
+
+    La publication est exécutée sous le verrou de la ressource et n'a pas
+    lieu si le contenu et les métadonnées ont déjà été publiés.
+    """
+    with ResourceLock(str(instance.ckan_id)) as lock:
+        # L'état publié est celui de la base au moment de la prise du verrou
+        instance = type(instance).objects.select_related('dataset', 'format_type').get(pk=instance.pk)
+        _publish(instance, lock, filename=filename, with_user=with_user)
+
+
+def _publish(instance, lock, filename=None, with_user=None):
+    related = get_related_file(instance)
+    if not related or not related.file_path:
+        raise ValueError("Resource \"{pk}\" has no file to publish.".format(pk=instance.pk))
+
+    ckan_package = CkanHandler.get_package(str(instance.dataset.ckan_id))
+    username = with_user and with_user.username or instance.dataset.editor.username
+    apikey = CkanHandler.get_user(username)['apikey']
+
+    format_type = instance.format_type
+    mimetype = format_type and format_type.mimetype and format_type.mimetype[0] or ''
+
+    data = {
+        'id': str(instance.ckan_id),
+        'url': '',
+        'name': instance.title,
+        'description': instance.description,
+        'lang': instance.language,
+        'data_type': instance.resource_type,
+        'size': related.file_path.size,
+        'format': format_type and format_type.ckan_format or '',
+        'mimetype': mimetype,
+        'view_type': format_type and format_type.ckan_view,
+        #
+        'api': '{}',
+        'restricted_by_jurisdiction': 'False',
+        'extracting_service': 'False',
+        'crs': (related.metadata or {}).get('crs') or '',
+        'restricted': json.dumps({'level': 'public'}),
+    }
+
+    if filename:
+        with open(filename, 'rb') as f:
+            content = file_digest(f)
+    else:
+        content = content_digest(related.file_path.storage, related.file_path.name)
+    key = idempotency_key(content, dict(data, package=str(instance.dataset.ckan_id)))
+    if lock.is_done(key):
+        logger.info("CKAN Resource \"{pk}\" is up to date.".format(pk=instance.ckan_id))
+        metrics.increment('resource_events_total', action='coalesced')
+        return
+
+    if filename:
+        upload = open(filename, 'rb')
+    else:
+        upload = related.file_path.storage.open(related.file_path.name, 'rb')
+
+    with upload:
+        data['upload'] = upload
+        with CkanUserHandler(apikey=apikey) as ckan, throttle('publish_resource', apikey):
+            lock.verify()
+            with metrics.timer('ckan_request_duration_seconds', action='publish_resource'):
+                ckan.publish_resource(ckan_package, **data)
+    lock.mark_done(key)
+
+    metrics.increment('bytes_total', related.file_path.size, direction='published')
@@ -0,0 +1,187 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import os
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_ENABLED = getattr(settings, 'RESOURCE_COMPRESSION_ENABLED', True)
+COMPRESSION_MIN_SIZE = getattr(settings, 'RESOURCE_COMPRESSION_MIN_SIZE', 4096)
+# Une variante n'est conservée que si elle fait au plus 80% de la taille d'origine
+COMPRESSION_MAX_RATIO = getattr(settings, 'RESOURCE_COMPRESSION_MAX_RATIO', 0.8)
+
+TEXT_EXTENSIONS = ('csv', 'tsv', 'txt', 'json', 'geojson', 'html', 'htm', 'xml', 'kml', 'gml')
+
+CHUNK_SIZE = 1048576
+SAMPLE_SIZE = 1048576
+
+
+class _Brotli(object):
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=9)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+# Encodages par ordre de préférence : (nom HTTP, suffixe, fabrique de compresseur)
+CODECS = [
+    codec for codec in (
+        ('br', '.br', brotli and _Brotli),
+        ('zstd', '.zst', zstandard and (lambda: zstandard.ZstdCompressor(level=10).compressobj())),
+        ('gzip', '.gz', lambda: zlib.compressobj(6, zlib.DEFLATED, 31)),
+    ) if codec[2]
+]
+
+VARIANT_SUFFIXES = ('.br', '.zst', '.gz')
+
+
+def is_text(filename):
+    return filename.split('.')[-1].lower() in TEXT_EXTENSIONS
+
+
+def is_variant(filename):
+    return str(filename).endswith(VARIANT_SUFFIXES) \
+        and is_text(os.path.splitext(str(filename))[0])
+
+
+def variant_path(filename, suffix):
+    return '{filename}{suffix}'.format(filename=filename, suffix=suffix)
+
+
+def is_fresh(filename, variant):
+    """Une variante est à jour si sa date de modification est celle du fichier source."""
+    try:
+        return os.stat(variant).st_mtime_ns == os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def invalidate(filename):
+    """Supprimer les variantes compressées d'un fichier."""
+    for suffix in VARIANT_SUFFIXES:
+        try:
+            os.remove(variant_path(filename, suffix))
+        except FileNotFoundError:
+            pass
+
+
+def _ratio(factory, data):
+    compressor = factory()
+    return len(compressor.compress(data) + compressor.flush()) / max(len(data), 1)
+
+
+def compress(filename):
+    """Écrire les variantes compressées d'un fichier texte.
+
+    Chaque encodage est d'abord évalué sur un échantillon, puis le fichier
+    est lu une seule fois pour alimenter tous les compresseurs retenus.
+    Renvoie la liste des encodages disponibles.
+    """
+
+    if not COMPRESSION_ENABLED or not is_text(filename):
+        return []
+    st = os.stat(filename)
+    if st.st_size < COMPRESSION_MIN_SIZE:
+        invalidate(filename)
+        return []
+
+    with open(filename, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+
+    selected = []
+    for encoding, suffix, factory in CODECS:
+        variant = variant_path(filename, suffix)
+        if is_fresh(filename, variant):
+            continue
+        if _ratio(factory, sample) > COMPRESSION_MAX_RATIO:
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        selected.append((encoding, variant, factory()))
+
+    outputs = [(variant, open('{}.tmp'.format(variant), 'wb'), compressor)
+               for encoding, variant, compressor in selected]
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                for variant, output, compressor in outputs:
+                    output.write(compressor.compress(chunk))
+        for variant, output, compressor in outputs:
+            output.write(compressor.flush())
+            output.close()
+            tmp = '{}.tmp'.format(variant)
+            if os.path.getsize(tmp) > COMPRESSION_MAX_RATIO * st.st_size:
+                os.remove(tmp)
+                continue
+            os.replace(tmp, variant)
+            os.utime(variant, ns=(st.st_atime_ns, st.st_mtime_ns))
+    finally:
+        for variant, output, compressor in outputs:
+            output.close()
+            if os.path.exists('{}.tmp'.format(variant)):
+                os.remove('{}.tmp'.format(variant))
+
+    return [encoding for encoding, suffix, factory in CODECS
+            if is_fresh(filename, variant_path(filename, suffix))]
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in (header or '').split(','):
+        parts = item.strip().split(';')
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[parts[0].strip().lower()] = q
+    return accepted
+
+
+def negotiate(request, filename):
+    """Choisir la variante à servir ; renvoie `(chemin, encodage)`."""
+    if not is_text(filename):
+        return filename, None
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+    for encoding, suffix, factory in CODECS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            variant = variant_path(filename, suffix)
+            if is_fresh(filename, variant):
+                return variant, encoding
+    return filename, None
@@ -0,0 +1,137 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from idgo_resource import logger
+from idgo_resource.models import Resource
+from idgo_resource.models import ResourceFormats
+from idgo_resource.models import Upload
+from idgo_resource import spreadsheet
+
+
+CONVERSION_ENABLED = getattr(settings, 'RESOURCE_CONVERSION_ENABLED', False)
+CONVERSION_MAX_WORKERS = getattr(settings, 'RESOURCE_CONVERSION_MAX_WORKERS', 2)
+CONVERSION_MEMORY_LIMIT = getattr(settings, 'RESOURCE_CONVERSION_MEMORY_LIMIT', 1073741824)  # Default: 1Gio
+CONVERSION_TIME_LIMIT = getattr(settings, 'RESOURCE_CONVERSION_TIME_LIMIT', 600)
+CONVERSION_PARQUET = getattr(settings, 'RESOURCE_CONVERSION_PARQUET', True)
+
+CONVERTIBLE_EXTENSIONS = tuple(spreadsheet.READERS)
+
+
+class ConversionError(Exception):
+    """La conversion a échoué ou dépassé les limites autorisées."""
+
+
+def is_convertible(filename):
+    return filename.split('.')[-1].lower() in CONVERTIBLE_EXTENSIONS
+
+
+# Pilotage des conversions
+# ========================
+#
+# Chaque conversion est exécutée dans un sous-processus (cf. `spreadsheet`),
+# borné en mémoire (RLIMIT_AS) et tué à l'expiration de CONVERSION_TIME_LIMIT.
+# CONVERSION_MAX_WORKERS limite le nombre de conversions simultanées par
+# processus (worker Celery ou serveur).
+
+_slots = threading.BoundedSemaphore(CONVERSION_MAX_WORKERS)
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa
+    except ImportError:
+        return False
+    return True
+
+
+def convert(source):
+    """Convertir le classeur `source` ; renvoie le répertoire temporaire et les fichiers produits.
+
+    L'appelant a la charge de supprimer le répertoire temporaire.
+    """
+
+    name = os.path.basename(source)
+    extension = source.split('.')[-1].lower()
+    directory = tempfile.mkdtemp(prefix='idgo_resource_')
+    stem = os.path.splitext(name)[0]
+    csv_path = os.path.join(directory, '{}.csv'.format(stem))
+    parquet_path = CONVERSION_PARQUET and parquet_available() \
+        and os.path.join(directory, '{}.parquet'.format(stem)) or None
+
+    args = [
+        sys.executable, '-m', 'idgo_resource.spreadsheet',
+        source, extension, csv_path, parquet_path or '', str(CONVERSION_MEMORY_LIMIT)]
+    with _slots:
+        try:
+            # Le sous-processus est tué (SIGKILL) à l'expiration du délai
+            process = subprocess.run(
+                args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, timeout=CONVERSION_TIME_LIMIT)
+        except subprocess.TimeoutExpired:
+            raise ConversionError("La conversion de {name} a dépassé le temps autorisé.".format(name=name))
+
+    if process.returncode == spreadsheet.EXIT_MEMORY:
+        raise ConversionError("La conversion de {name} a dépassé la mémoire autorisée.".format(name=name))
+    if process.returncode != 0:
+        logger.error("Conversion of \"{name}\" failed ({code}): {stderr}".format(
+            name=name, code=process.returncode, stderr=process.stderr.strip()))
+        raise ConversionError("La conversion de {name} a échoué.".format(name=name))
+
+    outputs = {'csv': csv_path}
+    if parquet_path and os.path.exists(parquet_path):
+        outputs['parquet'] = parquet_path
+    return directory, outputs
+
+
+@transaction.atomic
+def register(resource, extension, filename):
+    """Enregistrer (ou mettre à jour) la ressource dérivée de `resource` au format `extension`."""
+
+    format_type = ResourceFormats.objects.filter(extension=extension).order_by('pk').first()
+    if not format_type:
+        logger.warning("No resource format for extension \"{extension}\".".format(extension=extension))
+        return None
+
+    derived = resource.derived_resources.filter(format_type__extension=extension).first()
+    if not derived:
+        derived = Resource(dataset=resource.dataset, derived_from=resource, format_type=format_type)
+    derived.title = '{title} ({format})'.format(title=resource.title, format=format_type.description)
+    derived.description = resource.description
+    derived.language = resource.language
+    derived.resource_type = resource.resource_type
+    derived.save()
+
+    upload = getattr(derived, 'upload', None) or Upload(resource=derived)
+    previous = upload.file_path and upload.file_path.name
+    with open(filename, 'rb') as f:
+        upload.file_path.save(os.path.basename(filename), File(f), save=False)
+    upload.profile = None
+    upload.save()
+    if previous:
+        upload.file_path.storage.delete(previous)
+
+    return derived
@@ -0,0 +1,72 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import mimetypes
+import re
+
+from django.conf import settings
+
+from idgo_resource.mime import sniff_buffer
+from idgo_resource.storage import open_range
+
+
+# Nombre d'octets lus en tête de fichier pour la détection
+HEADER_SIZE = getattr(settings, 'RESOURCE_DETECTION_HEADER_SIZE', 65536)
+
+# Code EPSG déclaré dans l'en-tête : `"crs"` GeoJSON (`urn:ogc:def:crs:EPSG::2154`),
+# `srsName` GML (`EPSG:2154`), etc.
+EPSG_RE = re.compile(rb'EPSG:{1,2}(\d{4,6})', re.IGNORECASE)
+GEOJSON_RE = re.compile(rb'"type"\s*:\s*"Feature(Collection)?"')
+
+# En l'absence de membre `crs`, une géométrie GeoJSON est en WGS 84 (RFC 7946)
+GEOJSON_DEFAULT_CRS = 'EPSG:4326'
+
+
+def read_header(fieldfile, size=HEADER_SIZE):
+    """Lire les premiers octets du fichier, quel que soit le stockage."""
+    storage_size = fieldfile.storage.size(fieldfile.name)
+    if not storage_size:
+        return b'', 0
+    f = open_range(fieldfile.storage, fieldfile.name, 0, min(size, storage_size) - 1)
+    try:
+        return f.read(), storage_size
+    finally:
+        f.close()
+
+
+def detect_crs(header):
+    match = EPSG_RE.search(header)
+    if match:
+        return 'EPSG:{}'.format(match.group(1).decode('ascii'))
+    if GEOJSON_RE.search(header):
+        return GEOJSON_DEFAULT_CRS
+    return None
+
+
+def detect(fieldfile):
+    """Détecter le type MIME, la taille et le système de coordonnées d'un fichier.
+
+    Seul l'en-tête du fichier est lu ; le type MIME est déduit de l'extension,
+    sinon du contenu.
+    """
+    header, size = read_header(fieldfile)
+    content_type = mimetypes.guess_type(fieldfile.name)[0] or (header and sniff_buffer(header)) or None
+    return {
+        'content_type': content_type,
+        'size': size,
+        'crs': detect_crs(header),
+    }
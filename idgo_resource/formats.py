@@ -0,0 +1,112 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from functools import reduce
+from operator import iconcat
+import threading
+import time
+
+from django.conf import settings
+import redis
+
+from idgo_resource import logger
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+# Version des formats de ressource, incrémentée à chaque modification ;
+# les valeurs calculées à partir des formats sont mises en cache sous
+# cette version, partagée par tous les processus.
+VERSION_KEY = 'idgo_resource:formats:version'
+# Durée (en secondes) pendant laquelle la version lue est réutilisée par le
+# processus : REDIS est interrogé au plus une fois par intervalle.
+VERSION_TTL = getattr(settings, 'RESOURCE_FORMATS_VERSION_TTL', 5)
+
+_cache = {}
+_lock = threading.Lock()
+_version = None  # (date de lecture, version)
+
+
+def get_version():
+    """Retourner la version courante des formats, ou `None` si REDIS est injoignable."""
+    global _version
+    entry = _version
+    if entry and time.monotonic() - entry[0] < VERSION_TTL:
+        return entry[1]
+    try:
+        version = int(RedisHandler().client.get(VERSION_KEY) or 0)
+    except redis.RedisError as e:
+        logger.warning("Unable to read resource formats version: {}".format(e))
+        version = None
+    _version = (time.monotonic(), version)
+    return version
+
+
+def bump_version(*args, **kwargs):
+    """Invalider les valeurs mises en cache (connecté aux signaux de `ResourceFormats`)."""
+    try:
+        RedisHandler().client.incr(VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning("Unable to bump resource formats version: {}".format(e))
+    clear_cache()
+
+
+def cached(name, builder):
+    """Retourner la valeur `name` calculée par `builder` pour la version courante des formats."""
+    version = get_version()
+    if version is None:
+        return builder()
+
+    with _lock:
+        entry = _cache.get(name)
+    if entry and entry[0] == version:
+        return entry[1]
+
+    value = builder()
+    with _lock:
+        _cache[name] = (version, value)
+    return value
+
+
+def clear_cache():
+    global _version
+    with _lock:
+        _cache.clear()
+        _version = None
+
+
+def get_resource_formats():
+    """Retourner les formats de ressource triés par extension.
+
+    Le jeu de requête est construit à l'appel : aucune requête n'est
+    exécutée à l'import des modules (démarrage des workers, migrations).
+    """
+    from idgo_resource.models import ResourceFormats
+    return ResourceFormats.objects.all().order_by('extension')
+
+
+def get_extensions():
+    """Retourner les extensions de fichier autorisées."""
+    return cached('extensions', lambda: sorted(set(
+        item.extension for item in get_resource_formats() if item.extension)))
+
+
+def get_mimetypes():
+    """Retourner les types MIME autorisés."""
+    def build():
+        mimetypes = [item.mimetype for item in get_resource_formats() if item.mimetype]
+        return sorted(set(reduce(iconcat, mimetypes, [])))
+    return cached('mimetypes', build)
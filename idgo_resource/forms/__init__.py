@@ -15,11 +15,14 @@
 
 
 from idgo_resource.forms.resource import ModelResourceForm
+from idgo_resource.forms.ftp import BulkEmitResourceFtpForm
 from idgo_resource.forms.ftp import CreateResourceFtpForm
 from idgo_resource.forms.ftp import EditResourceFtpForm
 from idgo_resource.forms.ftp import EmitResourceFtpForm
 from idgo_resource.forms.ftp import ModelResourceFtpForm
 from idgo_resource.forms.ftp import UpdateResourceFtpForm
+from idgo_resource.forms.store import IngestArchiveForm
+from idgo_resource.forms.upload import BulkEmitResourceUploadForm
 from idgo_resource.forms.upload import CreateResourceUploadForm
 from idgo_resource.forms.upload import EditResourceUploadForm
 from idgo_resource.forms.upload import EmitResourceUploadForm
@@ -28,6 +31,8 @@ from idgo_resource.forms.upload import UpdateResourceUploadForm
 
 
 __all__ = [
+    BulkEmitResourceFtpForm,
+    BulkEmitResourceUploadForm,
     ModelResourceForm,
     ModelResourceFtpForm,
     ModelResourceUploadForm,
@@ -39,4 +44,5 @@ __all__ = [
     CreateResourceUploadForm,
     EditResourceFtpForm,
     EditResourceUploadForm,
+    IngestArchiveForm,
 ]
@@ -22,17 +22,20 @@ from django.core.exceptions import ValidationError
 from django import forms
 
 from idgo_admin.utils import readable_file_size
+from idgo_resource.formats import get_extensions
+from idgo_resource.formats import get_resource_formats
 from idgo_resource.forms import ModelResourceForm
-from idgo_resource.models import ResourceFormats
 from idgo_resource.models import Ftp
 from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource.storage import is_other_node
 
 
 DOWNLOAD_SIZE_LIMIT = getattr(settings, 'RESOURCE_STORE_DOWNLOAD_SIZE_LIMIT', 104857600)  # Default:100Mio
-try:
-    RESOURCE_FORMATS = ResourceFormats.objects.all().order_by('extension')
-except:
-    RESOURCE_FORMATS = []
+
+NODE_ERROR_MESSAGE = (
+    "Le fichier {name} a été sélectionné sur un autre serveur. "
+    "Veuillez sélectionner à nouveau le fichier."
+)
 
 FTP_DIR = settings.FTP_DIR
 try:
@@ -56,6 +59,34 @@ def file_size(value):
         raise ValidationError(message)
 
 
+def list_ftp_files(user, extensions):
+    """Lister les fichiers déposés par l'utilisateur sur son compte FTP."""
+    sub_dir = '{prefix}{username}'.format(
+        prefix=FTP_USER_PREFIX, username=user.username)
+    dir = os.path.join(FTP_DIR, sub_dir, FTP_UPLOADS_DIR)
+
+    choices = []
+    for path, subdirs, files in os.walk(dir):
+        for name in files:
+            file_path = Path(os.path.join(path, name))
+            if file_path.suffix[1:] not in extensions:
+                continue
+            if str(file_path).startswith(FTP_DIR):
+                filename = str(file_path)[len(FTP_DIR):]
+            else:
+                filename = str(file_path)
+            choices.append((str(file_path), 'file://{}'.format(filename)))
+    return choices
+
+
+def check_ftp_file(file_path):
+    p = Path(file_path)
+    if not p.exists():
+        raise forms.ValidationError("Le fichier n'existe pas.")
+    if p.is_dir():
+        raise forms.ValidationError("Les répertoires ne sont pas supportés par l'application.")
+
+
 class ResourceFtpForm(forms.Form):
 
     file_path = forms.ChoiceField(
@@ -65,41 +96,69 @@ class ResourceFtpForm(forms.Form):
     )
 
     def __init__(self, *args, user=None, **kwargs):
-        kwargs.setdefault('resource_formats', RESOURCE_FORMATS)
-        resource_formats = kwargs.pop('resource_formats')
+        resource_formats = kwargs.pop('resource_formats', None)
         super().__init__(*args, **kwargs)
 
-        self.extensions = list(set([item.extension for item in resource_formats if item.extension]))
-
-        sub_dir = '{prefix}{username}'.format(
-            prefix=FTP_USER_PREFIX, username=user.username)
-        dir = os.path.join(FTP_DIR, sub_dir, FTP_UPLOADS_DIR)
+        if resource_formats is None:
+            self.extensions = get_extensions()
+        else:
+            self.extensions = list(set([item.extension for item in resource_formats if item.extension]))
 
         choices = [(None, 'Veuillez sélectionner un fichier')]
-        for path, subdirs, files in os.walk(dir):
-            for name in files:
-                file_path = Path(os.path.join(path, name))
-                if file_path.suffix[1:] not in self.extensions:
-                    continue
-                if str(file_path).startswith(FTP_DIR):
-                    filename = str(file_path)[len(FTP_DIR):]
-                else:
-                    filename = str(file_path)
-                choices.append((str(file_path), 'file://{}'.format(filename)))
+        choices.extend(list_ftp_files(user, self.extensions))
         self.fields['file_path'].choices = choices
 
     def clean_file_path(self):
         file_path = self.cleaned_data.get('file_path')
         if not file_path:
             raise forms.ValidationError("Ce champs ne peut être vide.")
-        p = Path(file_path)
-        if not p.exists():
-            raise forms.ValidationError("Le fichier n'existe pas.")
-        if p.is_dir():
-            raise forms.ValidationError("Les répertoires ne sont pas supportés par l'application.")
+        check_ftp_file(file_path)
         return file_path
 
 
+class BulkEmitResourceFtpForm(forms.Form):
+    """Formulaire d'émission de plusieurs fichiers déposés sur le compte FTP."""
+
+    directory = forms.ChoiceField(
+        label="Importer tous les fichiers d'un répertoire :",
+        required=False,
+        choices=[],
+    )
+
+    file_path = forms.MultipleChoiceField(
+        label="Ou sélectionnez les fichiers déposés sur votre compte FTP :",
+        required=False,
+        choices=[],
+        widget=forms.CheckboxSelectMultiple(),
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extensions = get_extensions()
+
+        choices = list_ftp_files(user, self.extensions)
+        self.fields['file_path'].choices = choices
+
+        directories = sorted(set(os.path.dirname(value) for value, _ in choices))
+        self.fields['directory'].choices = [(None, 'Aucun')] + [
+            (directory, 'file://{}/'.format(directory[len(FTP_DIR):].lstrip('/')))
+            for directory in directories]
+
+    def clean(self):
+        directory = self.cleaned_data.get('directory')
+        file_paths = self.cleaned_data.get('file_path') or []
+        if directory:
+            file_paths = [
+                value for value, _ in self.fields['file_path'].choices
+                if value.startswith(os.path.join(directory, ''))]
+        if not file_paths:
+            raise ValidationError("Veuillez sélectionner au moins un fichier ou un répertoire.")
+        for file_path in file_paths:
+            check_ftp_file(file_path)
+        self.cleaned_data['file_path'] = file_paths
+        return self.cleaned_data
+
+
 class ModelResourceFtpForm(ResourceFtpForm, forms.ModelForm):
 
     class Meta:
@@ -124,17 +183,19 @@ class BaseResourceFtpForm(ModelResourceForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['format_type'].queryset = RESOURCE_FORMATS
+        self.fields['format_type'].queryset = get_resource_formats()
 
     def clean(self):
         redis_key = self.cleaned_data.get('redis_key')
         if redis_key:
             data = RedisHandler().retreive(redis_key)
+            if is_other_node(data):
+                raise ValidationError(NODE_ERROR_MESSAGE.format(name=data['name']))
+
             self.filename = data['filename']  # `filename` MUST exist.
             file_size = data['size']
 
-            if not os.path.exists(self.filename) and \
-               not os.path.isfile(self.filename) and \
+            if not os.path.isfile(self.filename) or \
                not os.path.getsize(self.filename) == file_size:
                 raise ValidationError(
                     (
@@ -15,9 +15,11 @@
 
 
 from django.apps import apps
+from django.core.exceptions import EmptyResultSet
 from django import forms
 from django.forms.models import ModelChoiceIterator
 
+from idgo_resource import formats
 from idgo_resource import logger
 from idgo_resource.models import Resource
 from idgo_resource.models import ResourceFormats
@@ -33,9 +35,39 @@ class FormatTypeSelect(forms.Select):
         return value is None or value == ''
 
     def optgroups(self, name, value, attrs=None):
-        """Return a list of optgroups for this widget."""
-        groups = []
+        """Return a list of optgroups for this widget.
+
+        Les options sont mises en cache pour la version courante des formats ;
+        seule la sélection est appliquée à chaque rendu.
+        """
+        queryset = getattr(self.choices, 'queryset', None)
+        try:
+            sql = queryset is not None and str(queryset.query)
+        except EmptyResultSet:
+            sql = None
+        if sql:
+            key = ('optgroups', name, sql, self.choices.field.empty_label)
+            groups = formats.cached(key, lambda: self._optgroups(name))
+        else:
+            groups = self._optgroups(name)
+
+        result = []
         has_selected = False
+        for group_name, subgroup, index in groups:
+            options = []
+            for option in subgroup:
+                selected = (
+                    str(option['value']) in value and
+                    (not has_selected or self.allow_multiple_selected))
+                if selected:
+                    has_selected = True
+                    option = dict(option, selected=True, attrs=dict(option['attrs'], **self.checked_attribute))
+                options.append(option)
+            result.append((group_name, options, index))
+        return result
+
+    def _optgroups(self, name):
+        groups = []
 
         for index, (option_value, option_label, option_extension) in enumerate(self.choices):
             if option_value is None:
@@ -53,14 +85,9 @@ class FormatTypeSelect(forms.Select):
             groups.append((group_name, subgroup, index))
 
             for subvalue, sublabel, subextra in choices:
-                selected = (
-                    str(subvalue) in value and
-                    (not has_selected or self.allow_multiple_selected))
-
-                has_selected |= selected
                 subgroup.append(
                     self.create_option(
-                        name, subvalue, sublabel, selected, index,
+                        name, subvalue, sublabel, False, index,
                         subindex=subindex, extension=option_extension))
                 if subindex is not None:
                     subindex += 1
@@ -0,0 +1,73 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import zipfile
+
+from django.core.exceptions import ValidationError
+from django import forms
+
+from idgo_resource.forms.ftp import check_ftp_file
+from idgo_resource.forms.ftp import list_ftp_files
+
+
+class IngestArchiveForm(forms.Form):
+    """Formulaire d'alimentation du répertoire d'une ressource magasin par une archive ZIP."""
+
+    archive = forms.FileField(
+        label="Téléverser une archive ZIP :",
+        required=False,
+    )
+
+    ftp_file = forms.ChoiceField(
+        label="Ou sélectionnez une archive déposée sur votre compte FTP :",
+        required=False,
+        choices=[],
+    )
+
+    clear = forms.BooleanField(
+        label="Supprimer les fichiers existants avant l'extraction",
+        required=False,
+        initial=False,
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extensions = ['zip']
+        self.fields['ftp_file'].choices = [(None, 'Aucune')] + list_ftp_files(user, self.extensions)
+
+    def clean_archive(self):
+        archive = self.cleaned_data.get('archive')
+        if archive:
+            if not zipfile.is_zipfile(archive):
+                raise ValidationError("Le fichier {name} n'est pas une archive ZIP.".format(name=archive.name))
+            archive.seek(0)
+        return archive
+
+    def clean_ftp_file(self):
+        ftp_file = self.cleaned_data.get('ftp_file')
+        if ftp_file:
+            check_ftp_file(ftp_file)
+            if not zipfile.is_zipfile(ftp_file):
+                raise ValidationError("Le fichier sélectionné n'est pas une archive ZIP.")
+        return ftp_file
+
+    def clean(self):
+        archive = self.cleaned_data.get('archive')
+        ftp_file = self.cleaned_data.get('ftp_file')
+        if bool(archive) == bool(ftp_file) and not self.errors:
+            raise ValidationError("Veuillez téléverser une archive ou sélectionner une archive déposée sur le FTP.")
+        return self.cleaned_data
@@ -14,30 +14,31 @@
 # under the License.
 
 
-import json
-import os.path
-from functools import reduce
-from operator import iconcat
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django import forms
 
-from idgo_admin.ckan_module import CkanHandler
-from idgo_admin.ckan_module import CkanUserHandler
 from idgo_admin.utils import readable_file_size
+from idgo_resource.ckan import publish_upload
+from idgo_resource.formats import get_extensions
+from idgo_resource.formats import get_mimetypes
+from idgo_resource.formats import get_resource_formats
 from idgo_resource.forms import ModelResourceForm
 from idgo_resource import logger
-from idgo_resource.models import ResourceFormats
 from idgo_resource.models import Upload
 from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource.retry import is_transient
+from idgo_resource.retry import publish_later
+from idgo_resource.storage import is_other_node
 
 
 DOWNLOAD_SIZE_LIMIT = getattr(settings, 'RESOURCE_STORE_DOWNLOAD_SIZE_LIMIT', 104857600)  # Default:100Mio
-try:
-    RESOURCE_FORMATS = ResourceFormats.objects.all().order_by('extension')
-except:
-    RESOURCE_FORMATS = []
+
+NODE_ERROR_MESSAGE = (
+    "Le fichier {name} a été déposé sur un autre serveur. "
+    "Veuillez recommencer le dépôt du fichier."
+)
 
 
 def file_size(value):
@@ -70,8 +71,8 @@ class ResourceUploadForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.extensions = list(set([item.extension for item in RESOURCE_FORMATS if item.extension]))
-        self.mimetypes = list(set(reduce(iconcat, [item.mimetype for item in RESOURCE_FORMATS if item.mimetype], [])))
+        self.extensions = get_extensions()
+        self.mimetypes = get_mimetypes()
         self.fields['file_path'].widget.attrs['accept'] = ', '.join(self.mimetypes)
 
     def clean_file_path(self):
@@ -83,6 +84,26 @@ class ResourceUploadForm(forms.Form):
         return file_path
 
 
+class BulkEmitResourceUploadForm(ResourceUploadForm):
+    """Formulaire d'émission de plusieurs fichiers en une seule requête."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['file_path'].widget = forms.ClearableFileInput(
+            attrs={'multiple': True, 'accept': ', '.join(self.mimetypes)})
+
+    def clean_file_path(self):
+        files = self.files.getlist(self.add_prefix('file_path'))
+        if not files:
+            raise forms.ValidationError("Ce champs ne peut être vide.")
+        for file_path in files:
+            file_size(file_path)
+            if file_path.content_type not in self.mimetypes:
+                raise forms.ValidationError(
+                    "Le type MIME du fichier {name} n'est pas autorisé.".format(name=file_path.name))
+        return files
+
+
 class ModelResourceUploadForm(ResourceUploadForm, forms.ModelForm):
 
     class Meta:
@@ -107,18 +128,21 @@ class BaseResourceUploadForm(ModelResourceForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['format_type'].queryset = RESOURCE_FORMATS
+        self.fields['format_type'].queryset = get_resource_formats()
 
     def clean(self):
         redis_key = self.cleaned_data.get('redis_key')
         if redis_key:
             data = RedisHandler().retreive(redis_key)
-            self.filename = data['filename']  # `filename` MUST exist.
-            file_size = data['size']
+            if is_other_node(data):
+                raise ValidationError(NODE_ERROR_MESSAGE.format(name=data['name']))
+
+            # Le fichier est désigné par sa clé dans le stockage, quel que soit le nœud
+            storage = Upload._meta.get_field('file_path').storage
+            storage_key = data.get('storage_key', data['name'])
+            self.filename = data.get('filename')
 
-            if not os.path.exists(self.filename) and \
-               not os.path.isfile(self.filename) and \
-               not os.path.getsize(self.filename) == file_size:
+            if not storage.exists(storage_key) or storage.size(storage_key) != data['size']:
                 raise ValidationError(
                     (
                         "Le fichier {name} semble perdu dans des profondeurs insondables."
@@ -128,41 +152,15 @@ class BaseResourceUploadForm(ModelResourceForm):
         return self.cleaned_data
 
     def save_ckan_resource(self, with_user=None):
-        resource = self.instance
-
-        if with_user:
-            username = with_user.username
-        else:
-            username = resource.dataset.editor.username
-
-        upload = open(self.filename, 'rb')
-
-        data = {
-            'id': str(resource.ckan_id),
-            'url': '',
-            'name': resource.title,
-            'description': resource.description,
-            'lang': resource.language,
-            'data_type': resource.resource_type,
-            'upload': upload,
-            'size': resource.upload.file_path.size,
-            'format': resource.format_type.ckan_format,
-            'mimetype': resource.format_type.mimetype[0],
-            'view_type': resource.format_type.ckan_view,
-            #
-            'api': '{}',
-            'restricted_by_jurisdiction': 'False',
-            'extracting_service': 'False',
-            'crs': '',
-            'restricted': json.dumps({'level': 'public'}),
-        }
-
-        ckan_package = CkanHandler.get_package(str(resource.dataset.ckan_id))
-        apikey = CkanHandler.get_user(username)['apikey']
-        with CkanUserHandler(apikey=apikey) as ckan:
-            ckan.publish_resource(ckan_package, **data)
-
-        upload.close()
+        try:
+            publish_upload(self.instance, filename=self.filename, with_user=with_user)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            # Le fichier est enregistré : la publication sera retentée depuis le stockage
+            logger.warning("Publication of resource \"{pk}\" deferred: {error}".format(
+                pk=self.instance.pk, error=e))
+            publish_later(self.instance.pk, user_pk=with_user and with_user.pk)
 
 
 class CreateResourceUploadForm(BaseResourceUploadForm):
@@ -0,0 +1,157 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import hashlib
+import json
+import random
+import time
+
+from django.conf import settings
+
+from idgo_resource import logger
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+# Durée de validité d'un verrou (secondes) : au-delà, il est considéré comme
+# abandonné par un processus défaillant et peut être repris.
+LOCK_TIMEOUT = getattr(settings, 'RESOURCE_LOCK_TIMEOUT', 600)
+# Durée maximum d'attente d'un verrou détenu par un autre processus (secondes)
+LOCK_WAIT = getattr(settings, 'RESOURCE_LOCK_WAIT', 900)
+# Durée de conservation de la clé d'idempotence de la dernière exécution
+IDEMPOTENCY_EXPIRATION = getattr(settings, 'RESOURCE_IDEMPOTENCY_EXPIRATION', 60*60*24*7)
+
+LOCK_KEY = 'idgo_resource:lock:{name}'
+FENCE_KEY = 'idgo_resource:fence:{name}'
+DONE_KEY = 'idgo_resource:done:{name}'
+
+# Prise du verrou et attribution du jeton de clôture (fencing token), qui
+# croît strictement à chaque prise : un détenteur dont le verrou a expiré
+# détient nécessairement un jeton inférieur à celui du détenteur courant.
+ACQUIRE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return false
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], token, 'PX', ARGV[1])
+return token
+"""
+
+# Libération du verrou par son seul détenteur
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Enregistrement de la clé d'idempotence, refusé si le verrou a été perdu
+MARK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class LockTimeout(Exception):
+    """Le verrou n'a pu être obtenu dans le délai imparti."""
+
+
+class LockLost(Exception):
+    """Le verrou a expiré et a été repris par un autre processus."""
+
+
+def idempotency_key(content, metadata):
+    """Dériver une clé d'idempotence de l'empreinte du contenu et des métadonnées."""
+    payload = json.dumps(
+        {'content': content, 'metadata': metadata}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def forget(name):
+    """Oublier la dernière exécution aboutie : la suivante aura lieu même à l'identique."""
+    RedisHandler().client.delete(DONE_KEY.format(name=name))
+
+
+class ResourceLock(object):
+    """Verrou distribué (REDIS) sur une ressource, assorti d'un jeton de clôture.
+
+    S'utilise comme gestionnaire de contexte ; les exécutions concurrentes
+    sur la même ressource sont sérialisées. À l'intérieur du verrou, l'appelant
+    relit l'état courant de la ressource et en dérive une clé d'idempotence :
+    une exécution dont la clé est celle de la dernière exécution aboutie est
+    sans objet (`is_done`), ce qui fusionne les tâches en double.
+    """
+
+    def __init__(self, name, timeout=LOCK_TIMEOUT, wait=LOCK_WAIT, interval=0.2):
+        self.name = name
+        self.timeout = timeout
+        self.wait = wait
+        self.interval = interval
+        self.token = None
+
+        redis = RedisHandler()
+        self.client = redis.client
+        self.acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+        self.release_script = self.client.register_script(RELEASE_SCRIPT)
+        self.mark_script = self.client.register_script(MARK_SCRIPT)
+
+        self.lock_key = LOCK_KEY.format(name=name)
+        self.fence_key = FENCE_KEY.format(name=name)
+        self.done_key = DONE_KEY.format(name=name)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait
+        while True:
+            token = self.acquire_script(
+                keys=[self.lock_key, self.fence_key], args=[int(self.timeout * 1000)])
+            if token:
+                self.token = str(token)
+                return self.token
+            if time.monotonic() >= deadline:
+                raise LockTimeout("Lock \"{name}\" is held by another process.".format(name=self.name))
+            # Attente aléatoire pour ne pas réveiller tous les candidats en même temps
+            time.sleep(self.interval * (1 + random.random()))
+
+    def release(self):
+        if self.token and not self.release_script(keys=[self.lock_key], args=[self.token]):
+            logger.warning("Lock \"{name}\" expired before being released.".format(name=self.name))
+        self.token = None
+
+    def verify(self):
+        """S'assurer que le verrou est toujours détenu, avant une écriture externe."""
+        if self.client.get(self.lock_key) != self.token:
+            raise LockLost("Lock \"{name}\" (token {token}) has been lost.".format(
+                name=self.name, token=self.token))
+
+    def is_done(self, key):
+        return self.client.get(self.done_key) == key
+
+    def mark_done(self, key):
+        if not self.mark_script(
+                keys=[self.lock_key, self.done_key],
+                args=[self.token, key, IDEMPOTENCY_EXPIRATION]):
+            raise LockLost("Lock \"{name}\" (token {token}) has been lost.".format(
+                name=self.name, token=self.token))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,314 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from idgo_resource import benchmark
+from idgo_resource.ckan.store import content_type
+from idgo_resource.ckan.store import index_directory
+from idgo_resource.ckan.store import iterate
+from idgo_resource.ckan.store import write_index
+from idgo_resource import compression
+from idgo_resource.forms.ftp import FTP_DIR
+from idgo_resource.forms.ftp import FTP_UPLOADS_DIR
+from idgo_resource.forms.ftp import FTP_USER_PREFIX
+from idgo_resource import profiling
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+STAGES = (
+    'tree', 'index', 'iterate', 'sniff', 'redis', 'profile', 'compress',
+    'emit', 'create', 'emit_ftp', 'create_ftp', 'publish', 'synchronize',
+)
+
+# Étapes appelant l'API CKAN : les ressources créées dans CKAN ne sont pas
+# supprimées (les lignes sont annulées, `post_delete` n'est pas émis).
+CKAN_STAGES = ('publish', 'synchronize')
+
+REDIS_KEY_RE = re.compile(r'name="redis_key"[^>]*value="([0-9a-f-]+)"|value="([0-9a-f-]+)"[^>]*name="redis_key"')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+
+    help = "Mesurer les étapes du traitement des ressources (émission, création, publication)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=100,
+                            help="Nombre de fichiers générés (1 à 100000).")
+        parser.add_argument('--size', default='1K',
+                            help="Taille de chaque fichier généré (ex. 1K, 20M, 2G).")
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--stages', nargs='+', choices=STAGES,
+                            default=[name for name in STAGES if name not in CKAN_STAGES],
+                            help="Étapes mesurées (par défaut, toutes sauf publish et synchronize).")
+        parser.add_argument('--dataset', type=int,
+                            help="Jeu de données utilisé par les étapes emit, create et publish.")
+        parser.add_argument('--username',
+                            help="Utilisateur connecté pour les étapes emit et create "
+                                 "(ainsi que leurs variantes FTP).")
+        parser.add_argument('--resource', type=int,
+                            help="Ressource magasin utilisée par l'étape synchronize.")
+        parser.add_argument('--ckan-stub-port', type=int,
+                            help="Démarrer une API CKAN locale sur ce port "
+                                 "(CKAN_URL doit pointer vers http://127.0.0.1:<port>/).")
+        parser.add_argument('--against-real-ckan', action='store_true',
+                            help="Autoriser les étapes publish et synchronize sans l'API CKAN locale "
+                                 "(les ressources créées dans CKAN ne sont pas supprimées).")
+        parser.add_argument('--json', action='store_true', help="Rapport au format JSON.")
+
+    def handle(self, *args, **options):
+        ckan_stages = [name for name in options['stages'] if name in CKAN_STAGES]
+        if ckan_stages and not options['ckan_stub_port'] and not options['against_real_ckan']:
+            raise CommandError(
+                "Les étapes {stages} nécessitent --ckan-stub-port (ou --against-real-ckan).".format(
+                    stages=', '.join(ckan_stages)))
+
+        self.options = options
+        self.results = []
+        self.location = tempfile.mkdtemp(prefix='idgo_resource_benchmark_')
+        self.ftp_location = None
+        try:
+            if options['ckan_stub_port']:
+                with benchmark.ckan_stub(options['ckan_stub_port']) as url:
+                    self.stderr.write("CKAN stub listening on {url}".format(url=url))
+                    self.run_stages()
+            else:
+                self.run_stages()
+        finally:
+            shutil.rmtree(self.location, ignore_errors=True)
+            if self.ftp_location:
+                shutil.rmtree(self.ftp_location, ignore_errors=True)
+        self.report()
+
+    def run_stages(self):
+        stages = self.options['stages']
+        self.filenames = []
+        for name in STAGES:
+            if name in stages or (name == 'tree' and not self.filenames):
+                stage = benchmark.Stage(name)
+                getattr(self, 'stage_{name}'.format(name=name))(stage)
+                if name in stages:
+                    self.results.append(stage.report())
+
+    # Étapes
+    # ======
+
+    def stage_tree(self, stage):
+        size = benchmark.parse_size(self.options['size'])
+        with stage.measure():
+            self.filenames = benchmark.generate_tree(self.location, self.options['files'], size)
+
+    def stage_index(self, stage):
+        for _ in range(self.options['iterations']):
+            with stage.measure():
+                write_index(self.location, index_directory(self.location))
+
+    def stage_iterate(self, stage):
+        for _ in range(self.options['iterations']):
+            with stage.measure():
+                iterate(self.location, base_url='/benchmark/')
+
+    def stage_sniff(self, stage):
+        for filename in self.filenames:
+            with stage.measure():
+                content_type(filename)
+
+    def stage_redis(self, stage):
+        redis = RedisHandler()
+        for _ in range(self.options['iterations']):
+            with stage.measure():
+                key = redis.create(user=None, name='benchmark')
+                redis.retreive(key)
+                redis.update(key, resource_pk=None)
+                redis.publish(key, stage='benchmark', progress=0)
+            redis.client.delete(key)
+
+    def stage_profile(self, stage):
+        for _ in range(self.options['iterations']):
+            with stage.measure():
+                profiling.profile(self.filenames[0])
+
+    def stage_compress(self, stage):
+        for _ in range(self.options['iterations']):
+            compression.invalidate(self.filenames[0])
+            with stage.measure():
+                compression.compress(self.filenames[0])
+
+    def get_client(self):
+        if not self.options['dataset'] or not self.options['username']:
+            raise CommandError("Les étapes emit et create nécessitent --dataset et --username.")
+        user = get_user_model().objects.get(username=self.options['username'])
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def ftp_file(self):
+        """Copier un fichier généré dans le répertoire FTP de l'utilisateur."""
+        if not self.ftp_location:
+            sub_dir = '{prefix}{username}'.format(prefix=FTP_USER_PREFIX, username=self.options['username'])
+            directory = os.path.join(FTP_DIR, sub_dir, FTP_UPLOADS_DIR)
+            os.makedirs(directory, exist_ok=True)
+            self.ftp_location = tempfile.mkdtemp(prefix='idgo_resource_benchmark_', dir=directory)
+            self.ftp_filename = os.path.join(self.ftp_location, os.path.basename(self.filenames[0]))
+            shutil.copyfile(self.filenames[0], self.ftp_filename)
+        return self.ftp_filename
+
+    def post(self, client, url, data, stage=None):
+        if stage:
+            with stage.measure():
+                return client.post(url, data)
+        return client.post(url, data)
+
+    def emit(self, client, stage=None):
+        url = reverse('idgo_resource:emit_resource_upload', kwargs={'dataset_id': self.options['dataset']})
+        with open(self.filenames[0], 'rb') as f:
+            response = self.post(client, url, {'file_path': f}, stage)
+        return self.redis_key(response)
+
+    def emit_ftp(self, client, stage=None):
+        url = reverse('idgo_resource:emit_resource_ftp', kwargs={'dataset_id': self.options['dataset']})
+        response = self.post(client, url, {'file_path': self.ftp_file()}, stage)
+        return self.redis_key(response)
+
+    def redis_key(self, response):
+        match = REDIS_KEY_RE.search(response.content.decode('utf-8'))
+        if not match:
+            raise CommandError("La réponse de l'émission ne contient pas de clé REDIS.")
+        return match.group(1) or match.group(2)
+
+    def create(self, client, redis_key, stage, viewname='create_resource_upload'):
+        url = reverse('idgo_resource:{}'.format(viewname), kwargs={'dataset_id': self.options['dataset']})
+        data = {
+            'title': 'Benchmark',
+            'language': 'french',
+            'resource_type': 'raw',
+            'format_type': self.csv_format().pk,
+            'redis_key': redis_key,
+        }
+        self.post(client, url, data, stage)
+
+    def csv_format(self):
+        from idgo_resource.models import ResourceFormats
+        return ResourceFormats.objects.filter(extension='csv').order_by('pk').first()
+
+    def in_rollback(self, func, *args):
+        """Exécuter `func` dans une transaction annulée, puis supprimer les fichiers créés.
+
+        Les fichiers des ressources FTP ne sont pas copiés : seul le répertoire
+        FTP généré est supprimé, à la fin de la commande.
+        """
+        from idgo_resource.models import Upload
+        last = Upload.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        names = []
+        try:
+            with transaction.atomic():
+                func(*args)
+                names = list(Upload.objects.filter(pk__gt=last).values_list('file_path', flat=True))
+                raise Rollback()
+        except Rollback:
+            pass
+        storage = Upload._meta.get_field('file_path').storage
+        for name in names:
+            if name and storage.exists(name):
+                compression.invalidate(storage.path(name))
+                storage.delete(name)
+
+    def stage_emit(self, stage):
+        client = self.get_client()
+        for _ in range(self.options['iterations']):
+            self.in_rollback(self.emit, client, stage)
+
+    def stage_create(self, stage):
+        client = self.get_client()
+        for _ in range(self.options['iterations']):
+            self.in_rollback(lambda: self.create(client, self.emit(client), stage))
+
+    def stage_emit_ftp(self, stage):
+        client = self.get_client()
+        for _ in range(self.options['iterations']):
+            self.in_rollback(self.emit_ftp, client, stage)
+
+    def stage_create_ftp(self, stage):
+        client = self.get_client()
+        for _ in range(self.options['iterations']):
+            self.in_rollback(lambda: self.create(
+                client, self.emit_ftp(client), stage, viewname='create_resource_ftp'))
+
+    def stage_publish(self, stage):
+        from idgo_admin.models import Dataset
+        from idgo_resource.ckan import publish_upload
+        from idgo_resource.models import Resource
+        from idgo_resource.models import Upload
+
+        if not self.options['dataset']:
+            raise CommandError("L'étape publish nécessite --dataset.")
+        dataset = Dataset.objects.get(pk=self.options['dataset'])
+
+        def publish():
+            resource = Resource.objects.create(
+                dataset=dataset, title='Benchmark', format_type=self.csv_format())
+            upload = Upload(resource=resource)
+            with open(self.filenames[0], 'rb') as f:
+                upload.file_path.save(os.path.basename(self.filenames[0]), File(f))
+            with stage.measure():
+                publish_upload(resource)
+
+        for _ in range(self.options['iterations']):
+            self.in_rollback(publish)
+
+    def stage_synchronize(self, stage):
+        from idgo_resource.ckan import synchronize_store
+        from idgo_resource.models import Resource
+
+        if not self.options['resource']:
+            raise CommandError("L'étape synchronize nécessite --resource.")
+        resource = Resource.objects.get(pk=self.options['resource'])
+        for _ in range(self.options['iterations']):
+            with stage.measure():
+                synchronize_store(resource)
+
+    # Rapport
+    # =======
+
+    def report(self):
+        if self.options['json']:
+            self.stdout.write(json.dumps(self.results, indent=2))
+            return
+        line = '{stage:<12} {runs:>6} {p50_ms:>10.2f} {p95_ms:>10.2f} {p99_ms:>10.2f} ' \
+               '{max_ms:>10.2f} {queries:>8.1f} {peak_rss_mb:>10.1f} {rss_growth_mb:>10.1f}'
+        self.stdout.write(
+            '{:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+                'stage', 'runs', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)',
+                'queries', 'rss (Mo)', '+rss (Mo)'))
+        for result in self.results:
+            self.stdout.write(line.format(**result))
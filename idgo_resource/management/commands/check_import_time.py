@@ -0,0 +1,93 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+
+# Budget (en millisecondes) du temps d'import des modules `idgo_resource`
+IMPORT_TIME_BUDGET = getattr(settings, 'RESOURCE_IMPORT_TIME_BUDGET', 500)
+
+# Modules chargés au démarrage des processus web et des workers Celery
+TARGETS = {
+    'web': 'idgo_resource.urls',
+    'worker': 'idgo_resource.tasks',
+}
+
+SCRIPT = 'import django; django.setup(); import {module}'
+
+
+def parse_importtime(output, package='idgo_resource'):
+    """Retourner le temps d'import cumulé (µs) des modules de `package`.
+
+    La sortie de `python -X importtime` liste chaque module après ses
+    dépendances, indentées de deux espaces par niveau ; seuls les modules
+    de `package` qui ne sont pas importés par un autre module de `package`
+    sont comptés, afin de ne pas compter deux fois le même temps.
+    """
+    lines = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, int(cumulative), name.strip()))
+
+    total = 0
+    stack = []
+    for depth, cumulative, name in reversed(lines):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        ours = name == package or name.startswith(package + '.')
+        if ours and not any(parent for _, parent in stack):
+            total += cumulative
+        stack.append((depth, ours))
+    return total
+
+
+class Command(BaseCommand):
+
+    help = "Vérifier le temps d'import des modules au démarrage des processus web et worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET,
+                            help="Budget en millisecondes (défaut : RESOURCE_IMPORT_TIME_BUDGET).")
+        parser.add_argument('--target', choices=sorted(TARGETS), nargs='+', default=sorted(TARGETS))
+
+    def handle(self, *args, **options):
+        exceeded = []
+        for target in options['target']:
+            module = TARGETS[target]
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', SCRIPT.format(module=module)],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                raise CommandError("Unable to import \"{module}\":\n{error}".format(
+                    module=module, error=process.stderr[-2000:]))
+
+            elapsed = parse_importtime(process.stderr) / 1000
+            self.stdout.write("{target}: {elapsed:.1f} ms (budget {budget:.0f} ms)".format(
+                target=target, elapsed=elapsed, budget=options['budget']))
+            if elapsed > options['budget']:
+                exceeded.append(target)
+
+        if exceeded:
+            raise CommandError("Import time budget exceeded: {}.".format(', '.join(exceeded)))
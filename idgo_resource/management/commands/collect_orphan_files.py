@@ -0,0 +1,96 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from functools import partial
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from idgo_resource.ckan.store import DIRECTORY_STORAGE
+from idgo_resource import orphans
+from idgo_resource.storage import is_local
+from idgo_resource.storage import resource_storage
+
+
+FTP_DIR = getattr(settings, 'FTP_DIR', None)
+
+
+class Command(BaseCommand):
+
+    help = "Lister et supprimer les fichiers qui ne sont plus référencés par aucune ressource."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help="Supprimer les fichiers orphelins (par défaut, ils sont seulement listés).")
+        parser.add_argument('--grace-period', type=int, default=orphans.GC_GRACE_PERIOD,
+                            help="Âge minimum, en secondes, d'un fichier orphelin supprimé.")
+        parser.add_argument('--batch-size', type=int, default=orphans.GC_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=orphans.GC_PAUSE,
+                            help="Pause entre deux lots de suppressions (secondes).")
+        parser.add_argument('--skip-store', action='store_true',
+                            help="Ne pas traiter les répertoires de stockage des ressources supprimées.")
+        parser.add_argument('--ftp', action='store_true',
+                            help="Traiter aussi les comptes FTP : les fichiers déposés mais jamais "
+                                 "importés y sont considérés comme orphelins.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        grace_period = options['grace_period']
+
+        references = orphans.collect_references()
+        self.stdout.write("{count} fichier(s) référencé(s).".format(count=len(references)))
+
+        storage = resource_storage
+        recheck = partial(orphans.referenced_now, storage=storage)
+        if is_local(storage):
+            found = orphans.scan_directory(
+                storage.location, references, grace_period, exclude=(DIRECTORY_STORAGE, FTP_DIR))
+            self.collect("Fichiers des ressources", found, os.remove, recheck)
+        else:
+            found = orphans.scan_storage(storage, references, grace_period)
+            self.collect("Fichiers des ressources", found, storage.delete, recheck)
+
+        if not options['skip_store']:
+            found = orphans.scan_store(grace_period)
+            self.collect("Répertoires de stockage", found, shutil.rmtree)
+
+        if options['ftp'] and FTP_DIR:
+            found = orphans.scan_directory(FTP_DIR, references, grace_period)
+            self.collect("Comptes FTP", found, os.remove, orphans.referenced_now)
+
+    def collect(self, label, found, remove, recheck=None):
+        items = []
+        total = 0
+        for name, size in found:
+            items.append((name, size))
+            total += size
+            if self.options['verbosity'] > 1:
+                self.stdout.write('{size:>10}  {name}'.format(size=filesizeformat(size), name=name))
+
+        self.stdout.write("{label} : {count} orphelin(s), {size}.".format(
+            label=label, count=len(items), size=filesizeformat(total)))
+        if not self.options['delete'] or not items:
+            return
+
+        count, size = orphans.delete(
+            items, remove, recheck=recheck,
+            batch_size=self.options['batch_size'], pause=self.options['pause'])
+        self.stdout.write(self.style.SUCCESS("{label} : {count} supprimé(s), {size} libéré(s).".format(
+            label=label, count=count, size=filesizeformat(size))))
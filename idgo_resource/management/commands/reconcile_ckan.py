@@ -0,0 +1,69 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from collections import Counter
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from idgo_resource import reconciliation
+
+
+class Command(BaseCommand):
+
+    help = "Comparer les ressources aux ressources CKAN et corriger les écarts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, nargs='+', help="Limiter à ces jeux de données.")
+        parser.add_argument('--workers', type=int, default=reconciliation.RECONCILIATION_WORKERS,
+                            help="Nombre de paquets CKAN lus simultanément.")
+        parser.add_argument('--batch-size', type=int, default=reconciliation.RECONCILIATION_BATCH_SIZE,
+                            help="Nombre de jeux de données par lot.")
+        parser.add_argument('--repair', action='store_true',
+                            help="Publier de nouveau les ressources absentes ou divergentes.")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="Supprimer de CKAN les ressources inconnues de l'application.")
+        parser.add_argument('--json', action='store_true', help="Rapport au format JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            entries = reconciliation.reconcile(
+                datasets=options['dataset'],
+                repair=options['repair'],
+                delete_orphans=options['delete_orphans'],
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+            )
+        except reconciliation.ReconciliationError as e:
+            raise CommandError(str(e))
+
+        if options['json']:
+            self.stdout.write(json.dumps(entries, indent=2, default=str))
+            return
+
+        for entry in entries:
+            self.stdout.write('{kind:<16} dataset={dataset} resource={resource} ckan_id={ckan_id}{repaired} {details}'.format(
+                repaired=entry.get('repaired') and ' [corrigé]' or '',
+                details=json.dumps(entry['details'], ensure_ascii=False, default=str),
+                **{key: value for key, value in entry.items() if key not in ('details', 'repaired')}))
+
+        counts = Counter(entry['kind'] for entry in entries)
+        summary = ', '.join('{kind} : {count}'.format(kind=kind, count=count) for kind, count in sorted(counts.items()))
+        self.stdout.write(self.style.SUCCESS(
+            "{count} écart(s) constaté(s){summary}.".format(
+                count=len(entries), summary=summary and ' ({})'.format(summary) or '')))
@@ -0,0 +1,41 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from idgo_resource.usage import reconcile
+
+
+class Command(BaseCommand):
+
+    help = "Recalculer les compteurs d'utilisation du stockage à partir des fichiers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Afficher les écarts sans corriger les compteurs.")
+
+    def handle(self, *args, **options):
+        drift = reconcile(dry_run=options['dry_run'])
+        for scope, object_id, current, expected in drift:
+            self.stdout.write('{scope}:{object_id} {current} -> {expected}'.format(
+                scope=scope, object_id=object_id,
+                current=filesizeformat(current), expected=filesizeformat(expected)))
+
+        action = options['dry_run'] and "à corriger" or "corrigé(s)"
+        self.stdout.write(self.style.SUCCESS(
+            "{count} compteur(s) {action}.".format(count=len(drift), action=action)))
@@ -0,0 +1,149 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import time
+
+from django.contrib.postgres.fields import JSONField
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import IntegerField
+from django.db.models import Value
+from django.db.models import When
+from django.utils import timezone
+
+from idgo_resource.bulk import find_format
+from idgo_resource import detection
+from idgo_resource.models import Ftp
+from idgo_resource.models import Resource
+from idgo_resource.models import ResourceFormats
+from idgo_resource.models import Upload
+
+
+MODELS = {
+    'upload': Upload,
+    'ftp': Ftp,
+}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+
+    help = "Détecter de nouveau le format et les métadonnées des fichiers des ressources."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), nargs='+', default=sorted(MODELS))
+        parser.add_argument('--dataset', type=int, nargs='+', help="Limiter à ces jeux de données.")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Nombre de fichiers lus simultanément.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Nombre de fichiers par lot d'écriture en base.")
+        parser.add_argument('--republish', action='store_true',
+                            help="Publier de nouveau dans CKAN les ressources modifiées.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Afficher les modifications sans les enregistrer.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.formats = list(ResourceFormats.objects.order_by('pk'))
+        self.counts = {'files': 0, 'formats': 0, 'metadata': 0, 'failed': 0}
+        changed = set()
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            for name in options['model']:
+                Model = MODELS[name]
+                queryset = Model.objects.filter(resource__isnull=False) \
+                    .exclude(file_path='').exclude(file_path__isnull=True) \
+                    .select_related('resource')
+                if options['dataset']:
+                    queryset = queryset.filter(resource__dataset__in=options['dataset'])
+
+                for chunk in chunked(queryset.order_by('pk').iterator(), options['batch_size']):
+                    results = executor.map(self.detect, chunk)
+                    changed |= self.apply(Model, list(zip(chunk, results)))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "{files} fichier(s) analysé(s) en {elapsed:.1f} s ({rate:.1f}/s) : "
+            "{formats} format(s) et {metadata} métadonnée(s) corrigé(s), {failed} échec(s).".format(
+                elapsed=elapsed, rate=elapsed and self.counts['files'] / elapsed or 0, **self.counts)))
+
+        if options['republish'] and changed and not options['dry_run']:
+            from idgo_resource.tasks import publish_resource
+            for pk in sorted(changed):
+                publish_resource.delay(pk)
+            self.stdout.write("{count} ressource(s) à publier de nouveau.".format(count=len(changed)))
+
+    def detect(self, instance):
+        try:
+            return detection.detect(instance.file_path)
+        except Exception as e:
+            self.stderr.write("{name} : {error}".format(name=instance.file_path.name, error=e))
+            return None
+        finally:
+            close_old_connections()
+
+    def apply(self, Model, results):
+        """Enregistrer les écarts d'un lot en une requête par table."""
+        formats = {}
+        metadata = {}
+        for instance, detected in results:
+            self.counts['files'] += 1
+            if detected is None:
+                self.counts['failed'] += 1
+                continue
+            format_type = find_format(self.formats, detected['content_type'], instance.file_path.name)
+            format_type_id = format_type and format_type.pk
+            if format_type_id and format_type_id != instance.resource.format_type_id:
+                formats[instance.resource_id] = format_type_id
+                self.stdout.write("{name} : format {old} -> {new}".format(
+                    name=instance.file_path.name, old=instance.resource.format_type_id, new=format_type_id))
+            if detected != (instance.metadata or {}):
+                metadata[instance.pk] = detected
+
+        self.counts['formats'] += len(formats)
+        self.counts['metadata'] += len(metadata)
+        if self.options['dry_run'] or not (formats or metadata):
+            return set()
+
+        # Équivalent d'un `bulk_update` : une seule requête UPDATE ... CASE par table
+        with transaction.atomic():
+            if formats:
+                Resource.objects.filter(pk__in=formats).update(
+                    format_type=Case(
+                        *[When(pk=pk, then=Value(value)) for pk, value in formats.items()],
+                        output_field=IntegerField()),
+                    last_update=timezone.now())
+            if metadata:
+                Model.objects.filter(pk__in=metadata).update(
+                    metadata=Case(
+                        *[When(pk=pk, then=Value(value, output_field=JSONField()))
+                          for pk, value in metadata.items()],
+                        output_field=JSONField()))
+        return set(formats) | {instance.resource_id for instance, _ in results if instance.pk in metadata}
@@ -0,0 +1,78 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from datetime import datetime
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from idgo_resource import retry
+
+
+class Command(BaseCommand):
+
+    help = "Consulter, relancer ou vider la file des tâches en échec."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'show', 'replay', 'purge'])
+        parser.add_argument('ids', nargs='*', help="Identifiants des entrées (show, replay).")
+        parser.add_argument('--all', action='store_true', help="Relancer toutes les entrées.")
+        parser.add_argument('--task', help="Ne considérer que les entrées de cette tâche.")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        entries = [
+            entry for entry in retry.entries()
+            if not options['task'] or entry['task'] == options['task']
+        ]
+
+        if action == 'list':
+            for entry in entries:
+                self.stdout.write('{id}  {date}  {task}{args}  [{exception}] {error}'.format(
+                    date=datetime.fromtimestamp(entry['failed_at']).strftime('%Y-%m-%d %H:%M:%S'),
+                    args=tuple(entry['args']), **entry))
+            self.stdout.write("{count} entrée(s).".format(count=len(entries)))
+
+        elif action == 'show':
+            for entry_id in options['ids']:
+                entry = retry.get(entry_id)
+                if not entry:
+                    raise CommandError("Entrée \"{id}\" introuvable.".format(id=entry_id))
+                self.stdout.write(json.dumps(entry, indent=2, ensure_ascii=False))
+
+        elif action == 'replay':
+            if not options['ids'] and not options['all']:
+                raise CommandError("Indiquez les identifiants des entrées à relancer ou --all.")
+            entry_ids = options['all'] and [entry['id'] for entry in entries] or options['ids']
+            replayed = 0
+            for entry_id in entry_ids:
+                if retry.replay(entry_id):
+                    replayed += 1
+                else:
+                    self.stderr.write("Entrée \"{id}\" introuvable.".format(id=entry_id))
+            self.stdout.write(self.style.SUCCESS(
+                "{count} tâche(s) relancée(s).".format(count=replayed)))
+
+        elif action == 'purge':
+            if options['task']:
+                for entry in entries:
+                    retry.remove(entry['id'])
+            else:
+                retry.purge()
+            self.stdout.write(self.style.SUCCESS(
+                "{count} entrée(s) supprimée(s).".format(count=len(entries))))
@@ -0,0 +1,221 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import close_old_connections
+
+from idgo_resource.ckan import synchronize_store
+from idgo_resource.locks import forget
+from idgo_resource.models import Resource
+from idgo_resource import retry
+
+
+class Checkpoint(object):
+    """Point de reprise : plus grand identifiant en deçà duquel tout est traité.
+
+    Les ressources sont parcourues par identifiant croissant mais se terminent
+    dans le désordre ; le point de reprise n'avance que lorsque toutes les
+    ressources précédentes sont terminées.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.pending = OrderedDict()
+        self.position = 0
+        if filename and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                self.position = json.load(f)['position']
+
+    def start(self, pk):
+        self.pending[pk] = False
+
+    def done(self, pk):
+        self.pending[pk] = True
+        while self.pending and next(iter(self.pending.values())):
+            self.position, _ = self.pending.popitem(last=False)
+
+    def save(self):
+        if not self.filename:
+            return
+        tmp = '{}.tmp'.format(self.filename)
+        with open(tmp, 'w') as f:
+            json.dump({'position': self.position, 'saved_at': time.time()}, f)
+        os.replace(tmp, self.filename)
+
+
+class Command(BaseCommand):
+
+    help = "Resynchroniser dans CKAN les pages des ressources magasin."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['thread', 'celery'], default='thread',
+                            help="Traitement local par un pool de threads ou par les workers Celery.")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Nombre de synchronisations simultanées (mode thread).")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Nombre de tâches par groupe Celery (mode celery).")
+        parser.add_argument('--dataset', type=int, nargs='+', help="Limiter à ces jeux de données.")
+        parser.add_argument('--resource', type=int, nargs='+', help="Limiter à ces ressources.")
+        parser.add_argument('--checkpoint',
+                            help="Fichier de point de reprise, relu au lancement suivant.")
+        parser.add_argument('--force', action='store_true',
+                            help="Publier même les pages inchangées depuis la dernière synchronisation "
+                                 "(après une migration de CKAN par exemple).")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Lister les ressources sans les synchroniser.")
+        parser.add_argument('--progress-every', type=float, default=5,
+                            help="Intervalle d'affichage de l'avancement (secondes).")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.checkpoint = Checkpoint(options['checkpoint'])
+
+        queryset = Resource.objects.filter(storageresource__isnull=False, pk__gt=self.checkpoint.position)
+        if options['dataset']:
+            queryset = queryset.filter(dataset__in=options['dataset'])
+        if options['resource']:
+            queryset = queryset.filter(pk__in=options['resource'])
+        self.total = queryset.count()
+        rows = queryset.order_by('pk').values_list('pk', 'ckan_id').iterator()
+
+        if self.checkpoint.position:
+            self.stdout.write("Reprise après la ressource {pk}.".format(pk=self.checkpoint.position))
+        self.stdout.write("{count} ressource(s) magasin à synchroniser.".format(count=self.total))
+
+        self.counts = {'synchronized': 0, 'unchanged': 0, 'failed': 0}
+        self.durations = []
+        self.started = self.reported = time.monotonic()
+
+        if options['dry_run']:
+            for pk, ckan_id in rows:
+                self.stdout.write('{pk}  {ckan_id}'.format(pk=pk, ckan_id=ckan_id))
+            return
+
+        try:
+            if options['mode'] == 'celery':
+                self.dispatch(rows)
+            else:
+                self.run(rows)
+        finally:
+            self.checkpoint.save()
+        self.report()
+
+    def synchronize(self, pk, ckan_id):
+        started = time.monotonic()
+        try:
+            if self.options['force']:
+                forget(str(ckan_id))
+            published = synchronize_store(Resource(pk=pk, ckan_id=ckan_id))
+            return pk, published and 'synchronized' or 'unchanged', time.monotonic() - started
+        except Exception as e:
+            # L'entrée peut être relancée avec la commande `resource_dlq`
+            retry.bury('idgo_resource.synchronize_store', [pk], {}, e, 1)
+            self.stderr.write("Ressource {pk} : {error}".format(pk=pk, error=e))
+            return pk, 'failed', time.monotonic() - started
+        finally:
+            close_old_connections()
+
+    def run(self, rows):
+        workers = max(1, self.options['workers'])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for pk, ckan_id in rows:
+                # Soumission bornée : le parcours avance au rythme des synchronisations
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.collect(finished)
+                self.checkpoint.start(pk)
+                pending.add(executor.submit(self.synchronize, pk, ckan_id))
+            finished, _ = wait(pending)
+            self.collect(finished)
+
+    def collect(self, futures):
+        for future in futures:
+            pk, outcome, duration = future.result()
+            self.counts[outcome] += 1
+            self.durations.append(duration)
+            self.checkpoint.done(pk)
+        self.progress()
+
+    def dispatch(self, rows):
+        from celery import group
+        from idgo_resource.tasks import synchronize_store as task
+
+        chunk = []
+        for pk, ckan_id in rows:
+            chunk.append(pk)
+            if len(chunk) >= self.options['chunk_size']:
+                self.send(group, task, chunk)
+                chunk = []
+        if chunk:
+            self.send(group, task, chunk)
+
+    def send(self, group, task, pks):
+        group(task.si(pk, force=self.options['force']) for pk in pks).apply_async()
+        # En mode Celery, le point de reprise suit les tâches envoyées
+        for pk in pks:
+            self.checkpoint.start(pk)
+            self.checkpoint.done(pk)
+        self.counts['synchronized'] += len(pks)
+        self.progress()
+
+    def processed(self):
+        return sum(self.counts.values())
+
+    def progress(self):
+        now = time.monotonic()
+        if now - self.reported < self.options['progress_every']:
+            return
+        self.reported = now
+        self.checkpoint.save()
+        processed = self.processed()
+        rate = processed / (now - self.started)
+        remaining = rate and (self.total - processed) / rate or 0
+        self.stdout.write("{processed}/{total} ({rate:.1f}/s, {failed} échec(s), reste ~{remaining:.0f} s)".format(
+            processed=processed, total=self.total, rate=rate,
+            failed=self.counts['failed'], remaining=remaining))
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        processed = self.processed()
+        if self.options['mode'] == 'celery':
+            self.stdout.write(self.style.SUCCESS(
+                "{count} tâche(s) envoyée(s) en {elapsed:.1f} s.".format(count=processed, elapsed=elapsed)))
+            return
+
+        durations = sorted(self.durations)
+        p50 = durations and durations[len(durations) // 2] or 0
+        p95 = durations and durations[min(len(durations) - 1, int(len(durations) * 0.95))] or 0
+        self.stdout.write(self.style.SUCCESS(
+            "{processed} ressource(s) en {elapsed:.1f} s ({rate:.1f}/s) : "
+            "{synchronized} synchronisée(s), {unchanged} inchangée(s), {failed} échec(s). "
+            "Durée par ressource : p50 {p50:.2f} s, p95 {p95:.2f} s.".format(
+                processed=processed, elapsed=elapsed, rate=elapsed and processed / elapsed or 0,
+                p50=p50, p95=p95, **self.counts)))
+        if self.counts['failed']:
+            raise CommandError(
+                "{count} échec(s), consultables avec la commande resource_dlq.".format(
+                    count=self.counts['failed']))
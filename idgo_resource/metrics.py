@@ -0,0 +1,199 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from contextlib import ContextDecorator
+import os
+import time
+
+from django.conf import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+try:
+    import statsd
+except ImportError:
+    statsd = None
+
+
+# Valeurs possibles : 'prometheus', 'statsd' ou None (désactivé)
+METRICS_BACKEND = getattr(settings, 'RESOURCE_METRICS_BACKEND', None)
+METRICS_PREFIX = getattr(settings, 'RESOURCE_METRICS_PREFIX', 'idgo_resource')
+METRICS_STATSD_HOST = getattr(settings, 'RESOURCE_METRICS_STATSD_HOST', 'localhost')
+METRICS_STATSD_PORT = getattr(settings, 'RESOURCE_METRICS_STATSD_PORT', 8125)
+# Accès au point d'accès Prometheus (refusé si rien n'est configuré, hors
+# administrateurs connectés) : jeton transmis dans l'en-tête
+# `Authorization: Bearer <jeton>` ou adresses autorisées.
+# ATTENTION : derrière un proxy local (nginx), REMOTE_ADDR vaut l'adresse du
+# proxy (127.0.0.1) pour toutes les requêtes ; les adresses autorisées ne
+# doivent alors pas inclure celle du proxy, le jeton est à privilégier.
+METRICS_TOKEN = getattr(settings, 'RESOURCE_METRICS_TOKEN', None)
+METRICS_ALLOWED_ADDRESSES = getattr(settings, 'RESOURCE_METRICS_ALLOWED_ADDRESSES', [])
+# Délai minimal (en secondes) entre deux mesures du nombre de clés REDIS
+METRICS_REDIS_KEYS_INTERVAL = getattr(settings, 'RESOURCE_METRICS_REDIS_KEYS_INTERVAL', 60)
+
+# Sous gunicorn, `prometheus_client` agrège les valeurs des différents
+# processus dans ce répertoire (à vider au démarrage du serveur).
+MULTIPROCESS = 'prometheus_multiproc_dir' in os.environ or 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Définition des métriques : nom -> (type, description, étiquettes)
+DEFINITIONS = {
+    'stage_duration_seconds': (
+        'histogram', "Durée des étapes de traitement des ressources.", ('stage',)),
+    'stage_failures_total': (
+        'counter', "Nombre d'échecs par étape de traitement.", ('stage',)),
+    'bytes_total': (
+        'counter', "Volume de données reçues ou publiées.", ('direction',)),
+    'ckan_request_duration_seconds': (
+        'histogram', "Durée des appels à l'API CKAN.", ('action',)),
+    'ckan_throttle_wait_seconds': (
+        'histogram', "Attente imposée par le limiteur avant un appel à l'API CKAN.", ('action',)),
+    'ckan_concurrency_limit': (
+        'gauge', "Nombre d'appels simultanés à l'API CKAN autorisés.", ('action',)),
+    'dead_letters_total': (
+        'counter', "Nombre de tâches placées dans la file des échecs.", ('task',)),
+    'resource_events_total': (
+        'counter', "Nombre de ressources créées, modifiées ou supprimées.", ('action',)),
+    'redis_keys': (
+        'gauge', "Nombre de clés présentes dans la base REDIS.", ()),
+}
+
+
+class _PrometheusBackend(object):
+
+    def __init__(self):
+        self.metrics = {}
+        for name, (kind, documentation, labelnames) in DEFINITIONS.items():
+            fullname = '{prefix}_{name}'.format(prefix=METRICS_PREFIX, name=name)
+            if kind == 'histogram':
+                metric = prometheus_client.Histogram(
+                    fullname, documentation, labelnames, buckets=DURATION_BUCKETS)
+            elif kind == 'gauge':
+                metric = prometheus_client.Gauge(
+                    fullname, documentation, labelnames, multiprocess_mode='livemax')
+            else:
+                metric = prometheus_client.Counter(fullname, documentation, labelnames)
+            self.metrics[name] = metric
+
+    def _get(self, name, labels):
+        metric = self.metrics[name]
+        return labels and metric.labels(**labels) or metric
+
+    def increment(self, name, value, labels):
+        self._get(name, labels).inc(value)
+
+    def observe(self, name, value, labels):
+        self._get(name, labels).observe(value)
+
+    def gauge(self, name, value, labels):
+        self._get(name, labels).set(value)
+
+
+class _StatsdBackend(object):
+
+    def __init__(self):
+        self.client = statsd.StatsClient(
+            METRICS_STATSD_HOST, METRICS_STATSD_PORT, prefix=METRICS_PREFIX)
+
+    def _name(self, name, labels):
+        return '.'.join([name] + [str(labels[k]) for k in sorted(labels)])
+
+    def increment(self, name, value, labels):
+        self.client.incr(self._name(name, labels), value)
+
+    def observe(self, name, value, labels):
+        self.client.timing(self._name(name, labels), value * 1000)
+
+    def gauge(self, name, value, labels):
+        self.client.gauge(self._name(name, labels), value)
+
+
+def _get_backend():
+    if METRICS_BACKEND == 'prometheus' and prometheus_client:
+        return _PrometheusBackend()
+    if METRICS_BACKEND == 'statsd' and statsd:
+        return _StatsdBackend()
+
+
+# Les métriques sont enregistrées une seule fois par processus
+backend = _get_backend()
+
+
+def increment(name, value=1, **labels):
+    if backend:
+        backend.increment(name, value, labels)
+
+
+def observe(name, value, **labels):
+    if backend:
+        backend.observe(name, value, labels)
+
+
+def gauge(name, value, **labels):
+    if backend:
+        backend.gauge(name, value, labels)
+
+
+class timer(ContextDecorator):
+    """Mesurer la durée d'un bloc ou d'une fonction dans un histogramme.
+
+    S'utilise en gestionnaire de contexte (`with timer(...)`) ou en
+    décorateur (`@timer(...)`). Si `failures` est renseigné, le compteur
+    correspondant est incrémenté lorsqu'une exception est levée.
+    """
+
+    def __init__(self, name, failures=None, **labels):
+        self.name = name
+        self.failures = failures
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def _recreate_cm(self):
+        # Employé en décorateur, chaque appel utilise sa propre instance :
+        # les appels concurrents ne partagent pas `start` ni `elapsed`.
+        return type(self)(self.name, self.failures, **self.labels)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        observe(self.name, self.elapsed, **self.labels)
+        if exc_type and self.failures:
+            increment(self.failures, **self.labels)
+        return False
+
+
+def export():
+    """Retourner les métriques au format texte Prometheus et leur type de contenu.
+
+    Retourne `None` si le backend Prometheus n'est pas actif.
+    """
+    if not isinstance(backend, _PrometheusBackend):
+        return None
+
+    if MULTIPROCESS:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
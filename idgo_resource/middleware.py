@@ -0,0 +1,190 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import base64
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import random
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404
+from django.urls import resolve
+
+try:
+    import pyinstrument
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    pyinstrument = None
+
+from idgo_resource import logger
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+PROFILING_ENABLED = getattr(settings, 'RESOURCE_PROFILING_ENABLED', False)
+# Jeton à fournir dans l'en-tête `X-Resource-Profile` pour profiler une requête
+PROFILING_TOKEN = getattr(settings, 'RESOURCE_PROFILING_TOKEN', None)
+# Proportion de requêtes profilées sans en-tête (0 : aucune)
+PROFILING_SAMPLE_RATE = getattr(settings, 'RESOURCE_PROFILING_SAMPLE_RATE', 0.0)
+# Nombre maximum de profils enregistrés par minute, tous processus confondus
+PROFILING_MAX_PER_MINUTE = getattr(settings, 'RESOURCE_PROFILING_MAX_PER_MINUTE', 10)
+# 'cprofile' (déterministe) ou 'sampling' (échantillonnage, nécessite pyinstrument)
+PROFILING_MODE = getattr(settings, 'RESOURCE_PROFILING_MODE', 'cprofile')
+PROFILING_EXPIRATION = getattr(settings, 'RESOURCE_PROFILING_EXPIRATION', 60*60*24)
+
+PROFILE_KEY = 'idgo_resource:profile:{key}'
+RATE_KEY = 'idgo_resource:profiling:{minute}'
+
+PROFILE_HEADER = 'HTTP_X_RESOURCE_PROFILE'
+
+
+def get_profile(key):
+    """Retourner le profil enregistré sous `key`, ou `None` s'il a expiré."""
+    value = RedisHandler().client.get(PROFILE_KEY.format(key=key))
+    return value and json.loads(value)
+
+
+class _CProfiler(object):
+
+    fmt = 'pstats'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def dump(self):
+        stats = pstats.Stats(self.profiler)
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(50)
+        data = base64.b64encode(marshal.dumps(stats.stats)).decode('ascii')
+        return data, text.getvalue()
+
+
+class _SamplingProfiler(object):
+
+    fmt = 'speedscope'
+
+    def __init__(self):
+        self.profiler = pyinstrument.Profiler(interval=0.005)
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def dump(self):
+        session = self.profiler.last_session
+        return SpeedscopeRenderer().render(session), self.profiler.output_text()
+
+
+class ResourceProfilingMiddleware(object):
+    """Profiler à la demande les requêtes de l'espace de noms `idgo_resource`.
+
+    Une requête est profilée si elle porte l'en-tête `X-Resource-Profile`
+    avec le jeton attendu, ou si elle est tirée au sort selon
+    `RESOURCE_PROFILING_SAMPLE_RATE`. Le profil et le journal des requêtes
+    SQL sont conservés dans REDIS ; la clé est renvoyée dans l'en-tête
+    `X-Resource-Profile-Key` de la réponse.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not PROFILING_ENABLED or not self.is_requested(request):
+            return self.get_response(request)
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        if match.namespace != 'idgo_resource' or not self.acquire():
+            return self.get_response(request)
+
+        if PROFILING_MODE == 'sampling' and pyinstrument:
+            profiler = _SamplingProfiler()
+        else:
+            profiler = _CProfiler()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            elapsed = time.perf_counter() - start
+
+        key = uuid4().__str__()
+        try:
+            self.store(key, request, response, elapsed, profiler, queries.captured_queries)
+        except Exception:
+            logger.exception("Unable to store the profile of \"{path}\".".format(path=request.path))
+        else:
+            response['X-Resource-Profile-Key'] = key
+        return response
+
+    def is_requested(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token is not None:
+            return bool(PROFILING_TOKEN) and token == PROFILING_TOKEN
+        return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+    def acquire(self):
+        """Limiter le nombre de profils par minute (compteur REDIS partagé)."""
+        client = RedisHandler().client
+        rate_key = RATE_KEY.format(minute=int(time.time() // 60))
+        pipe = client.pipeline()
+        pipe.incr(rate_key)
+        pipe.expire(rate_key, 120)
+        count, _ = pipe.execute()
+        return count <= PROFILING_MAX_PER_MINUTE
+
+    def store(self, key, request, response, elapsed, profiler, captured_queries):
+        data, summary = profiler.dump()
+        user = getattr(request, 'user', None)
+        value = {
+            'key': key,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': user and user.is_authenticated and user.username or None,
+            'status': response.status_code,
+            'duration': elapsed,
+            'created': time.time(),
+            'queries': [
+                {'sql': query['sql'], 'time': float(query['time'])}
+                for query in captured_queries
+            ],
+            'format': profiler.fmt,
+            'summary': summary,
+            'profile': data,
+        }
+        client = RedisHandler().client
+        client.set(PROFILE_KEY.format(key=key), json.dumps(value), ex=PROFILING_EXPIRATION)
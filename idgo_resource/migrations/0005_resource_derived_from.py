@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_resource', '0004_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='derived_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='derived_resources', to='idgo_resource.Resource', verbose_name="Ressource d'origine"),
+        ),
+    ]
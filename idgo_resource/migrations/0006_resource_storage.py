@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import idgo_resource.models
+import idgo_resource.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_resource', '0005_resource_derived_from'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storageresource',
+            name='file_path',
+            field=models.FileField(blank=True, db_column='file', null=True, storage=idgo_resource.storage.ResourceStorage(), upload_to='', verbose_name='Fichier'),
+        ),
+        migrations.AlterField(
+            model_name='upload',
+            name='file_path',
+            field=models.FileField(blank=True, db_column='file', null=True, storage=idgo_resource.storage.ResourceStorage(), upload_to=idgo_resource.models._ftp_file_upload_to, verbose_name='Fichier'),
+        ),
+    ]
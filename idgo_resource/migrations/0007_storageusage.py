@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_resource', '0006_resource_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('resource', 'Ressource'), ('dataset', 'Jeu de données'), ('user', 'Utilisateur'), ('organisation', 'Organisation')], max_length=20, verbose_name='Portée')),
+                ('object_id', models.IntegerField(verbose_name="Identifiant de l'objet")),
+                ('bytes_used', models.BigIntegerField(default=0, verbose_name='Octets utilisés')),
+                ('quota', models.BigIntegerField(blank=True, null=True, verbose_name='Quota (octets)')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Dernière mise à jour')),
+            ],
+            options={
+                'verbose_name': 'Utilisation du stockage',
+                'verbose_name_plural': 'Utilisations du stockage',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='storageusage',
+            unique_together=set([('scope', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_resource', '0007_storageusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ftp',
+            name='metadata',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True, verbose_name='Métadonnées détectées'),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='metadata',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True, verbose_name='Métadonnées détectées'),
+        ),
+    ]
@@ -0,0 +1,152 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import mimetypes
+import os
+import queue
+import threading
+
+from django.conf import settings
+import magic
+
+
+# Nombre maximum de descripteurs libmagic ouverts par processus
+MAGIC_POOL_SIZE = getattr(settings, 'RESOURCE_MAGIC_POOL_SIZE', 4)
+# Nombre d'entrées conservées dans le cache de détection du processus
+MIME_CACHE_SIZE = getattr(settings, 'RESOURCE_MIME_CACHE_SIZE', 4096)
+# Partager le cache de détection entre processus via REDIS
+MIME_CACHE_REDIS = getattr(settings, 'RESOURCE_MIME_CACHE_REDIS', False)
+MIME_CACHE_EXPIRATION = getattr(settings, 'RESOURCE_MIME_CACHE_EXPIRATION', 60*60*24)
+
+MIME_CACHE_KEY = 'idgo_resource:mime:{dev}:{ino}:{size}:{mtime}'
+
+
+class MagicPool(object):
+    """Réserve de descripteurs libmagic.
+
+    Les descripteurs libmagic ne peuvent pas être utilisés par plusieurs
+    threads à la fois : chaque détection emprunte un descripteur, qui est
+    ouvert au besoin dans la limite de `size`, puis le rend à la réserve.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.handles = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def checkout(self):
+        try:
+            handle = self.handles.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    handle = magic.Magic(mime=True)
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                handle = self.handles.get()
+        try:
+            yield handle
+        finally:
+            self.handles.put(handle)
+
+
+class LRUCache(object):
+    """Cache borné, protégé par un verrou, qui évince l'entrée la moins récemment lue."""
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return None
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+pool = MagicPool(MAGIC_POOL_SIZE)
+cache = LRUCache(MIME_CACHE_SIZE)
+
+
+def _redis_client():
+    from idgo_resource.redis_client import Handler as RedisHandler
+    return RedisHandler().client
+
+
+def sniff(filename):
+    """Détecter le type MIME d'un fichier d'après son contenu.
+
+    Le résultat est mis en cache sous l'identité du fichier (périphérique,
+    inode, taille, date de modification) : un fichier modifié ou remplacé
+    est détecté à nouveau.
+    """
+    stat = os.stat(filename)
+    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    content_type = cache.get(key)
+    if content_type:
+        return content_type
+
+    redis_key = MIME_CACHE_KEY.format(dev=key[0], ino=key[1], size=key[2], mtime=key[3])
+    if MIME_CACHE_REDIS:
+        content_type = _redis_client().get(redis_key)
+
+    if not content_type:
+        with pool.checkout() as handle:
+            content_type = handle.from_file(filename)
+        if MIME_CACHE_REDIS:
+            _redis_client().set(redis_key, content_type, ex=MIME_CACHE_EXPIRATION)
+
+    cache.set(key, content_type)
+    return content_type
+
+
+def sniff_buffer(data):
+    """Détecter le type MIME d'après les premiers octets d'un fichier."""
+    with pool.checkout() as handle:
+        return handle.from_buffer(data)
+
+
+def guess_type(filename):
+    """Deviner le type MIME d'un fichier d'après son extension, sinon d'après son contenu."""
+    # La base `mimetypes` du module est initialisée une seule fois par processus
+    return mimetypes.guess_type(str(filename))[0] or sniff(str(filename))
@@ -14,6 +14,7 @@
 # under the License.
 
 
+from functools import lru_cache
 from functools import reduce
 import json
 import os
@@ -24,6 +25,8 @@ import uuid
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import JSONField
+from django.db import transaction
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
@@ -35,7 +38,13 @@ from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.ckan_module import CkanUserHandler
 from idgo_admin.managers import DefaultResourceManager
 from idgo_admin.utils import three_suspension_points
+from idgo_resource.ckan.throttle import throttle
+from idgo_resource import compression
+from idgo_resource import formats
 from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.storage import is_local
+from idgo_resource.storage import resource_storage
 
 
 try:
@@ -43,19 +52,42 @@ try:
 except AttributeError:
     DOWNLOAD_SIZE_LIMIT = 104857600
 
-if settings.STATIC_ROOT:
-    locales_path = os.path.join(settings.STATIC_ROOT, 'mdedit/config/locales/fr/locales.json')
-else:
-    locales_path = os.path.join(settings.BASE_DIR, 'idgo_admin/static/mdedit/config/locales/fr/locales.json')
 
-try:
-    with open(locales_path, 'r', encoding='utf-8') as f:
-        MDEDIT_LOCALES = json.loads(f.read())
-        AUTHORIZED_PROTOCOL = (
+@lru_cache(maxsize=None)
+def get_mdedit_locales():
+    """Lire les locales de mdedit au premier appel (et non à l'import du module)."""
+    if settings.STATIC_ROOT:
+        locales_path = os.path.join(settings.STATIC_ROOT, 'mdedit/config/locales/fr/locales.json')
+    else:
+        locales_path = os.path.join(settings.BASE_DIR, 'idgo_admin/static/mdedit/config/locales/fr/locales.json')
+    try:
+        with open(locales_path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+    except Exception:
+        logger.warning("Unable to read mdedit locales \"{path}\".".format(path=locales_path))
+        return {}
+
+
+class LazyProtocolChoices(object):
+    """Choix des protocoles, évalués à la première itération.
+
+    L'objet est toujours « vrai » : Django teste la valeur de vérité des
+    choix à la définition du champ, ce qui ne doit pas lire les locales.
+    L'absence de locales est traitée lors de la validation du modèle
+    (cf. `ResourceFormats.clean_fields`).
+    """
+
+    def choices(self):
+        codelists = get_mdedit_locales().get('codelists', {})
+        return [
             (protocol['id'], protocol['value']) for protocol
-            in MDEDIT_LOCALES['codelists']['MD_LinkageProtocolCode'])
-except Exception:
-    AUTHORIZED_PROTOCOL = None
+            in codelists.get('MD_LinkageProtocolCode', [])]
+
+    def __iter__(self):
+        return iter(self.choices())
+
+
+AUTHORIZED_PROTOCOL = LazyProtocolChoices()
 
 CKAN_STORAGE_PATH = settings.CKAN_STORAGE_PATH
 OWS_URL_PATTERN = settings.OWS_URL_PATTERN
@@ -135,6 +167,12 @@ class ResourceFormats(models.Model):
         default=False,
     )
 
+    def clean_fields(self, exclude=None):
+        # Sans locales, aucun protocole n'est connu : la valeur n'est pas restreinte
+        if not AUTHORIZED_PROTOCOL.choices():
+            exclude = list(exclude or []) + ['protocol']
+        super().clean_fields(exclude=exclude)
+
     def __str__(self):
         return self.description
 
@@ -234,6 +272,15 @@ class Resource(models.Model):
         default='raw',
     )
 
+    derived_from = models.ForeignKey(
+        to='self',
+        related_name='derived_resources',
+        verbose_name="Ressource d'origine",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+
     def __str__(self):
         return self.title
 
@@ -283,6 +330,7 @@ class StorageResource(models.Model):
         blank=True,
         null=True,
         db_column='file',
+        storage=resource_storage,
     )
 
 
@@ -367,8 +415,30 @@ class AbstractResourceFile(AbstractResourceRelation):
         upload_to=_ftp_file_upload_to,
     )
 
+    profile = JSONField(
+        verbose_name="Profil des données",
+        blank=True,
+        null=True,
+    )
+
+    # Métadonnées détectées à partir de l'en-tête du fichier (taille, système de coordonnées)
+    metadata = JSONField(
+        verbose_name="Métadonnées détectées",
+        blank=True,
+        null=True,
+    )
+
+    # Vue de téléchargement du fichier (cf. `idgo_resource.sendfile`)
+    download_viewname = None
+
     @property
     def get_file_url(self):
+        if self.file_path and self.download_viewname and self.resource_id and self.resource.dataset_id:
+            kwargs = {
+                'dataset_id': self.resource.dataset_id,
+                'resource_id': self.resource_id,
+            }
+            return reverse(self.download_viewname, kwargs=kwargs)
         if self.file_path and hasattr(self.file_path, 'url'):
             return self.file_path.url
         else:
@@ -401,6 +471,18 @@ class Upload(AbstractResourceFile):
         verbose_name = "Ressource téléversée"
         verbose_name_plural = "Ressources téléversées"
 
+    # Les fichiers téléversés peuvent être conservés dans un stockage objet
+    file_path = models.FileField(
+        verbose_name="Fichier",
+        blank=True,
+        null=True,
+        db_column='file',
+        upload_to=_ftp_file_upload_to,
+        storage=resource_storage,
+    )
+
+    download_viewname = 'idgo_resource:download_resource_upload'
+
 
 class Ftp(AbstractResourceFile):
     """Modèle de classe les ressources FTP."""
@@ -410,6 +492,58 @@ class Ftp(AbstractResourceFile):
         verbose_name = "Ressource FTP"
         verbose_name_plural = "Ressources FTP"
 
+    download_viewname = 'idgo_resource:download_resource_ftp'
+
+
+# ========================
+# Comptabilité du stockage
+# ========================
+
+
+class StorageUsage(models.Model):
+    """Compteur de l'espace de stockage occupé (et quota éventuel) par portée."""
+
+    class Meta(object):
+        verbose_name = "Utilisation du stockage"
+        verbose_name_plural = "Utilisations du stockage"
+        unique_together = ('scope', 'object_id')
+
+    SCOPE_CHOICES = (
+        ('resource', "Ressource"),
+        ('dataset', "Jeu de données"),
+        ('user', "Utilisateur"),
+        ('organisation', "Organisation"),
+    )
+
+    scope = models.CharField(
+        verbose_name="Portée",
+        max_length=20,
+        choices=SCOPE_CHOICES,
+    )
+
+    object_id = models.IntegerField(
+        verbose_name="Identifiant de l'objet",
+    )
+
+    bytes_used = models.BigIntegerField(
+        verbose_name="Octets utilisés",
+        default=0,
+    )
+
+    quota = models.BigIntegerField(
+        verbose_name="Quota (octets)",
+        blank=True,
+        null=True,
+    )
+
+    updated = models.DateTimeField(
+        verbose_name="Dernière mise à jour",
+        auto_now=True,
+    )
+
+    def __str__(self):
+        return '{scope}:{object_id}'.format(scope=self.scope, object_id=self.object_id)
+
 
 # Signaux
 # =======
@@ -418,17 +552,65 @@ class Ftp(AbstractResourceFile):
 def logging_after_save(sender, instance, **kwargs):
     action = kwargs.get('created', False) and 'created' or 'updated'
     logger.info("Resource \"{pk}\" has been {action}.".format(pk=instance.pk, action=action))
+    metrics.increment('resource_events_total', action=action)
 
 
 @receiver(post_delete, sender=Resource)
 def logging_after_delete(sender, instance, **kwargs):
     logger.info("Resource \"{pk}\" has been deleted.".format(pk=instance.pk))
+    metrics.increment('resource_events_total', action='deleted')
+
+
+@receiver(pre_save, sender=Resource)
+def set_last_update(sender, instance, **kwargs):
+    instance.last_update = timezone.now()
+
+
+@receiver(post_save, sender=Upload)
+@receiver(post_save, sender=Ftp)
+def touch_resource(sender, instance, **kwargs):
+    # Le fichier ou son profil a changé : les ETag et fragments de la ressource sont invalidés
+    if instance.resource_id:
+        Resource.objects.filter(pk=instance.resource_id).update(last_update=timezone.now())
+
+
+@receiver(post_save, sender=Upload)
+@receiver(post_save, sender=Ftp)
+@receiver(post_save, sender=StorageResource)
+def account_storage_usage(sender, instance, **kwargs):
+    if instance.resource_id:
+        from idgo_resource import usage
+        usage.account(instance.resource_id)
+
+
+@receiver(post_delete, sender=Resource)
+def release_storage_usage(sender, instance, **kwargs):
+    from idgo_resource import usage
+    usage.release(instance)
+
+
+@receiver(post_save, sender=ResourceFormats)
+@receiver(post_delete, sender=ResourceFormats)
+def bump_resource_formats_version(sender, instance, **kwargs):
+    # Les autres processus ne doivent reconstruire leur cache qu'une fois la modification visible
+    transaction.on_commit(formats.bump_version)
+
+
+@receiver(pre_save, sender=Upload)
+@receiver(pre_save, sender=Ftp)
+def invalidate_compressed_variants(sender, instance, **kwargs):
+    """Supprimer les variantes compressées du fichier remplacé."""
+    if not instance.pk:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list('file_path', flat=True).first()
+    if previous and previous != instance.file_path.name and is_local(instance.file_path.storage):
+        compression.invalidate(instance.file_path.storage.path(previous))
 
 
 @receiver(post_delete, sender=Resource)
 def delete_ckan_resource(sender, instance, **kwargs):
     """Supprimer la resource CKAN à la suppression d'une resource."""
     apikey = CkanHandler.get_user(instance.dataset.editor.username)['apikey']
-    with CkanUserHandler(apikey=apikey) as ckan:
+    with CkanUserHandler(apikey=apikey) as ckan, throttle('delete_resource', apikey):
         ckan.delete_resource(str(instance.ckan_id))
     logger.info("CKAN Resource \"{pk}\" has been deleted.".format(pk=instance.ckan_id))
@@ -0,0 +1,234 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from datetime import timedelta
+import hashlib
+import os
+import posixpath
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from idgo_resource.ckan.store import DIRECTORY_STORAGE
+from idgo_resource.compression import is_variant
+from idgo_resource.models import Resource
+from idgo_resource.storage import is_local
+
+
+# Âge minimum (secondes) d'un fichier non référencé pour être supprimé :
+# protège les fichiers en cours de dépôt ou pas encore rattachés à une ressource.
+GC_GRACE_PERIOD = getattr(settings, 'RESOURCE_GC_GRACE_PERIOD', 60*60*24*7)
+# Suppressions par lot, et pause entre deux lots (secondes)
+GC_BATCH_SIZE = getattr(settings, 'RESOURCE_GC_BATCH_SIZE', 100)
+GC_PAUSE = getattr(settings, 'RESOURCE_GC_PAUSE', 1.0)
+
+
+def fingerprint(name):
+    """Empreinte de 64 bits d'un chemin."""
+    digest = hashlib.blake2b(name.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def file_fields():
+    """Retourner les `FileField` de tous les modèles installés.
+
+    Les fichiers d'autres applications peuvent partager les mêmes
+    répertoires : ils sont comptés parmi les fichiers référencés.
+    """
+    for Model in apps.get_models():
+        for field in Model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield Model, field
+
+
+def normalize(storage, name):
+    """Chemin absolu d'un fichier local, clé de l'objet sinon."""
+    if is_local(storage):
+        # Les fichiers FTP sont enregistrés sous leur chemin absolu
+        return os.path.normpath(os.path.join(storage.location, name))
+    return name
+
+
+class References(object):
+    """Ensemble compact des fichiers référencés.
+
+    Seule une empreinte de 64 bits de chaque chemin est conservée ; une
+    collision ne peut que faire conserver à tort un fichier orphelin.
+    Les variantes compressées d'un fichier référencé sont référencées.
+    """
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def add(self, name):
+        self.fingerprints.add(fingerprint(name))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, name):
+        if fingerprint(name) in self.fingerprints:
+            return True
+        return is_variant(name) and fingerprint(os.path.splitext(name)[0]) in self.fingerprints
+
+
+def collect_references():
+    """Parcourir en flux les chemins référencés en base."""
+    references = References()
+    for Model, field in file_fields():
+        names = Model._base_manager.exclude(**{field.name: ''}) \
+            .exclude(**{'{}__isnull'.format(field.name): True}) \
+            .values_list(field.name, flat=True).iterator()
+        for name in names:
+            references.add(normalize(field.storage, name))
+    return references
+
+
+def referenced_now(names, storage=None):
+    """Parmi `names`, retourner ceux qui sont référencés en base à cet instant.
+
+    Sans `storage`, `names` sont des chemins absolus de fichiers locaux.
+    """
+    candidates = set(names)
+    if storage is None or is_local(storage):
+        for Model, field in file_fields():
+            if is_local(field.storage):
+                candidates |= {os.path.relpath(name, field.storage.location) for name in names}
+
+    found = set()
+    for Model, field in file_fields():
+        values = Model._base_manager.filter(**{'{}__in'.format(field.name): candidates}) \
+            .values_list(field.name, flat=True)
+        found |= {normalize(field.storage, value) for value in values}
+    return found
+
+
+def scan_directory(root, references, grace_period=GC_GRACE_PERIOD, exclude=()):
+    """Lister les fichiers de `root` non référencés et plus anciens que le délai de grâce.
+
+    Le parcours utilise `os.scandir` sans suivre les liens symboliques ;
+    les répertoires de `exclude` ne sont pas parcourus.
+    """
+    limit = time.time() - grace_period
+    exclude = {os.path.normpath(path) for path in exclude if path}
+    stack = [os.path.normpath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except (FileNotFoundError, PermissionError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    continue
+                path = os.path.normpath(entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    if path not in exclude:
+                        stack.append(path)
+                    continue
+                if path in references:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < limit:
+                    yield path, stat.st_size
+
+
+def scan_storage(storage, references, grace_period=GC_GRACE_PERIOD, path=''):
+    """Lister les objets non référencés d'un stockage distant (S3).
+
+    Les tailles et dates de modification sont lues lors du listage si le
+    stockage le permet (`S3Storage.scan`) ; à défaut, objet par objet.
+    """
+    limit = timezone.now() - timedelta(seconds=grace_period)
+    if hasattr(storage, 'scan'):
+        for name, size, modified_time in storage.scan(path):
+            if name not in references and modified_time < limit:
+                yield name, size
+        return
+
+    directories, files = storage.listdir(path)
+    for filename in files:
+        name = posixpath.join(path, filename)
+        if name not in references and storage.get_modified_time(name) < limit:
+            yield name, storage.size(name)
+    for directory in directories:
+        yield from scan_storage(storage, references, grace_period, posixpath.join(path, directory))
+
+
+def directory_size(location):
+    size = 0
+    for root, _, filenames in os.walk(location):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def scan_store(grace_period=GC_GRACE_PERIOD):
+    """Lister les répertoires de stockage des ressources supprimées."""
+    limit = time.time() - grace_period
+    existing = set(Resource.objects.values_list('pk', flat=True).iterator())
+    try:
+        entries = os.scandir(DIRECTORY_STORAGE)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or not entry.name.isdigit():
+                continue
+            if int(entry.name) in existing or entry.stat().st_mtime >= limit:
+                continue
+            yield entry.path, directory_size(entry.path)
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def delete(items, remove, recheck=None, batch_size=GC_BATCH_SIZE, pause=GC_PAUSE):
+    """Supprimer les éléments par lots, en marquant une pause entre deux lots.
+
+    `recheck` retourne les chemins d'un lot devenus référencés depuis le
+    parcours, qui sont conservés. Retourne le nombre et le volume supprimés.
+    """
+    count = size = 0
+    for index, batch in enumerate(batches(items, batch_size)):
+        if index and pause:
+            time.sleep(pause)
+        kept = recheck and recheck([name for name, _ in batch]) or set()
+        for name, item_size in batch:
+            if name in kept:
+                continue
+            try:
+                remove(name)
+            except FileNotFoundError:
+                continue
+            count += 1
+            size += item_size
+    return count, size
@@ -0,0 +1,231 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import csv
+import shutil
+
+from django.contrib.auth import get_user_model
+
+from idgo_resource.ckan import publish_upload
+from idgo_resource.ckan.upload import get_related_file
+from idgo_resource import compression
+from idgo_resource import conversion
+from idgo_resource import detection
+from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.models import Resource
+from idgo_resource import profiling
+from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource import retry
+from idgo_resource.retry import is_transient
+from idgo_resource.retry import publish_later
+from idgo_resource.storage import is_local
+from idgo_resource.storage import local_copy
+
+
+# Étapes terminales du traitement d'une ressource ; lorsque la publication
+# est différée, la tâche `publish_resource` publie ensuite dans l'entrée
+# REDIS l'étape `done` ou `failed` (cf. `retry.bury`).
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+STAGE_DEFERRED = 'deferred'
+FINAL_STAGES = (STAGE_DONE, STAGE_FAILED, STAGE_DEFERRED)
+
+
+def detect(resource, session):
+    """Étape de détection des métadonnées du fichier (taille, système de coordonnées)."""
+    related = get_related_file(resource)
+    if not related or not related.file_path:
+        return
+    related.metadata = detection.detect(related.file_path)
+    related.save(update_fields=['metadata'])
+
+
+def convert(resource, session):
+    """Étape de conversion des classeurs en CSV et Parquet.
+
+    Les fichiers produits sont enregistrés comme ressources dérivées,
+    qui suivent à leur tour les étapes suivantes du traitement. Ce ne sont
+    que des compléments : l'échec de la conversion (classeur invalide,
+    délai ou mémoire dépassés) est signalé sans interrompre le traitement
+    du fichier d'origine.
+    """
+    if not conversion.CONVERSION_ENABLED:
+        return
+    related = get_related_file(resource)
+    if not related or not related.file_path or not conversion.is_convertible(related.file_path.name):
+        return
+
+    try:
+        with local_copy(related.file_path.storage, related.file_path.name) as path:
+            directory, outputs = conversion.convert(path)
+    except (conversion.ConversionError, OSError) as e:
+        logger.warning("Conversion of resource \"{pk}\" failed: {error}".format(pk=resource.pk, error=e))
+        retry.notify(session.get('redis_key'), stage='convert', warning=str(e))
+        return
+    try:
+        for extension, filename in sorted(outputs.items()):
+            derived = conversion.register(resource, extension, filename)
+            if derived:
+                process(derived, session)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def profile(resource, session):
+    """Étape de profilage des fichiers tabulaires (aperçu et statistiques par colonne).
+
+    Le profil n'est qu'un aperçu : un fichier illisible n'empêche pas sa
+    publication, la ressource est alors enregistrée sans profil.
+    """
+    related = get_related_file(resource)
+    if not related or not related.file_path or not profiling.is_tabular(related.file_path.name):
+        return
+    with local_copy(related.file_path.storage, related.file_path.name) as path:
+        try:
+            related.profile = profiling.profile(path)
+        except (csv.Error, ValueError, UnicodeDecodeError) as e:
+            logger.warning("Unable to profile resource \"{pk}\": {error}".format(pk=resource.pk, error=e))
+            related.profile = None
+    related.save(update_fields=['profile'])
+
+
+def compress(resource, session):
+    """Étape de production des variantes compressées des fichiers texte.
+
+    Les variantes ne sont produites que pour les fichiers stockés localement :
+    elles sont servies par `idgo_resource.sendfile` ou le serveur frontal.
+    """
+    related = get_related_file(resource)
+    if related and related.file_path and is_local(related.file_path.storage):
+        compression.compress(related.file_path.path)
+
+
+def publish(resource, session):
+    """Étape de publication du fichier de la ressource dans CKAN.
+
+    Sur une erreur transitoire (CKAN indisponible, etc.), la publication est
+    confiée à la tâche `publish_resource`, relancée avec un délai croissant :
+    le fichier, déjà enregistré, n'a pas à être de nouveau téléversé.
+    Renvoie alors `STAGE_DEFERRED`.
+    """
+    User = get_user_model()
+    user = User.objects.filter(pk=session.get('user')).first()
+    try:
+        publish_upload(resource, with_user=user)
+    except Exception as e:
+        if not is_transient(e):
+            raise
+        logger.warning("Publication of resource \"{pk}\" deferred: {error}".format(pk=resource.pk, error=e))
+        publish_later(resource.pk, user_pk=user and user.pk, redis_key=session.get('redis_key'))
+        return STAGE_DEFERRED
+
+
+# Étapes du traitement exécutées dans l'ordre ;
+# chaque étape est appelée avec la ressource et l'entrée REDIS.
+STAGES = (
+    ('detect', detect),
+    ('convert', convert),
+    ('profile', profile),
+    ('compress', compress),
+    ('publish', publish),
+)
+
+
+def process(resource, session, notify=None):
+    """Exécuter les étapes de traitement sur une ressource.
+
+    Renvoie `True` si une étape a été différée (publication confiée à une tâche).
+    """
+    total = len(STAGES)
+    deferred = False
+    for index, (stage, func) in enumerate(STAGES):
+        if notify:
+            notify(stage, int(100 * index / total))
+        try:
+            with metrics.timer('stage_duration_seconds', failures='stage_failures_total', stage=stage):
+                deferred = func(resource, session) == STAGE_DEFERRED or deferred
+        except Exception as e:
+            logger.exception("Resource \"{pk}\" failed at stage \"{stage}\".".format(
+                pk=resource.pk, stage=stage))
+            e.stage = stage
+            raise
+    return deferred
+
+
+def run(redis_key):
+    """Dérouler les étapes de traitement de la ressource liée à `redis_key`."""
+
+    redis = RedisHandler()
+    session = redis.retreive(redis_key)
+    resource = Resource.objects.get(pk=session['resource_pk'])
+    # La tâche de publication différée rend compte dans la même entrée
+    session['redis_key'] = redis_key
+
+    def notify(stage, progress):
+        redis.publish(redis_key, stage=stage, progress=progress)
+
+    try:
+        deferred = process(resource, session, notify=notify)
+    except Exception as e:
+        redis.publish(redis_key, stage=STAGE_FAILED, failed_stage=e.stage, error=str(e))
+        raise
+
+    if deferred:
+        redis.publish(redis_key, stage=STAGE_DEFERRED, progress=100,
+                      message="La publication dans CKAN sera relancée ultérieurement.")
+    else:
+        redis.publish(redis_key, stage=STAGE_DONE, progress=100)
+    return resource.pk
+
+
+def run_batch(redis_key):
+    """Dérouler les étapes de traitement d'un lot de ressources.
+
+    L'entrée REDIS contient la liste `resource_pks` ; l'échec d'une
+    ressource n'interrompt pas le traitement du lot. Les publications
+    différées sont signalées dans l'événement final (`deferred`).
+    """
+
+    redis = RedisHandler()
+    session = redis.retreive(redis_key)
+    resource_pks = session['resource_pks']
+
+    queryset = Resource.objects.filter(pk__in=resource_pks).select_related('dataset', 'format_type')
+    total = len(resource_pks)
+    failed = []
+    deferred = []
+    for index, resource in enumerate(queryset.iterator()):
+        redis.publish(
+            redis_key, stage='processing', resource_pk=resource.pk,
+            progress=int(100 * index / total))
+        try:
+            if process(resource, session):
+                deferred.append(resource.pk)
+        except Exception:
+            failed.append(resource.pk)
+
+    if failed:
+        redis.publish(redis_key, stage=STAGE_FAILED, progress=100, failed=failed, deferred=deferred,
+                      error="{count} ressource(s) en échec.".format(count=len(failed)))
+    elif deferred:
+        redis.publish(redis_key, stage=STAGE_DEFERRED, progress=100, deferred=deferred,
+                      message="La publication de {count} ressource(s) sera relancée ultérieurement.".format(
+                          count=len(deferred)))
+    else:
+        redis.publish(redis_key, stage=STAGE_DONE, progress=100)
+    return resource_pks
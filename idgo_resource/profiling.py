@@ -0,0 +1,237 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import codecs
+import csv
+from hashlib import blake2b
+import io
+from itertools import islice
+import math
+import re
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+PROFILE_PREVIEW_ROWS = getattr(settings, 'RESOURCE_PROFILE_PREVIEW_ROWS', 20)
+PROFILE_CHUNK_ROWS = getattr(settings, 'RESOURCE_PROFILE_CHUNK_ROWS', 10000)
+PROFILE_CELL_LENGTH = 200
+# Taille maximale d'une cellule (le module `csv` la limite à 128Kio par défaut,
+# ce qu'une géométrie WKT dépasse aisément), bornée par la limite mémoire
+# des traitements (cf. `RESOURCE_CONVERSION_MEMORY_LIMIT`).
+PROFILE_FIELD_SIZE_LIMIT = min(
+    getattr(settings, 'RESOURCE_PROFILE_FIELD_SIZE_LIMIT', 16777216),  # Default: 16Mio
+    getattr(settings, 'RESOURCE_CONVERSION_MEMORY_LIMIT', 1073741824))
+SAMPLE_SIZE = 65536
+
+TABULAR_EXTENSIONS = ('csv', 'tsv')
+DELIMITERS = ',;\t|'
+DATE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})([ T]\d{2}:\d{2}(:\d{2})?)?$')
+
+
+def is_tabular(filename):
+    return filename.split('.')[-1].lower() in TABULAR_EXTENSIONS
+
+
+def detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # L'échantillon peut couper un caractère multi-octets
+        if e.start < len(sample) - 3:
+            return 'cp1252'
+    return 'utf-8'
+
+
+def detect_dialect(text):
+    try:
+        return csv.Sniffer().sniff(text, delimiters=DELIMITERS)
+    except csv.Error:
+        return csv.excel
+
+
+class HyperLogLog(object):
+    """Estimation du nombre de valeurs distinctes en mémoire constante."""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def update(self, values):
+        bits = 64 - self.p
+        if numpy is not None:
+            hashes = numpy.fromiter((self._hash(v) for v in values), dtype=numpy.uint64)
+            if not hashes.size:
+                return
+            index = (hashes >> numpy.uint64(bits)).astype(numpy.intp)
+            w = (hashes & numpy.uint64((1 << bits) - 1)).astype(numpy.float64)
+            length = numpy.where(w > 0, numpy.floor(numpy.log2(numpy.maximum(w, 1))) + 1, 0)
+            registers = numpy.frombuffer(self.registers, dtype=numpy.uint8)
+            numpy.maximum.at(registers, index, (bits - length + 1).astype(numpy.uint8))
+            return
+        for value in values:
+            x = self._hash(value)
+            index = x >> bits
+            rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class ColumnProfile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.integer = True
+        self.date = True
+        self.min = self.max = None
+        self.text_min = self.text_max = None
+        self.distinct = HyperLogLog()
+
+    def update(self, values):
+        """Mettre à jour le profil avec les valeurs d'un bloc de lignes."""
+        total = len(values)
+        values = [value for value in (v.strip() for v in values) if value]
+        self.count += total
+        self.nulls += total - len(values)
+        if not values:
+            return
+
+        self.distinct.update(values)
+
+        low, high = min(values), max(values)
+        self.text_min = low if self.text_min is None else min(self.text_min, low)
+        self.text_max = high if self.text_max is None else max(self.text_max, high)
+
+        if self.numeric:
+            self.update_numeric(values)
+        if not self.numeric and self.date:
+            self.date = all(DATE_RE.match(value) for value in values)
+
+    def update_numeric(self, values):
+        try:
+            if numpy is not None:
+                numbers = numpy.char.replace(numpy.array(values), ',', '.').astype(numpy.float64)
+                if not numpy.isfinite(numbers).all():
+                    raise ValueError
+                low, high = float(numbers.min()), float(numbers.max())
+                integer = bool((numpy.mod(numbers, 1) == 0).all())
+            else:
+                numbers = [float(value.replace(',', '.')) for value in values]
+                if not all(math.isfinite(number) for number in numbers):
+                    raise ValueError
+                low, high = min(numbers), max(numbers)
+                integer = all(number.is_integer() for number in numbers)
+        except ValueError:
+            self.numeric = False
+            return
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.integer = self.integer and integer
+
+    def as_dict(self):
+        minimum, maximum = self.text_min, self.text_max
+        if self.count == self.nulls:
+            type_ = 'empty'
+        elif self.numeric:
+            type_ = self.integer and 'integer' or 'number'
+            minimum, maximum = self.min, self.max
+            if self.integer:
+                minimum, maximum = int(minimum), int(maximum)
+        elif self.date:
+            type_ = 'date'
+        else:
+            type_ = 'text'
+        if isinstance(minimum, str):
+            minimum, maximum = minimum[:PROFILE_CELL_LENGTH], maximum[:PROFILE_CELL_LENGTH]
+        return {
+            'name': self.name,
+            'type': type_,
+            'count': self.count,
+            'nulls': self.nulls,
+            'min': minimum,
+            'max': maximum,
+            'distinct': self.distinct.count(),
+        }
+
+
+def profile(filename, preview_rows=PROFILE_PREVIEW_ROWS):
+    """Profiler un fichier tabulaire en le lisant par blocs de lignes.
+
+    Renvoie l'encodage et le délimiteur détectés, le profil de chaque
+    colonne et un aperçu des premières lignes.
+    """
+
+    with open(filename, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+        encoding = detect_encoding(sample)
+        dialect = detect_dialect(sample.decode(encoding, errors='replace'))
+        f.seek(0)
+
+        text = io.TextIOWrapper(f, encoding=encoding, errors='replace', newline='')
+        csv.field_size_limit(PROFILE_FIELD_SIZE_LIMIT)
+        reader = csv.reader(text, dialect)
+
+        header = next(reader, [])
+        columns = [ColumnProfile(name.strip()) for name in header]
+        width = len(columns)
+
+        preview = []
+        rows = 0
+        while True:
+            chunk = list(islice(reader, PROFILE_CHUNK_ROWS))
+            if not chunk:
+                break
+            # Les lignes incomplètes ou trop longues sont ramenées à la largeur de l'en-tête
+            chunk = [(row + [''] * width)[:width] for row in chunk]
+            rows += len(chunk)
+            if len(preview) < preview_rows:
+                preview.extend(
+                    [cell[:PROFILE_CELL_LENGTH] for cell in row]
+                    for row in chunk[:preview_rows - len(preview)])
+            for column, values in zip(columns, zip(*chunk)):
+                column.update(values)
+
+    return {
+        'encoding': encoding,
+        'delimiter': dialect.delimiter,
+        'rows': rows,
+        'columns': [column.as_dict() for column in columns],
+        'header': [column.name for column in columns],
+        'preview': preview,
+    }
@@ -0,0 +1,232 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+
+from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.ckan_module import CkanUserHandler
+from idgo_admin.models import Dataset
+from idgo_resource.ckan.throttle import throttle
+from idgo_resource.ckan.upload import get_related_file
+from idgo_resource import logger
+from idgo_resource.models import Resource
+
+
+RECONCILIATION_WORKERS = getattr(settings, 'RESOURCE_RECONCILIATION_WORKERS', 4)
+RECONCILIATION_BATCH_SIZE = getattr(settings, 'RESOURCE_RECONCILIATION_BATCH_SIZE', 100)
+
+# Écarts constatés entre les ressources et les ressources CKAN
+MISSING_IN_CKAN = 'missing_in_ckan'
+ORPHAN_IN_CKAN = 'orphan_in_ckan'
+STALE_METADATA = 'stale_metadata'
+WRONG_SIZE = 'wrong_size'
+PACKAGE_ERROR = 'package_error'
+
+
+class ReconciliationError(Exception):
+    """La réconciliation ne peut pas être menée sans risque."""
+
+
+def fetch_package(dataset):
+    try:
+        with throttle('package_show'):
+            return dataset.pk, CkanHandler.get_package(str(dataset.ckan_id)), None
+    except Exception as e:
+        return dataset.pk, None, e
+    finally:
+        close_old_connections()
+
+
+def get_foreign_model():
+    """Modèle des ressources gérées par `idgo_admin`, ou `None` s'il est introuvable."""
+    try:
+        return apps.get_model('idgo_admin', 'Resource')
+    except LookupError:
+        return None
+
+
+def foreign_ckan_ids(datasets):
+    """Identifiants CKAN des ressources gérées par `idgo_admin`, à ne pas traiter comme orphelines.
+
+    Renvoie `None` si ces ressources ne peuvent être connues : aucune
+    ressource CKAN ne peut alors être qualifiée d'orpheline.
+    """
+    Model = get_foreign_model()
+    if Model is None:
+        return None
+    return {
+        str(ckan_id) for ckan_id in
+        Model.objects.filter(dataset__in=datasets).values_list('ckan_id', flat=True)
+    }
+
+
+def expected_metadata(resource):
+    """Métadonnées attendues dans CKAN pour une ressource (seules celles connues sans lire le fichier)."""
+    format_type = resource.format_type
+    expected = {
+        'name': resource.title,
+        'description': resource.description,
+        'format': format_type and format_type.ckan_format or '',
+    }
+    related = get_related_file(resource)
+    size = related and (related.metadata or {}).get('size')
+    return expected, size
+
+
+def compare(resource, remote):
+    expected, size = expected_metadata(resource)
+    stale = {
+        key: {'expected': value, 'found': remote.get(key)}
+        for key, value in expected.items()
+        if (value or '').strip().lower() != (remote.get(key) or '').strip().lower()
+    }
+    drift = []
+    if stale:
+        drift.append((STALE_METADATA, stale))
+    if size is not None and str(size) != str(remote.get('size') or ''):
+        drift.append((WRONG_SIZE, {'expected': size, 'found': remote.get('size')}))
+    return drift
+
+
+def diff(dataset, package, resources, foreign_ids):
+    """Comparer les ressources d'un jeu de données au paquet CKAN correspondant."""
+    local = {str(resource.ckan_id): resource for resource in resources}
+    remote = {item['id']: item for item in package.get('resources', [])}
+
+    entries = []
+    for ckan_id in sorted(local.keys() - remote.keys()):
+        entries.append(_entry(MISSING_IN_CKAN, dataset, ckan_id, local[ckan_id]))
+    orphans = foreign_ids is not None and remote.keys() - local.keys() - foreign_ids or set()
+    for ckan_id in sorted(orphans):
+        entries.append(_entry(ORPHAN_IN_CKAN, dataset, ckan_id, details={'name': remote[ckan_id].get('name')}))
+    for ckan_id in sorted(local.keys() & remote.keys()):
+        for kind, details in compare(local[ckan_id], remote[ckan_id]):
+            entries.append(_entry(kind, dataset, ckan_id, local[ckan_id], details))
+    return entries
+
+
+def _entry(kind, dataset, ckan_id, resource=None, details=None):
+    return {
+        'kind': kind,
+        'dataset': dataset.pk,
+        'resource': resource and resource.pk,
+        'ckan_id': ckan_id,
+        'details': details or {},
+    }
+
+
+def iterate_batches(queryset, size):
+    iterator = queryset.iterator()
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def reconcile(datasets=None, repair=False, delete_orphans=False,
+              workers=RECONCILIATION_WORKERS, batch_size=RECONCILIATION_BATCH_SIZE):
+    """Comparer les ressources aux ressources CKAN, par lots de jeux de données.
+
+    Les paquets CKAN d'un lot sont lus simultanément (dans la limite du
+    limiteur d'appels à CKAN) puis comparés aux ressources par opérations
+    ensemblistes sur les identifiants CKAN. Avec `repair`, les ressources
+    absentes ou divergentes sont publiées de nouveau ; avec `delete_orphans`,
+    les ressources CKAN inconnues sont supprimées. Retourne la liste des écarts.
+
+    Lève `ReconciliationError` si `delete_orphans` est demandé alors que les
+    ressources gérées par `idgo_admin` ne peuvent être identifiées.
+    """
+    if delete_orphans and get_foreign_model() is None:
+        raise ReconciliationError(
+            "Les ressources idgo_admin sont introuvables : les ressources CKAN orphelines ne peuvent être supprimées.")
+
+    queryset = Dataset.objects.select_related('editor').order_by('pk')
+    if datasets:
+        queryset = queryset.filter(pk__in=datasets)
+
+    entries = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch in iterate_batches(queryset, batch_size):
+            resources = {}
+            related = Resource.objects.filter(dataset__in=batch) \
+                .select_related('format_type', 'upload', 'ftp', 'storageresource')
+            for resource in related:
+                resources.setdefault(resource.dataset_id, []).append(resource)
+            foreign_ids = foreign_ckan_ids(batch)
+            by_pk = {dataset.pk: dataset for dataset in batch}
+
+            for pk, package, error in executor.map(fetch_package, batch):
+                dataset = by_pk[pk]
+                if error or not package:
+                    entries.append(_entry(PACKAGE_ERROR, dataset, str(dataset.ckan_id),
+                                          details={'error': str(error or 'not found')}))
+                    continue
+                found = diff(dataset, package, resources.get(pk, []), foreign_ids)
+                entries.extend(found)
+                if found and (repair or delete_orphans):
+                    fix(dataset, found, repair=repair, delete_orphans=delete_orphans)
+
+    logger.info("CKAN reconciliation: {count} difference(s) found.".format(count=len(entries)))
+    return entries
+
+
+def fix(dataset, entries, repair=False, delete_orphans=False):
+    """Corriger les écarts d'un jeu de données.
+
+    Les publications sont confiées aux tâches Celery (nouvelles tentatives,
+    file des échecs) ; la clé d'idempotence est ignorée puisque CKAN diverge
+    de ce qui a été publié.
+    """
+    from idgo_resource.tasks import publish_resource
+    from idgo_resource.tasks import synchronize_store
+
+    republish = set()
+    orphans = []
+    for entry in entries:
+        if entry['kind'] in (MISSING_IN_CKAN, STALE_METADATA, WRONG_SIZE):
+            republish.add(entry['resource'])
+        elif entry['kind'] == ORPHAN_IN_CKAN:
+            orphans.append(entry['ckan_id'])
+
+    if repair:
+        store_pks = set(Resource.objects.filter(
+            pk__in=republish, storageresource__isnull=False).values_list('pk', flat=True))
+        for pk in sorted(republish):
+            task = pk in store_pks and synchronize_store or publish_resource
+            task.delay(pk, force=True)
+            entry_repaired(entries, pk)
+
+    if delete_orphans and orphans:
+        apikey = CkanHandler.get_user(dataset.editor.username)['apikey']
+        with CkanUserHandler(apikey=apikey) as ckan:
+            for ckan_id in orphans:
+                with throttle('delete_resource', apikey):
+                    ckan.delete_resource(ckan_id)
+                logger.info("Orphan CKAN Resource \"{id}\" has been deleted.".format(id=ckan_id))
+                entry_repaired(entries, ckan_id=ckan_id)
+
+
+def entry_repaired(entries, resource=None, ckan_id=None):
+    for entry in entries:
+        if (resource and entry['resource'] == resource) or (ckan_id and entry['ckan_id'] == ckan_id):
+            entry['repaired'] = True
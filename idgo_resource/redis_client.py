@@ -14,16 +14,135 @@
 # under the License.
 
 
+from collections import OrderedDict
 import json
+import threading
+import time
 from uuid import uuid4
 
 from django.conf import settings
+from django.core.signals import request_finished
+from django.core.signals import request_started
 import redis
 
 from idgo_resource import logger
 
 
 REDIS_EXPIRATION = 60*60
+# Délais (en secondes) des opérations et de la connexion : un serveur REDIS
+# qui ne répond plus ne doit pas bloquer indéfiniment les requêtes.
+REDIS_SOCKET_TIMEOUT = getattr(settings, 'RESOURCE_REDIS_SOCKET_TIMEOUT', 5)
+REDIS_CONNECT_TIMEOUT = getattr(settings, 'RESOURCE_REDIS_CONNECT_TIMEOUT', 2)
+
+# Canal de diffusion des étapes de traitement d'une ressource
+PROGRESS_CHANNEL = 'idgo_resource:progress:{key}'
+
+# Cache des entrées REDIS dans le processus (invalidé par pub/sub)
+SESSION_CACHE = getattr(settings, 'RESOURCE_SESSION_CACHE', True)
+SESSION_CACHE_SIZE = getattr(settings, 'RESOURCE_SESSION_CACHE_SIZE', 1024)
+INVALIDATION_CHANNEL = 'idgo_resource:session:invalidate'
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(**kwargs):
+    """Retourner le pool de connexions partagé par les clients d'un même serveur."""
+    key = tuple(sorted(kwargs.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = redis.ConnectionPool(**kwargs)
+        return _pools[key]
+
+
+class SessionCache(object):
+    """Cache à deux niveaux des entrées REDIS.
+
+    Le niveau « requête » conserve les entrées lues pendant le traitement
+    d'une requête HTTP ; il est vidé à la fin de la requête. Le niveau
+    « processus » conserve les dernières entrées lues ou écrites avec leur
+    version ; il n'est utilisé que tant que le thread qui écoute les
+    invalidations publiées à chaque mise à jour est actif.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def begin(self, **kwargs):
+        self.local.records = {}
+
+    def end(self, **kwargs):
+        self.local.records = None
+
+    def is_listening(self):
+        return self.listener is not None and self.listener.is_alive()
+
+    def start(self, client):
+        """Démarrer l'écoute des invalidations (une fois par processus).
+
+        Après un fork ou une perte de connexion, le thread n'existe plus :
+        les entrées ont pu manquer des invalidations et sont oubliées.
+        """
+        if self.is_listening():
+            return
+        with self.lock:
+            if self.is_listening():
+                return
+            self.records.clear()
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: self.on_invalidation})
+            self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def on_invalidation(self, message):
+        key, version = message['data'].rsplit(' ', 1)
+        self.invalidate(key, int(version))
+
+    def get(self, key):
+        records = getattr(self.local, 'records', None)
+        if records is not None and key in records:
+            return records[key]
+        if not self.is_listening():
+            return None
+        with self.lock:
+            entry = self.records.get(key)
+            if entry is None:
+                return None
+            self.records.move_to_end(key)
+        if records is not None:
+            records[key] = entry[1]
+        return entry[1]
+
+    def set(self, key, version, value):
+        records = getattr(self.local, 'records', None)
+        if records is not None:
+            records[key] = value
+        with self.lock:
+            current = self.records.get(key)
+            if current and current[0] > version:
+                return
+            self.records[key] = (version, value)
+            self.records.move_to_end(key)
+            while len(self.records) > self.size:
+                self.records.popitem(last=False)
+
+    def invalidate(self, key, version=None):
+        records = getattr(self.local, 'records', None)
+        if records is not None and version is None:
+            records.pop(key, None)
+        with self.lock:
+            current = self.records.get(key)
+            if current and (version is None or current[0] < version):
+                del self.records[key]
+
+
+session_cache = SessionCache(SESSION_CACHE_SIZE)
+request_started.connect(session_cache.begin)
+request_finished.connect(session_cache.end)
 
 
 class Handler:
@@ -42,7 +161,9 @@ class Handler:
             logger.warning("REDIS settings are missing in this context. Trying to connect with defaults values.")
             logger.warning("REDIS client try to connect with defaults host and port.")
         kwargs.setdefault('decode_responses', True)  # Oui decode moi tout
-        self.client = redis.StrictRedis(**kwargs)
+        kwargs.setdefault('socket_timeout', REDIS_SOCKET_TIMEOUT)
+        kwargs.setdefault('socket_connect_timeout', REDIS_CONNECT_TIMEOUT)
+        self.client = redis.StrictRedis(connection_pool=get_connection_pool(**kwargs))
 
     def scent(self):
         pubsub = self.client.pubsub()
@@ -58,16 +179,92 @@ class Handler:
 
     def create(self, *args, **kwargs):
         key = uuid4().__str__()
-        self.client.set(key, json.dumps(kwargs))
-        self.client.expire(key, REDIS_EXPIRATION)
+        value = json.dumps(dict(kwargs, _version=1))
+        self.client.set(key, value, ex=REDIS_EXPIRATION)
+        self.cache(key, 1, value)
         return key
 
     def update(self, key, *args, **kwargs):
-        data = self.retreive(key)
-        data.update(**kwargs)
-        self.client.set(key, json.dumps(data))
-        return self.retreive(key)
+        return self._update(key, kwargs)
+
+    def _update(self, key, fields, channel='', message=''):
+        """Fusionner `fields` dans l'entrée, incrémenter sa version et diffuser l'invalidation.
+
+        La fusion est faite en Python sous WATCH (et non dans un script Lua :
+        `cjson` y convertit les listes vides en objets et tronque les nombres
+        à 14 chiffres significatifs) ; elle est rejouée si l'entrée a été
+        modifiée entre la lecture et l'écriture.
+        """
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    if value is None:
+                        session_cache.invalidate(key)
+                    data = json.loads(value)  # TypeError si l'entrée n'existe pas ou a expiré
+                    data.update(fields)
+                    data['_version'] = data.get('_version', 0) + 1
+                    value = json.dumps(data)
+                    pipe.multi()
+                    pipe.set(key, value, ex=REDIS_EXPIRATION)
+                    pipe.publish(INVALIDATION_CHANNEL, '{key} {version}'.format(key=key, version=data['_version']))
+                    if channel:
+                        pipe.publish(channel, message)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+        self.cache(key, data['_version'], value)
+        return self.strip(data)
 
-    def retreive(self, key, *args, **kwargs):
+    def retreive(self, key, *args, cached=True, **kwargs):
+        if cached and SESSION_CACHE:
+            session_cache.start(self.client)
+            value = session_cache.get(key)
+            if value is not None:
+                return self.strip(json.loads(value))
         value = self.client.get(key)
-        return json.loads(value)
+        data = json.loads(value)
+        self.cache(key, data.get('_version', 0), value)
+        return self.strip(data)
+
+    @staticmethod
+    def strip(data):
+        # La version est interne au cache : elle n'est pas exposée aux appelants
+        data.pop('_version', None)
+        return data
+
+    def cache(self, key, version, value):
+        if SESSION_CACHE:
+            session_cache.start(self.client)
+            session_cache.set(key, version, value)
+
+    def publish(self, key, **event):
+        """Publier l'avancement du traitement de la ressource liée à `key`.
+
+        Le dernier événement est conservé dans l'entrée REDIS afin que
+        les abonnés tardifs puissent connaître l'état courant.
+        """
+        self._update(
+            key, {'progress': event},
+            channel=PROGRESS_CHANNEL.format(key=key), message=json.dumps(event))
+
+    def listen(self, key, timeout=None, interval=1.0):
+        """Écouter les événements publiés pour `key`.
+
+        Renvoie `None` à chaque intervalle sans message, ce qui permet
+        à l'appelant d'émettre un signal de vie ou de rendre la main.
+        """
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(PROGRESS_CHANNEL.format(key=key))
+        deadline = timeout and time.monotonic() + timeout
+        try:
+            while not deadline or time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=interval)
+                if message and message['type'] == 'message':
+                    yield json.loads(message['data'])
+                else:
+                    yield None
+        finally:
+            pubsub.close()
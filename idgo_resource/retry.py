@@ -0,0 +1,158 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import json
+import random
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+
+from idgo_resource.ckan.throttle import is_overloaded
+from idgo_resource.ckan.throttle import ThrottleTimeout
+from idgo_resource.locks import LockLost
+from idgo_resource.locks import LockTimeout
+from idgo_resource import logger
+from idgo_resource import metrics
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+# Délai de base et délai maximum entre deux tentatives (secondes)
+RETRY_BACKOFF = getattr(settings, 'RESOURCE_RETRY_BACKOFF', 30)
+RETRY_BACKOFF_MAX = getattr(settings, 'RESOURCE_RETRY_BACKOFF_MAX', 60*60)
+
+DEAD_LETTER_KEY = 'idgo_resource:dlq'
+
+
+def is_transient(exception):
+    """Déterminer si l'erreur est transitoire et justifie une nouvelle tentative.
+
+    Sont transitoires les erreurs réseau, les réponses 408, 429 et 5xx de
+    CKAN et l'indisponibilité d'un verrou ou d'un créneau d'appel ; les
+    autres erreurs (données invalides, ressource supprimée, etc.) sont
+    définitives.
+    """
+    if isinstance(exception, (LockLost, LockTimeout, ThrottleTimeout)):
+        return True
+    if isinstance(exception, ObjectDoesNotExist):
+        return False
+    response = getattr(exception, 'response', None)
+    status = getattr(exception, 'status_code', None) or getattr(response, 'status_code', None)
+    if status == 408:
+        return True
+    return is_overloaded(exception)
+
+
+def backoff(retries):
+    """Délai avant la tentative suivante : croissance exponentielle et gigue complète."""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** retries))
+
+
+def handle(task, exception):
+    """Replanifier la tâche sur une erreur transitoire, sinon la placer dans la file des échecs."""
+    retries = task.request.retries
+    if is_transient(exception) and retries < task.max_retries:
+        logger.warning("Task \"{name}\" failed ({error}), retry #{count}.".format(
+            name=task.name, error=exception, count=retries + 1))
+        raise task.retry(exc=exception, countdown=backoff(retries))
+
+    logger.error("Task \"{name}\" failed after {count} attempt(s): {error}".format(
+        name=task.name, count=retries + 1, error=exception))
+    bury(task.name, task.request.args, task.request.kwargs, exception, retries + 1)
+
+
+def publish_later(resource_pk, user_pk=None, redis_key=None):
+    """Confier la publication d'une ressource à la tâche relancée en cas d'échec.
+
+    Si `redis_key` est renseignée, la tâche y publie l'issue de la publication.
+    """
+    from idgo_resource.tasks import publish_resource
+    kwargs = {'user_pk': user_pk}
+    if redis_key:
+        kwargs['redis_key'] = redis_key
+    transaction.on_commit(lambda: publish_resource.apply_async(
+        (resource_pk,), kwargs, countdown=backoff(0)))
+
+
+def notify(redis_key, **event):
+    """Publier un événement dans l'entrée REDIS `redis_key`, si elle n'a pas expiré."""
+    if not redis_key:
+        return
+    try:
+        RedisHandler().publish(redis_key, **event)
+    except TypeError:
+        logger.info("Progress entry \"{key}\" has expired.".format(key=redis_key))
+
+
+# File des échecs
+# ===============
+
+
+def bury(name, args, kwargs, exception, attempts):
+    """Enregistrer une tâche en échec définitif dans la file des échecs."""
+    entry_id = str(uuid4())
+    entry = {
+        'id': entry_id,
+        'task': name,
+        'args': list(args or []),
+        'kwargs': dict(kwargs or {}),
+        'exception': type(exception).__name__,
+        'error': str(exception),
+        'transient': is_transient(exception),
+        'attempts': attempts,
+        'failed_at': time.time(),
+    }
+    RedisHandler().client.hset(DEAD_LETTER_KEY, entry_id, json.dumps(entry))
+    metrics.increment('dead_letters_total', task=name)
+
+    from idgo_resource.pipeline import STAGE_FAILED
+    notify(entry['kwargs'].get('redis_key'), stage=STAGE_FAILED, failed_stage=name,
+           error=entry['error'], dead_letter=entry_id)
+    return entry_id
+
+
+def entries():
+    """Retourner les tâches en échec, de la plus ancienne à la plus récente."""
+    values = RedisHandler().client.hvals(DEAD_LETTER_KEY)
+    return sorted((json.loads(value) for value in values), key=lambda entry: entry['failed_at'])
+
+
+def get(entry_id):
+    value = RedisHandler().client.hget(DEAD_LETTER_KEY, entry_id)
+    return value and json.loads(value) or None
+
+
+def remove(entry_id):
+    return bool(RedisHandler().client.hdel(DEAD_LETTER_KEY, entry_id))
+
+
+def replay(entry_id):
+    """Relancer une tâche de la file des échecs ; elle dispose de nouveau de toutes ses tentatives."""
+    from idgo_resource.apps import app as celery_app
+    entry = get(entry_id)
+    if not entry:
+        return None
+    # Retirer l'entrée avant l'envoi : un nouvel échec créera une nouvelle entrée
+    if not remove(entry_id):
+        return None
+    return celery_app.send_task(entry['task'], args=entry['args'], kwargs=entry['kwargs'])
+
+
+def purge():
+    return RedisHandler().client.delete(DEAD_LETTER_KEY)
@@ -0,0 +1,186 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.http import FileResponse
+from django.http import Http404
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.http import parse_http_date_safe
+
+from idgo_resource import compression
+
+
+# Délégation de l'envoi des fichiers au serveur frontal :
+# - 'nginx' : en-tête X-Accel-Redirect ; `RESOURCE_SENDFILE_ROOTS` associe
+#   chaque répertoire local à l'emplacement `internal` nginx qui le sert ;
+# - 'xsendfile' : en-tête X-Sendfile (Apache mod_xsendfile, lighttpd).
+SENDFILE_BACKEND = getattr(settings, 'RESOURCE_SENDFILE_BACKEND', None)
+SENDFILE_ROOTS = getattr(settings, 'RESOURCE_SENDFILE_ROOTS', {})
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile(object):
+    """Fichier limité à `length` octets à partir de la position courante.
+
+    Le descripteur reste exposé via `fileno()` afin que le serveur WSGI
+    puisse utiliser `os.sendfile` (gunicorn borne l'envoi à Content-Length).
+    """
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+def get_etag(st):
+    return '"{ino:x}-{size:x}-{mtime:x}"'.format(
+        ino=st.st_ino, size=st.st_size, mtime=st.st_mtime_ns)
+
+
+def parse_range(header, size):
+    """Retourner `(start, end)` pour une plage unique, `None` sinon.
+
+    Lève `ValueError` si la plage n'est pas satisfiable.
+    """
+    match = header and RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def if_range_matches(request, etag, mtime):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def delegate(filename, content_type):
+    """Confier l'envoi du fichier au serveur frontal si celui-ci est configuré."""
+    if SENDFILE_BACKEND == 'xsendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = filename
+        return response
+    if SENDFILE_BACKEND == 'nginx':
+        for root, location in SENDFILE_ROOTS.items():
+            root = os.path.join(os.path.realpath(root), '')
+            if filename.startswith(root):
+                response = HttpResponse(content_type=content_type)
+                response['X-Accel-Redirect'] = urljoin(
+                    os.path.join(location, ''), quote(filename[len(root):]))
+                return response
+
+
+def serve(request, filename, content_type=None, as_attachment=False):
+    """Servir un fichier local en gérant les requêtes conditionnelles et partielles."""
+
+    filename = os.path.realpath(filename)
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    # Variantes pré-compressées : avec nginx, `gzip_static` et `brotli_static`
+    # s'en chargent (l'en-tête Content-Encoding n'est pas transmis).
+    encoding = None
+    path = filename
+    if SENDFILE_BACKEND != 'nginx':
+        path, encoding = compression.negotiate(request, filename)
+
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404()
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404()
+
+    etag = get_etag(st)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if response is None:
+        response = delegate(path, content_type)
+    if response is None:
+        response = _file_response(request, path, st, etag, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if compression.is_text(filename):
+        response['Vary'] = 'Accept-Encoding'
+    if as_attachment:
+        response['Content-Disposition'] = 'attachment; filename="{name}"'.format(
+            name=os.path.basename(filename).replace('"', ''))
+    return response
+
+
+def _file_response(request, filename, st, etag, content_type):
+    try:
+        byte_range = if_range_matches(request, etag, st.st_mtime) \
+            and parse_range(request.META.get('HTTP_RANGE'), st.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{size}'.format(size=st.st_size)
+        return response
+
+    f = open(filename, 'rb')
+    if byte_range:
+        start, end = byte_range
+        f.seek(start)
+        response = FileResponse(RangeFile(f, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes {start}-{end}/{size}'.format(start=start, end=end, size=st.st_size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(f, content_type=content_type)
+        response['Content-Length'] = st.st_size
+    response['Accept-Ranges'] = 'bytes'
+    return response
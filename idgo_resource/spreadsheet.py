@@ -0,0 +1,193 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Conversion d'un classeur en CSV (et Parquet), dans un processus dédié.
+
+Ce module n'importe pas Django : `conversion.convert` l'exécute dans un
+sous-processus (`python -m idgo_resource.spreadsheet`). Les workers Celery
+en mode prefork sont des processus démons, qui ne peuvent pas créer
+d'enfants `multiprocessing` ; un sous-processus (fork + exec) n'est pas
+concerné par cette restriction et peut être tué à l'expiration du délai.
+"""
+
+
+import csv
+import datetime
+import os
+import resource as rlimit
+import sys
+from xml.etree.ElementTree import iterparse
+import zipfile
+
+
+PARQUET_BATCH_SIZE = 65536
+
+ODS_TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+ODS_OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+ODS_TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+# Codes de sortie du processus de conversion
+EXIT_MEMORY = 3
+
+
+# Lecture des classeurs
+# =====================
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_xlsx(filename):
+    import openpyxl
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield [_cell(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def read_xls(filename):
+    import xlrd
+    book = xlrd.open_workbook(filename, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        for index in range(sheet.nrows):
+            row = []
+            for cell in sheet.row(index):
+                value = cell.value
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    value = xlrd.xldate_as_datetime(value, book.datemode)
+                row.append(_cell(value))
+            yield row
+    finally:
+        book.release_resources()
+
+
+def _ods_value(element):
+    value = element.get(ODS_OFFICE + 'date-value') or element.get(ODS_OFFICE + 'value')
+    if value is not None:
+        return _cell(float(value)) if element.get(ODS_OFFICE + 'value-type') == 'float' else value
+    return '\n'.join(''.join(p.itertext()) for p in element.iter(ODS_TEXT + 'p'))
+
+
+def read_ods(filename):
+    """Lire la première feuille d'un classeur ODS en flux (sans odfpy)."""
+    with zipfile.ZipFile(filename) as archive, archive.open('content.xml') as content:
+        row = []
+        empty_cells = empty_rows = 0
+        for event, element in iterparse(content, events=('end',)):
+            if element.tag in (ODS_TABLE + 'table-cell', ODS_TABLE + 'covered-table-cell'):
+                repeat = int(element.get(ODS_TABLE + 'number-columns-repeated', 1))
+                value = _ods_value(element)
+                if value:
+                    # Les cellules vides ne sont matérialisées que si une valeur suit
+                    row.extend([''] * empty_cells + [value] * repeat)
+                    empty_cells = 0
+                else:
+                    empty_cells += repeat
+                element.clear()
+            elif element.tag == ODS_TABLE + 'table-row':
+                repeat = int(element.get(ODS_TABLE + 'number-rows-repeated', 1))
+                if row:
+                    for _ in range(empty_rows):
+                        yield []
+                    empty_rows = 0
+                    for _ in range(repeat):
+                        yield row
+                else:
+                    empty_rows += repeat
+                row, empty_cells = [], 0
+                element.clear()
+            elif element.tag == ODS_TABLE + 'table':
+                return
+
+
+READERS = {
+    'ods': read_ods,
+    'xls': read_xls,
+    'xlsx': read_xlsx,
+}
+
+
+def write_parquet(csv_path, parquet_path):
+    import pyarrow.csv
+    import pyarrow.parquet
+
+    reader = pyarrow.csv.open_csv(
+        csv_path, read_options=pyarrow.csv.ReadOptions(block_size=PARQUET_BATCH_SIZE * 64))
+    with pyarrow.parquet.ParquetWriter(parquet_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+
+
+def write_csv(rows, csv_path):
+    """Écrire les lignes en CSV en les alignant sur la plus large d'entre elles.
+
+    La largeur n'est connue qu'à la fin de la lecture : les lignes sont
+    d'abord écrites telles quelles, puis complétées lors d'une seconde passe.
+    """
+    raw_path = '{}.raw'.format(csv_path)
+    count = width = 0
+    try:
+        with open(raw_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for row in rows:
+                width = max(width, len(row))
+                writer.writerow(row)
+                count += 1
+        with open(raw_path, 'r', newline='', encoding='utf-8') as src, \
+                open(csv_path, 'w', newline='', encoding='utf-8') as dst:
+            writer = csv.writer(dst)
+            for row in csv.reader(src):
+                writer.writerow(row + [''] * (width - len(row)))
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return count
+
+
+def convert(source, extension, csv_path, parquet_path=None):
+    rows = write_csv(READERS[extension](source), csv_path)
+    if parquet_path and rows:
+        write_parquet(csv_path, parquet_path)
+    return rows
+
+
+def main(argv):
+    """python -m idgo_resource.spreadsheet SOURCE EXTENSION CSV_PATH PARQUET_PATH MEMORY_LIMIT
+
+    `PARQUET_PATH` vide : pas de sortie Parquet. Le nombre de lignes est
+    écrit sur la sortie standard.
+    """
+    source, extension, csv_path, parquet_path, memory_limit = argv
+    soft, hard = rlimit.getrlimit(rlimit.RLIMIT_AS)
+    rlimit.setrlimit(rlimit.RLIMIT_AS, (int(memory_limit), hard))
+    try:
+        rows = convert(source, extension, csv_path, parquet_path or None)
+    except MemoryError:
+        return EXIT_MEMORY
+    sys.stdout.write('{}\n'.format(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
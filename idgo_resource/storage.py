@@ -0,0 +1,352 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from contextlib import contextmanager
+import hashlib
+import mimetypes
+import os
+import posixpath
+import shutil
+import socket
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import get_storage_class
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import LazyObject
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.client import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+# Classe de stockage des fichiers des ressources (par défaut celle de Django),
+# par exemple 'idgo_resource.storage.S3Storage'.
+STORAGE_CLASS = getattr(settings, 'RESOURCE_STORAGE_CLASS', None)
+
+S3_BUCKET = getattr(settings, 'RESOURCE_S3_BUCKET', None)
+S3_PREFIX = getattr(settings, 'RESOURCE_S3_PREFIX', '')
+S3_ENDPOINT_URL = getattr(settings, 'RESOURCE_S3_ENDPOINT_URL', None)  # MinIO, Ceph, etc.
+S3_REGION = getattr(settings, 'RESOURCE_S3_REGION', None)
+S3_ACCESS_KEY_ID = getattr(settings, 'RESOURCE_S3_ACCESS_KEY_ID', None)
+S3_SECRET_ACCESS_KEY = getattr(settings, 'RESOURCE_S3_SECRET_ACCESS_KEY', None)
+S3_MULTIPART_THRESHOLD = getattr(settings, 'RESOURCE_S3_MULTIPART_THRESHOLD', 8388608)  # Default: 8Mio
+S3_MULTIPART_CHUNKSIZE = getattr(settings, 'RESOURCE_S3_MULTIPART_CHUNKSIZE', 8388608)  # Default: 8Mio
+S3_MAX_CONCURRENCY = getattr(settings, 'RESOURCE_S3_MAX_CONCURRENCY', 4)
+# Durée de validité (en secondes) des liens de téléchargement signés
+S3_PRESIGNED_EXPIRATION = getattr(settings, 'RESOURCE_S3_PRESIGNED_EXPIRATION', 300)
+
+# Nom du nœud web courant, enregistré dans les sessions d'émission
+NODE_NAME = getattr(settings, 'RESOURCE_NODE_NAME', None) or socket.gethostname()
+# Le stockage local est-il partagé entre les nœuds web (NFS, etc.) ?
+LOCAL_STORAGE_SHARED = getattr(settings, 'RESOURCE_LOCAL_STORAGE_SHARED', False)
+# Cookie d'affinité à utiliser par le répartiteur de charge si le stockage n'est pas partagé
+NODE_COOKIE = getattr(settings, 'RESOURCE_NODE_COOKIE', 'idgo_resource_node')
+NODE_COOKIE_MAX_AGE = 60*60
+
+CHUNK_SIZE = 1048576
+
+
+class LocalStorage(FileSystemStorage):
+    """Stockage sur le système de fichiers local (ou partagé)."""
+
+    def download_url(self, name, filename=None, content_type=None):
+        # Les fichiers locaux sont servis par `idgo_resource.sendfile`
+        return None
+
+    @contextmanager
+    def local_copy(self, name):
+        yield self.path(name)
+
+
+class _LimitedReader(object):
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+@deconstructible
+class S3Storage(Storage):
+    """Stockage dans un service compatible S3 (AWS, MinIO, Ceph...).
+
+    Les fichiers sont envoyés en flux par parties (multipart) au-delà de
+    `RESOURCE_S3_MULTIPART_THRESHOLD` ; les lectures partielles et les
+    liens de téléchargement signés évitent de faire transiter les fichiers
+    par les serveurs web.
+    """
+
+    def __init__(self, bucket=None, prefix=None, endpoint_url=None):
+        if boto3 is None:
+            raise ImproperlyConfigured("S3Storage requires the boto3 package.")
+        self.bucket = bucket or S3_BUCKET
+        if not self.bucket:
+            raise ImproperlyConfigured("RESOURCE_S3_BUCKET is not set.")
+        self.prefix = (S3_PREFIX if prefix is None else prefix).strip('/')
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+            config=Config(signature_version='s3v4'),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+        )
+
+    def key(self, name):
+        name = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+        if name.startswith('../') or name == '..':
+            raise ValueError("Invalid name \"{}\".".format(name))
+        return posixpath.join(self.prefix, name) if self.prefix else name
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError("S3Storage files are read-only, use save().")
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(name))
+        f = File(response['Body'], name=name)
+        f.size = response['ContentLength']
+        return f
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek') and getattr(content, 'seekable', lambda: True)():
+            content.seek(0)
+        content_type = getattr(content, 'content_type', None) \
+            or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(
+            getattr(content, 'file', content), self.bucket, self.key(name),
+            ExtraArgs={'ContentType': content_type}, Config=self.transfer_config)
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['LastModified']
+
+    def digest(self, name):
+        # L'ETag identifie le contenu de l'objet sans avoir à le relire
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ETag'].strip('"')
+
+    def listdir(self, path):
+        prefix = self.key(path).rstrip('/')
+        prefix = prefix and prefix + '/'
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for item in page.get('CommonPrefixes', []):
+                directories.append(item['Prefix'][len(prefix):].rstrip('/'))
+            for item in page.get('Contents', []):
+                files.append(item['Key'][len(prefix):])
+        return directories, files
+
+    def scan(self, path=''):
+        """Parcourir récursivement les objets sous `path`.
+
+        Renvoie pour chaque objet son nom, sa taille et sa date de modification,
+        lus dans les pages de `list_objects_v2` (aucun appel par objet).
+        """
+        prefix = self.key(path).rstrip('/') if path else self.prefix
+        prefix = prefix and prefix + '/'
+        root = self.prefix and self.prefix + '/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(root):], item['Size'], item['LastModified']
+
+    def url(self, name):
+        return self.download_url(name)
+
+    def open_range(self, name, start, end):
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key(name), Range='bytes={}-{}'.format(start, end))
+        return response['Body']
+
+    def download_url(self, name, filename=None, content_type=None):
+        params = {'Bucket': self.bucket, 'Key': self.key(name)}
+        if filename:
+            params['ResponseContentDisposition'] = 'attachment; filename="{}"'.format(
+                filename.replace('"', ''))
+        if content_type:
+            params['ResponseContentType'] = content_type
+        return self.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=S3_PRESIGNED_EXPIRATION)
+
+    @contextmanager
+    def local_copy(self, name):
+        suffix = os.path.splitext(name)[1]
+        with tempfile.NamedTemporaryFile(prefix='idgo_resource_', suffix=suffix) as f:
+            self.client.download_fileobj(
+                self.bucket, self.key(name), f, Config=self.transfer_config)
+            f.flush()
+            yield f.name
+
+
+class ResourceStorage(LazyObject):
+    """Stockage des fichiers des ressources, choisi par `RESOURCE_STORAGE_CLASS`.
+
+    La classe n'est instanciée qu'au premier accès. La déconstruction est
+    constante : changer de classe de stockage ne nécessite pas de migration.
+    """
+
+    def _setup(self):
+        self._wrapped = get_storage_class(STORAGE_CLASS)()
+
+    def deconstruct(self):
+        return ('idgo_resource.storage.ResourceStorage', [], {})
+
+
+resource_storage = ResourceStorage()
+
+
+def is_local(storage):
+    """Indiquer si les fichiers de `storage` sont accessibles par un chemin local."""
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def is_shared(storage):
+    """Indiquer si les fichiers de `storage` sont accessibles depuis tous les nœuds web."""
+    return LOCAL_STORAGE_SHARED or not is_local(storage)
+
+
+def staging(fieldfile, shared=None):
+    """Décrire un fichier déposé pour la session d'émission (entrée REDIS).
+
+    Le fichier est désigné par sa clé dans le stockage et non par un chemin
+    local ; si le stockage n'est pas partagé, le nœud qui l'a reçu est
+    enregistré afin que la création de la ressource y soit routée.
+    """
+    storage = fieldfile.storage
+    return {
+        'storage_key': fieldfile.name,
+        'node': NODE_NAME,
+        'shared': is_shared(storage) if shared is None else shared,
+        'filename': is_local(storage) and fieldfile.path or None,
+    }
+
+
+def is_other_node(session):
+    """Indiquer si le fichier de la session est resté sur un autre nœud, non partagé."""
+    return not session.get('shared', True) and session.get('node', NODE_NAME) != NODE_NAME
+
+
+def set_node_cookie(response):
+    """Poser le cookie d'affinité qui route la suite de la session vers ce nœud."""
+    response.set_cookie(NODE_COOKIE, NODE_NAME, max_age=NODE_COOKIE_MAX_AGE, httponly=True)
+    return response
+
+
+@contextmanager
+def local_copy(storage, name):
+    """Fournir un chemin local vers le fichier `name` (copie temporaire si besoin)."""
+    if is_local(storage):
+        yield storage.path(name)
+    elif hasattr(storage, 'local_copy'):
+        with storage.local_copy(name) as path:
+            yield path
+    else:
+        suffix = os.path.splitext(name)[1]
+        with tempfile.NamedTemporaryFile(prefix='idgo_resource_', suffix=suffix) as f:
+            with storage.open(name, 'rb') as source:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            f.flush()
+            yield f.name
+
+
+def file_digest(f):
+    """Calculer l'empreinte SHA-256 du contenu d'un fichier ouvert."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_digest(storage, name):
+    """Retourner une empreinte du contenu du fichier `name`.
+
+    Le stockage objet fournit l'ETag ; les autres stockages sont relus.
+    """
+    if hasattr(storage, 'digest'):
+        return storage.digest(name)
+    with storage.open(name, 'rb') as f:
+        return file_digest(f)
+
+
+def open_range(storage, name, start, end):
+    """Ouvrir en lecture les octets `start` à `end` (inclus) du fichier `name`."""
+    if hasattr(storage, 'open_range'):
+        return storage.open_range(name, start, end)
+    f = storage.open(name, 'rb')
+    f.seek(start)
+    return _LimitedReader(f, end - start + 1)
+
+
+def download_url(storage, name, filename=None, content_type=None):
+    """Retourner un lien de téléchargement direct, ou `None` si le fichier est servi par l'application."""
+    if hasattr(storage, 'download_url'):
+        return storage.download_url(name, filename=filename, content_type=content_type)
+    return None
@@ -16,6 +16,7 @@
 
 from celery.signals import before_task_publish
 from celery.utils.log import get_task_logger
+from django.conf import settings
 
 
 from idgo_resource.apps import app as celery_app
@@ -23,6 +24,89 @@ from idgo_resource.apps import app as celery_app
 
 logger = get_task_logger(__name__)
 
+# Nombre de nouvelles tentatives de publication avant placement dans la file des échecs
+PUBLISH_MAX_RETRIES = getattr(settings, 'RESOURCE_PUBLISH_MAX_RETRIES', 8)
+
+
+@celery_app.task(name='idgo_resource.process_resource', ignore_result=True)
+def process_resource(redis_key):
+    """Traiter la ressource suivie par l'entrée REDIS `redis_key`."""
+    from idgo_resource import pipeline
+    pipeline.run(redis_key)
+
+
+@celery_app.task(name='idgo_resource.process_resources', ignore_result=True)
+def process_resources(redis_key):
+    """Traiter le lot de ressources suivi par l'entrée REDIS `redis_key`."""
+    from idgo_resource import pipeline
+    pipeline.run_batch(redis_key)
+
+
+@celery_app.task(name='idgo_resource.publish_resource', bind=True, ignore_result=True,
+                 max_retries=PUBLISH_MAX_RETRIES)
+def publish_resource(self, resource_pk, user_pk=None, force=False, redis_key=None):
+    """Publier dans CKAN le fichier de la ressource, avec nouvelles tentatives en cas d'échec.
+
+    L'issue est publiée dans l'entrée REDIS `redis_key` le cas échéant
+    (l'échec définitif l'est par `retry.bury`).
+    """
+    from django.contrib.auth import get_user_model
+    from idgo_resource.ckan import publish_upload
+    from idgo_resource.locks import forget
+    from idgo_resource.models import Resource
+    from idgo_resource.pipeline import STAGE_DONE
+    from idgo_resource import retry
+    try:
+        resource = Resource.objects.get(pk=resource_pk)
+        if force and not self.request.retries:
+            forget(str(resource.ckan_id))
+        user = get_user_model().objects.filter(pk=user_pk).first()
+        publish_upload(resource, with_user=user)
+    except Exception as e:
+        retry.handle(self, e)
+    else:
+        retry.notify(redis_key, stage=STAGE_DONE, progress=100)
+
+
+@celery_app.task(name='idgo_resource.synchronize_store', bind=True, ignore_result=True,
+                 max_retries=PUBLISH_MAX_RETRIES)
+def synchronize_store(self, resource_pk, user_pk=None, force=False):
+    """Synchroniser dans CKAN la page d'une ressource magasin, avec nouvelles tentatives."""
+    from django.contrib.auth import get_user_model
+    from idgo_resource.ckan import synchronize_store as synchronize
+    from idgo_resource.locks import forget
+    from idgo_resource.models import Resource
+    from idgo_resource import retry
+    try:
+        resource = Resource.objects.get(pk=resource_pk)
+        if force and not self.request.retries:
+            forget(str(resource.ckan_id))
+        user = get_user_model().objects.filter(pk=user_pk).first()
+        synchronize(resource, with_user=user)
+    except Exception as e:
+        retry.handle(self, e)
+
+
+@celery_app.task(name='idgo_resource.reconcile_ckan', ignore_result=True)
+def reconcile_ckan(repair=False):
+    """Comparer les ressources aux ressources CKAN et corriger les écarts le cas échéant."""
+    from idgo_resource import reconciliation
+    reconciliation.reconcile(repair=repair)
+
+
+@celery_app.task(name='idgo_resource.ingest_archive', ignore_result=True)
+def ingest_archive(resource_pk, source=None, user_pk=None, clear=False, redis_key=None):
+    """Extraire une archive dans le répertoire de stockage de la ressource puis la synchroniser."""
+    from idgo_resource import archive
+    archive.ingest(resource_pk, source=source, user_pk=user_pk, clear=clear, redis_key=redis_key)
+
+
+@celery_app.task(name='idgo_resource.reconcile_storage_usage', ignore_result=True)
+def reconcile_storage_usage():
+    """Recalculer les compteurs d'utilisation du stockage à partir des fichiers."""
+    from idgo_resource import usage
+    usage.reconcile()
+
 
 @before_task_publish.connect
 def on_beforehand(headers=None, body=None, sender=None, **kwargs):
@@ -16,25 +16,40 @@
 
 from django.conf.urls import url
 
+from idgo_resource.views import BulkEmitResourceFtp
+from idgo_resource.views import BulkEmitResourceUpload
 from idgo_resource.views import CreateResourceFtp
 from idgo_resource.views import CreateResourceUpload
 from idgo_resource.views import Dashboard
 from idgo_resource.views import DeleteResourceFtp
 from idgo_resource.views import DeleteResourceUpload
+from idgo_resource.views import DirectoryStorage
+from idgo_resource.views import DownloadResourceFtp
+from idgo_resource.views import DownloadResourceUpload
 from idgo_resource.views import EditResourceFtp
 from idgo_resource.views import EditResourceUpload
 from idgo_resource.views import EmitResourceFtp
 from idgo_resource.views import EmitResourceUpload
+from idgo_resource.views import IngestResourceStore
+from idgo_resource.views import Metrics
 from idgo_resource.views import NewResource
 from idgo_resource.views import RedirectResource
+from idgo_resource.views import ResourceProfile
+from idgo_resource.views import ResourceProgress
 from idgo_resource.views import ShowResourceFtp
 from idgo_resource.views import ShowResourceUpload
+from idgo_resource.views import StorageUsageView
 from idgo_resource.views import UpdateResourceFtp
 from idgo_resource.views import UpdateResourceUpload
 
 
 urlpatterns = [
+    url('^metrics/$', Metrics.as_view(), name='metrics'),
+    url('^profile/(?P<key>([0-9a-f-]+))/$', ResourceProfile.as_view(), name='resource_profile'),
+    url('^usage/$', StorageUsageView.as_view(), name='storage_usage'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/usage/$', StorageUsageView.as_view(), name='storage_usage'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/dashboard/$', Dashboard.as_view(), name='dashboard'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/progress/(?P<redis_key>([0-9a-f-]+))/$', ResourceProgress.as_view(), name='resource_progress'),
 
     url('^dataset/(?P<dataset_id>(\d+))/-/resource/$', RedirectResource.as_view(), name='redirect_resource'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/new/$', NewResource.as_view(), name='new_resource'),
@@ -42,18 +57,28 @@ urlpatterns = [
     # Resource: Upload
     # ================
     url('^dataset/(?P<dataset_id>(\d+))/resource/new/upload/$', EmitResourceUpload.as_view(), name='emit_resource_upload'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/new/upload/bulk/$', BulkEmitResourceUpload.as_view(), name='bulk_emit_resource_upload'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/new/upload/create/$', CreateResourceUpload.as_view(), name='create_resource_upload'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/upload/show/$', ShowResourceUpload.as_view(), name='show_resource_upload'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/upload/edit/$', EditResourceUpload.as_view(), name='edit_resource_upload'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/upload/update/$', UpdateResourceUpload.as_view(), name='update_resource_upload'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/upload/delete/$', DeleteResourceUpload.as_view(), name='delete_resource_upload'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/upload/download/$', DownloadResourceUpload.as_view(), name='download_resource_upload'),
 
     # Resource: Ftp
     # =============
     url('^dataset/(?P<dataset_id>(\d+))/resource/new/ftp/$', EmitResourceFtp.as_view(), name='emit_resource_ftp'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/new/ftp/bulk/$', BulkEmitResourceFtp.as_view(), name='bulk_emit_resource_ftp'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/new/ftp/create/$', CreateResourceFtp.as_view(), name='create_resource_ftp'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/ftp/show/$', ShowResourceFtp.as_view(), name='show_resource_ftp'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/ftp/edit/$', EditResourceFtp.as_view(), name='edit_resource_ftp'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/ftp/update/$', UpdateResourceFtp.as_view(), name='update_resource_ftp'),
     url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/ftp/delete/$', DeleteResourceFtp.as_view(), name='delete_resource_ftp'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/ftp/download/$', DownloadResourceFtp.as_view(), name='download_resource_ftp'),
+
+    # Resource: Store
+    # ===============
+    url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/storage/ingest/$', IngestResourceStore.as_view(), name='ingest_resource_store'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/storage/$', DirectoryStorage.as_view(), name='directory_storage'),
+    url('^dataset/(?P<dataset_id>(\d+))/resource/(?P<resource_id>(\d+))/storage/(?P<path>(.+))$', DirectoryStorage.as_view(), name='directory_storage'),
 ]
@@ -0,0 +1,264 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from collections import defaultdict
+from functools import reduce
+from operator import ior
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+from django.template.defaultfilters import filesizeformat
+
+from idgo_resource.ckan.store import DIRECTORY_STORAGE
+from idgo_resource.ckan.store import index_directory
+from idgo_resource.ckan.store import read_index
+from idgo_resource.ckan.upload import get_related_file
+from idgo_resource import logger
+from idgo_resource.models import Resource
+from idgo_resource.models import StorageUsage
+
+
+# Quotas par défaut, en octets, par portée (`user`, `organisation`, `dataset`) ;
+# le champ `quota` d'une ligne `StorageUsage` prévaut sur ces valeurs.
+QUOTAS = getattr(settings, 'RESOURCE_QUOTAS', {})
+
+SCOPE_LABELS = dict(StorageUsage.SCOPE_CHOICES)
+
+
+class QuotaExceeded(Exception):
+    """Le fichier dépasse l'espace de stockage disponible."""
+
+    def __init__(self, scope, quota, used):
+        self.scope = scope
+        self.quota = quota
+        self.used = used
+        super().__init__(
+            "Le quota de stockage ({label}) est atteint : "
+            "{used} utilisés sur {quota} autorisés.".format(
+                label=SCOPE_LABELS[scope].lower(),
+                used=filesizeformat(used),
+                quota=filesizeformat(quota),
+            ))
+
+
+def scopes(dataset):
+    """Retourner les portées auxquelles sont imputés les fichiers du jeu de données."""
+    if not dataset:
+        return []
+    keys = [
+        ('dataset', dataset.pk),
+        ('user', dataset.editor_id),
+        ('organisation', dataset.organisation_id),
+    ]
+    return [(scope, object_id) for scope, object_id in keys if object_id]
+
+
+def _file_size(fieldfile):
+    try:
+        return fieldfile.storage.size(fieldfile.name)
+    except OSError:
+        return 0
+
+
+def measure(resource):
+    """Calculer l'espace occupé par les fichiers d'une ressource."""
+    size = 0
+    for related in (get_related_file(resource), getattr(resource, 'storageresource', None)):
+        if related and related.file_path:
+            size += _file_size(related.file_path)
+
+    location = os.path.join(DIRECTORY_STORAGE, str(resource.pk))
+    if os.path.isdir(location):
+        index = read_index(location)
+        if index is None:
+            index = index_directory(location)
+        size += sum(entry['size'] for entry in index.values())
+    return size
+
+
+def _lock(scope, object_id):
+    StorageUsage.objects.get_or_create(scope=scope, object_id=object_id)
+    return StorageUsage.objects.select_for_update().get(scope=scope, object_id=object_id)
+
+
+def _apply(dataset, delta):
+    # Les portées sont toujours mises à jour dans le même ordre pour éviter les interblocages
+    for scope, object_id in scopes(dataset):
+        updated = StorageUsage.objects.filter(scope=scope, object_id=object_id) \
+            .update(bytes_used=F('bytes_used') + delta)
+        if not updated:
+            _lock(scope, object_id)
+            StorageUsage.objects.filter(scope=scope, object_id=object_id) \
+                .update(bytes_used=F('bytes_used') + delta)
+
+
+@transaction.atomic
+def account(resource_pk):
+    """Mettre à jour les compteurs après l'enregistrement d'un fichier de la ressource.
+
+    L'écart entre la taille mesurée et la taille déjà imputée à la ressource
+    est reporté sur le jeu de données, son éditeur et son organisation, dans
+    la transaction de l'enregistrement.
+    """
+    row = _lock('resource', resource_pk)
+    resource = Resource.objects.select_related('dataset').filter(pk=resource_pk).first()
+    if not resource:
+        return
+
+    size = measure(resource)
+    delta = size - row.bytes_used
+    if not delta:
+        return
+
+    row.bytes_used = size
+    row.save(update_fields=['bytes_used', 'updated'])
+    _apply(resource.dataset, delta)
+
+
+@transaction.atomic
+def release(resource):
+    """Libérer l'espace imputé à une ressource supprimée."""
+    row = StorageUsage.objects.select_for_update() \
+        .filter(scope='resource', object_id=resource.pk).first()
+    if not row:
+        return
+    if row.bytes_used:
+        _apply(resource.dataset, -row.bytes_used)
+    row.delete()
+
+
+def _quota(row, scope):
+    if row and row.quota is not None:
+        return row.quota
+    return QUOTAS.get(scope)
+
+
+def check_quota(dataset, size, resource=None):
+    """Vérifier que `size` octets supplémentaires tiennent dans les quotas.
+
+    Lorsque `resource` est renseignée, ses fichiers sont remplacés : l'espace
+    qui lui est déjà imputé est déduit. Lève `QuotaExceeded` le cas échéant.
+    """
+    keys = scopes(dataset)
+    if not keys:
+        return
+
+    lookups = keys + (resource and [('resource', resource.pk)] or [])
+    rows = {
+        (row.scope, row.object_id): row for row in StorageUsage.objects.filter(
+            reduce(ior, [Q(scope=scope, object_id=object_id) for scope, object_id in lookups]))
+    }
+
+    replaced = resource and ('resource', resource.pk) in rows \
+        and rows[('resource', resource.pk)].bytes_used or 0
+
+    for scope, object_id in keys:
+        row = rows.get((scope, object_id))
+        quota = _quota(row, scope)
+        if quota is None:
+            continue
+        used = row and row.bytes_used or 0
+        if used - replaced + size > quota:
+            raise QuotaExceeded(scope, quota, used)
+
+
+def files_size(value):
+    """Taille d'un fichier téléversé ou déposé sur le FTP, ou d'une liste de ceux-ci."""
+    if isinstance(value, (list, tuple)):
+        return sum(files_size(item) for item in value)
+    if isinstance(value, str):
+        try:
+            return os.path.getsize(value)
+        except OSError:
+            return 0
+    return value and value.size or 0
+
+
+def validate_quota(form, dataset, resource=None, field='file_path'):
+    """Ajouter au formulaire l'erreur de dépassement de quota le cas échéant."""
+    try:
+        check_quota(dataset, files_size(form.cleaned_data.get(field)), resource=resource)
+    except QuotaExceeded as e:
+        form.add_error(field, str(e))
+        return False
+    return True
+
+
+def summary(keys):
+    """Retourner l'utilisation et le quota de chacune des portées."""
+    rows = {}
+    if keys:
+        rows = {
+            (row.scope, row.object_id): row for row in StorageUsage.objects.filter(
+                reduce(ior, [Q(scope=scope, object_id=object_id) for scope, object_id in keys]))
+        }
+
+    data = {}
+    for scope, object_id in keys:
+        row = rows.get((scope, object_id))
+        data[scope] = {
+            'id': object_id,
+            'used': row and row.bytes_used or 0,
+            'quota': _quota(row, scope),
+            'updated': row and row.updated.isoformat() or None,
+        }
+    return data
+
+
+def reconcile(dry_run=False):
+    """Recalculer l'ensemble des compteurs à partir des fichiers.
+
+    Les compteurs sont tenus à jour au fil de l'eau ; ce parcours complet ne
+    sert qu'à corriger les écarts (fichiers modifiés hors de l'application,
+    transactions interrompues, etc.). Retourne la liste des écarts constatés
+    sous la forme `(scope, object_id, current, expected)`.
+    """
+    totals = defaultdict(int)
+    queryset = Resource.objects.select_related('dataset', 'upload', 'ftp', 'storageresource')
+    for resource in queryset.iterator():
+        size = measure(resource)
+        totals[('resource', resource.pk)] = size
+        for key in scopes(resource.dataset):
+            totals[key] += size
+
+    drift = []
+    with transaction.atomic():
+        rows = {
+            (row.scope, row.object_id): row
+            for row in StorageUsage.objects.select_for_update()
+        }
+        for key in sorted(set(rows) | set(totals)):
+            row = rows.get(key)
+            current = row and row.bytes_used or 0
+            expected = totals.get(key, 0)
+            if current == expected:
+                continue
+            drift.append(key + (current, expected))
+            if dry_run:
+                continue
+            if row:
+                row.bytes_used = expected
+                row.save(update_fields=['bytes_used', 'updated'])
+            else:
+                StorageUsage.objects.create(scope=key[0], object_id=key[1], bytes_used=expected)
+
+    logger.info("Storage usage reconciled: {count} counter(s) corrected.".format(
+        count=not dry_run and len(drift) or 0))
+    return drift
@@ -15,36 +15,56 @@
 
 
 from idgo_resource.views.dashboard import Dashboard
+from idgo_resource.views.download import DirectoryStorage
+from idgo_resource.views.download import DownloadResourceFtp
+from idgo_resource.views.download import DownloadResourceUpload
+from idgo_resource.views.ftp import BulkEmitResourceFtp
 from idgo_resource.views.ftp import CreateResourceFtp
 from idgo_resource.views.ftp import EditResourceFtp
 from idgo_resource.views.ftp import EmitResourceFtp
 from idgo_resource.views.ftp import DeleteResourceFtp
 from idgo_resource.views.ftp import ShowResourceFtp
 from idgo_resource.views.ftp import UpdateResourceFtp
+from idgo_resource.views.metrics import Metrics
 from idgo_resource.views.new import NewResource
+from idgo_resource.views.profiling import ResourceProfile
+from idgo_resource.views.progress import ResourceProgress
 from idgo_resource.views.resource import RedirectResource
+from idgo_resource.views.store import IngestResourceStore
+from idgo_resource.views.upload import BulkEmitResourceUpload
 from idgo_resource.views.upload import CreateResourceUpload
 from idgo_resource.views.upload import EditResourceUpload
 from idgo_resource.views.upload import EmitResourceUpload
 from idgo_resource.views.upload import DeleteResourceUpload
 from idgo_resource.views.upload import ShowResourceUpload
 from idgo_resource.views.upload import UpdateResourceUpload
+from idgo_resource.views.usage import StorageUsageView
 
 
 __all__ = [
+    BulkEmitResourceFtp,
+    BulkEmitResourceUpload,
     CreateResourceFtp,
     CreateResourceUpload,
     Dashboard,
     DeleteResourceFtp,
     DeleteResourceUpload,
+    DirectoryStorage,
+    DownloadResourceFtp,
+    DownloadResourceUpload,
     EditResourceFtp,
     EditResourceUpload,
     EmitResourceFtp,
     EmitResourceUpload,
+    IngestResourceStore,
+    Metrics,
     NewResource,
     RedirectResource,
+    ResourceProfile,
+    ResourceProgress,
     ShowResourceFtp,
     ShowResourceUpload,
+    StorageUsageView,
     UpdateResourceFtp,
     UpdateResourceUpload,
 ]
@@ -14,8 +14,11 @@
 # under the License.
 
 
+import re
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
@@ -26,6 +29,9 @@ from idgo_admin.shortcuts import render_with_info_profile
 from idgo_admin.shortcuts import user_and_profile
 
 
+# Même motif que le paramètre `redis_key` de l'URL `resource_progress`
+REDIS_KEY_RE = re.compile(r'^[0-9a-f-]+$')
+
 decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
 
 
@@ -36,8 +42,13 @@ class Dashboard(View):
         user, profile = user_and_profile(request)
         dataset = get_object_or_404(Dataset, pk=dataset_id)
 
+        redis_key = request.GET.get('key')
+        if redis_key and not REDIS_KEY_RE.match(redis_key):
+            raise Http404()
+
         context = {
             'dataset': dataset,
+            'redis_key': redis_key,
         }
 
         return render_with_info_profile(request, 'resource/dashboard.html', context)
@@ -0,0 +1,101 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import os.path
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.shortcuts import redirect
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+
+from idgo_resource.ckan.store import DIRECTORY_STORAGE
+from idgo_resource.models import Resource
+from idgo_resource.sendfile import serve
+from idgo_resource.storage import download_url
+from idgo_resource.storage import is_local
+
+
+decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
+
+
+class DirectoryStorage(View):
+    """Servir un fichier du répertoire de stockage d'une ressource.
+
+    Les liens sont publiés dans CKAN : la vue est accessible sans authentification.
+    """
+
+    def get(self, request, dataset_id, resource_id, path='', *args, **kwargs):
+        resource = get_object_or_404(Resource, pk=resource_id, dataset_id=dataset_id)
+
+        # Les fichiers internes (index, fichiers temporaires) ne sont pas servis
+        parts = [part for part in path.split('/') if part]
+        if not parts or any(part.startswith(('_', '.')) for part in parts):
+            raise Http404()
+
+        location = os.path.realpath(os.path.join(DIRECTORY_STORAGE, str(resource.pk)))
+        filename = os.path.realpath(os.path.join(location, *parts))
+        if os.path.commonpath([location, filename]) != location:
+            raise Http404()
+
+        return serve(request, filename)
+
+
+@method_decorator(decorators, name='dispatch')
+class DownloadResourceFile(View):
+    """Télécharger le fichier d'une ressource."""
+
+    related_attr = None
+
+    def get(self, request, dataset_id, resource_id, *args, **kwargs):
+        resource = get_object_or_404(
+            Resource.objects.select_related(self.related_attr, 'format_type'),
+            pk=resource_id, dataset_id=dataset_id)
+
+        instance = getattr(resource, self.related_attr, None)
+        if not instance or not instance.file_path:
+            raise Http404()
+
+        format_type = resource.format_type
+        content_type = format_type and format_type.mimetype and format_type.mimetype[0]
+
+        storage = instance.file_path.storage
+        if not is_local(storage):
+            # Le client télécharge directement depuis le stockage objet (lien signé)
+            url = download_url(
+                storage, instance.file_path.name,
+                filename=os.path.basename(instance.file_path.name), content_type=content_type)
+            if not url:
+                raise Http404()
+            return redirect(url)
+
+        return serve(request, instance.file_path.path, content_type=content_type, as_attachment=True)
+
+
+class DownloadResourceUpload(DownloadResourceFile):
+    """Télécharger le fichier d'une ressource de type Upload."""
+
+    related_attr = 'upload'
+
+
+class DownloadResourceFtp(DownloadResourceFile):
+    """Télécharger le fichier d'une ressource de type Ftp."""
+
+    related_attr = 'ftp'
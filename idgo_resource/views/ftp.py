@@ -15,8 +15,6 @@
 
 
 from functools import reduce
-import magic
-from mimetypes import MimeTypes
 from operator import ior
 from pathlib import Path
 
@@ -35,16 +33,26 @@ from django.urls import reverse
 from idgo_admin.models import Dataset
 from idgo_admin.shortcuts import render_with_info_profile
 from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.bulk import create_ftp_resources
+from idgo_resource.forms import BulkEmitResourceFtpForm
 from idgo_resource.forms import CreateResourceFtpForm
 from idgo_resource.forms import EditResourceFtpForm
 from idgo_resource.forms import EmitResourceFtpForm
 from idgo_resource.forms import UpdateResourceFtpForm
 from idgo_resource.models import ResourceFormats
 from idgo_resource.models import Resource
+from idgo_resource import metrics
+from idgo_resource.mime import guess_type
 from idgo_resource.redis_client import Handler as RedisHandler
-
-
-Mime = magic.Magic(mime=True)
+from idgo_resource.storage import LOCAL_STORAGE_SHARED
+from idgo_resource.storage import set_node_cookie
+from idgo_resource.storage import staging
+from idgo_resource.tasks import process_resource
+from idgo_resource.tasks import process_resources
+from idgo_resource.usage import validate_quota
+from idgo_resource.views.resource import FRAGMENT_CACHE_TIMEOUT
+from idgo_resource.views.resource import get_resource_stamp
+from idgo_resource.views.resource import render_conditional
 
 
 LOGIN_URL = settings.LOGIN_URL
@@ -63,18 +71,21 @@ class ResourceFtpBaseView(View):
     def post(self, *args, **kwargs):
         raise NotImplementedError
 
+    @metrics.timer('stage_duration_seconds', stage='emit_redis')
     def redis_create_key(self, user, instance, instance_pk, content_type):
         return RedisHandler().create(
             user=user.pk,
             content_type=content_type,
             name=instance.file_path.name,
             size=instance.file_path.size,
-            filename=instance.file_path.path,
             resource_pk=None,
             related_pk=instance_pk,
-            related_model=type(instance).__name__
+            related_model=type(instance).__name__,
+            # Les fichiers restent sur le système de fichiers du serveur FTP
+            **staging(instance.file_path, shared=LOCAL_STORAGE_SHARED)
         )
 
+    @metrics.timer('stage_duration_seconds', stage='emit_format')
     def init_resource_form(self, instance, title, content_type, redis_key, resource=None):
 
         filters = [
@@ -120,14 +131,17 @@ class EmitResourceFtp(ResourceFtpBaseView):
         dataset = get_object_or_404(Dataset, pk=dataset_id)
         form = self.EmitResourceForm(data=request.POST, files=request.FILES, user=user)
 
-        if not form.is_valid():
+        if not form.is_valid() or not validate_quota(form, dataset):
             context = {'form': form, 'dataset': dataset}
             return render_with_info_profile(request, self.template_emit, context)
 
-        instance = form.save()
+        with metrics.timer('stage_duration_seconds', stage='emit_save'):
+            instance = form.save()
+        metrics.increment('bytes_total', instance.file_path.size, direction='uploaded')
 
         file_path = Path(instance.file_path.name)
-        content_type = MimeTypes().guess_type(str(file_path))[0] or Mime.from_file(str(file_path))
+        with metrics.timer('stage_duration_seconds', stage='emit_sniff'):
+            content_type = guess_type(file_path)
 
         title = file_path.name
 
@@ -140,7 +154,60 @@ class EmitResourceFtp(ResourceFtpBaseView):
         messages.info(request, msg)
 
         context = {'form': resource_form, 'dataset': dataset}
-        return render_with_info_profile(request, self.template_create, context)
+        response = render_with_info_profile(request, self.template_create, context)
+        if not LOCAL_STORAGE_SHARED:
+            set_node_cookie(response)
+        return response
+
+
+class BulkEmitResourceFtp(ResourceFtpBaseView):
+    """Emettre plusieurs fichiers pour créer en lot des ressources de type Ftp."""
+
+    EmitResourceForm = BulkEmitResourceFtpForm
+    template_emit = 'resource/ftp/bulk_emit.html'
+
+    def get(self, request, dataset_id=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset = get_object_or_404(Dataset, pk=dataset_id)
+        form = self.EmitResourceForm(user=user)
+
+        context = {'form': form, 'extensions': form.extensions, 'dataset': dataset}
+        return render_with_info_profile(request, self.template_emit, context)
+
+    @transaction.atomic
+    def post(self, request, dataset_id=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset = get_object_or_404(Dataset, pk=dataset_id)
+        form = self.EmitResourceForm(data=request.POST, files=request.FILES, user=user)
+
+        if not form.is_valid() or not validate_quota(form, dataset):
+            context = {'form': form, 'extensions': form.extensions, 'dataset': dataset}
+            return render_with_info_profile(request, self.template_emit, context)
+
+        resources = create_ftp_resources(
+            dataset, form.cleaned_data['file_path'], resource_type=self.default_resource_type)
+
+        # Une seule entrée REDIS suit le traitement de l'ensemble du lot
+        redis_key = RedisHandler().create(
+            user=user.pk, resource_pks=[resource.pk for resource in resources])
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resources.delay(redis_key))
+
+        msg = (
+            "Création de {count} ressources en cours d'execution. "
+            '<a href="{url}?key={key}">Suivre l\'avancement du traitement</a>.'
+        ).format(
+            count=len(resources),
+            url=reverse('idgo_resource:dashboard', kwargs={'dataset_id': dataset.pk}),
+            key=redis_key,
+        )
+        messages.success(request, msg)
+
+        url = '{base_url}?id={dataset_id}#resources'.format(
+            base_url=reverse('idgo_admin:dataset'), dataset_id=dataset.pk)
+        return HttpResponseRedirect(url)
 
 
 class UpdateResourceFtp(ResourceFtpBaseView):
@@ -177,7 +244,7 @@ class UpdateResourceFtp(ResourceFtpBaseView):
         form = self.UpdateResourceForm(
             data=request.POST, files=request.FILES, instance=instance, user=user)
 
-        if not form.is_valid():
+        if not form.is_valid() or not validate_quota(form, dataset, resource=resource):
             context = {
                 'form': form,
                 'dataset': dataset,
@@ -189,7 +256,7 @@ class UpdateResourceFtp(ResourceFtpBaseView):
         updated_ftp = form.save()
 
         file_path = Path(instance.file_path.name)
-        content_type = MimeTypes().guess_type(str(file_path))[0] or Mime.from_file(str(file_path))
+        content_type = guess_type(file_path)
 
         title = file_path.name
 
@@ -207,7 +274,10 @@ class UpdateResourceFtp(ResourceFtpBaseView):
             'resource': resource,
             'ftp': updated_ftp,
         }
-        return render_with_info_profile(request, self.template_edit, context)
+        response = render_with_info_profile(request, self.template_edit, context)
+        if not LOCAL_STORAGE_SHARED:
+            set_node_cookie(response)
+        return response
 
 
 @method_decorator(decorators, name='dispatch')
@@ -259,7 +329,8 @@ class CreateResourceFtp(View):
         # return HttpResponseRedirect(url)
 
     def run_asynchronous_tasks(self, redis_key, *args, **kwargs):
-        raise NotImplementedError('TODO')
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resource.delay(redis_key))
 
 
 @method_decorator(decorators, name='dispatch')
@@ -324,7 +395,8 @@ class EditResourceFtp(View):
         # return HttpResponseRedirect(url)
 
     def run_asynchronous_tasks(self, redis_key, *args, **kwargs):
-        raise NotImplementedError('TODO')
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resource.delay(redis_key))
 
 
 @method_decorator(decorators, name='dispatch')
@@ -334,16 +406,25 @@ class ShowResourceFtp(View):
     template_show = 'resource/ftp/show.html'
 
     def get_context(self, dataset, resource):
-        return {'dataset': dataset, 'resource': resource}
+        return {
+            'dataset': dataset,
+            'resource': resource,
+            'fragment_timeout': FRAGMENT_CACHE_TIMEOUT,
+            'fragment_key': get_resource_stamp(resource),
+        }
 
     def get(self, request, dataset_id, resource_id, *args, **kwargs):
         user, profile = user_and_profile(request)
 
-        dataset = get_object_or_404(Dataset, pk=dataset_id)
-        resource = get_object_or_404(Resource, pk=resource_id)
+        queryset = Resource.objects.select_related('dataset', 'format_type', 'ftp')
+        resource = get_object_or_404(queryset, pk=resource_id, dataset_id=dataset_id)
+        dataset = resource.dataset
+
+        def render():
+            context = self.get_context(dataset, resource)
+            return render_with_info_profile(request, self.template_show, context)
 
-        context = self.get_context(dataset, resource)
-        return render_with_info_profile(request, self.template_show, context)
+        return render_conditional(request, resource, getattr(resource, 'ftp', None), render)
 
 
 @method_decorator(decorators, name='dispatch')
@@ -0,0 +1,71 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import hmac
+import time
+
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseForbidden
+from django.views import View
+
+from idgo_resource import metrics
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+_redis_keys_updated = 0
+
+
+def is_allowed(request):
+    """Vérifier l'accès au point d'accès (cf. `RESOURCE_METRICS_TOKEN`)."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    if metrics.METRICS_TOKEN:
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(authorization, 'Bearer {}'.format(metrics.METRICS_TOKEN)):
+            return True
+    return request.META.get('REMOTE_ADDR') in metrics.METRICS_ALLOWED_ADDRESSES
+
+
+def update_redis_keys():
+    global _redis_keys_updated
+    now = time.monotonic()
+    if now - _redis_keys_updated >= metrics.METRICS_REDIS_KEYS_INTERVAL:
+        _redis_keys_updated = now
+        metrics.gauge('redis_keys', RedisHandler().client.dbsize())
+
+
+class Metrics(View):
+    """Exposer les métriques au format Prometheus.
+
+    L'accès est réservé aux administrateurs connectés, aux requêtes portant
+    le jeton `RESOURCE_METRICS_TOKEN` et aux adresses de
+    `RESOURCE_METRICS_ALLOWED_ADDRESSES` (voir la mise en garde concernant
+    les proxies dans `idgo_resource.metrics`).
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not is_allowed(request):
+            return HttpResponseForbidden()
+
+        # La jauge est rafraîchie au plus une fois par RESOURCE_METRICS_REDIS_KEYS_INTERVAL
+        update_redis_keys()
+
+        exported = metrics.export()
+        if exported is None:
+            raise Http404()
+        content, content_type = exported
+        return HttpResponse(content, content_type=content_type)
@@ -0,0 +1,68 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import base64
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+
+from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.middleware import get_profile
+
+
+decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
+
+
+@method_decorator(decorators, name='dispatch')
+class ResourceProfile(View):
+    """Consulter le profil d'une requête enregistré par `ResourceProfilingMiddleware`.
+
+    Sans paramètre, renvoie la description du profil et le journal SQL en JSON ;
+    avec `download`, renvoie le fichier pstats ou speedscope.
+    """
+
+    def get(self, request, key=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+        if not user.is_superuser:
+            raise Http404()
+
+        value = get_profile(key)
+        if not value:
+            raise Http404()
+
+        if 'download' not in request.GET:
+            value.pop('profile')
+            return JsonResponse(value)
+
+        if value['format'] == 'pstats':
+            content = base64.b64decode(value['profile'])
+            filename = '{key}.prof'.format(key=key)
+            content_type = 'application/octet-stream'
+        else:
+            content = value['profile']
+            filename = '{key}.speedscope.json'.format(key=key)
+            content_type = 'application/json'
+
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
@@ -0,0 +1,125 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.http import JsonResponse
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+
+from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.pipeline import FINAL_STAGES
+from idgo_resource.redis_client import Handler as RedisHandler
+
+
+PROGRESS_TIMEOUT = getattr(settings, 'RESOURCE_PROGRESS_TIMEOUT', 300)
+PROGRESS_POLL_TIMEOUT = getattr(settings, 'RESOURCE_PROGRESS_POLL_TIMEOUT', 25)
+PROGRESS_KEEPALIVE = 15
+
+# Événement final envoyé lorsque l'entrée REDIS a expiré en cours de suivi
+EXPIRED_EVENT = {
+    'stage': 'failed',
+    'reason': 'expired',
+    'error': "Le suivi de ce traitement a expiré.",
+}
+
+decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
+
+
+@method_decorator(decorators, name='dispatch')
+class ResourceProgress(View):
+    """Suivre l'avancement du traitement d'une ressource.
+
+    Renvoie un flux Server-Sent Events si le client l'accepte ; sinon
+    l'état courant est renvoyé en JSON, éventuellement après avoir attendu
+    le prochain événement si le paramètre `wait` est présent (long-poll).
+    """
+
+    def get(self, request, dataset_id=None, redis_key=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        redis = RedisHandler()
+        try:
+            # L'état d'avancement est écrit par les workers : pas de cache local
+            session = redis.retreive(redis_key, cached=False)
+        except TypeError:  # L'entrée REDIS n'existe pas ou a expiré
+            raise Http404()
+        if session.get('user') != user.pk:
+            raise Http404()
+
+        if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+            response = StreamingHttpResponse(
+                self.stream(redis, redis_key), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        progress = session.get('progress') or {}
+        if 'wait' in request.GET and progress.get('stage') not in FINAL_STAGES:
+            for event in redis.listen(redis_key, timeout=PROGRESS_POLL_TIMEOUT):
+                if event:
+                    progress = event
+                    break
+
+        # Interrogation périodique : 304 tant que l'état n'a pas changé
+        etag = '"{}"'.format(hashlib.md5(json.dumps(progress, sort_keys=True).encode('utf-8')).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(progress)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def stream(self, redis, redis_key):
+        last = None
+        idle = 0
+        for index, event in enumerate(redis.listen(redis_key, timeout=PROGRESS_TIMEOUT)):
+            if index == 0:
+                # L'abonnement est effectif : on relit l'état courant
+                # pour ne rien perdre de ce qui a été publié avant.
+                try:
+                    current = redis.retreive(redis_key, cached=False).get('progress')
+                except TypeError:  # L'entrée a expiré depuis l'ouverture du flux
+                    yield self.format_event(EXPIRED_EVENT)
+                    return
+                if current and current != event:
+                    last = current
+                    yield self.format_event(current)
+            if event is None:
+                idle += 1
+                if idle % PROGRESS_KEEPALIVE == 0:
+                    if not redis.client.exists(redis_key):
+                        yield self.format_event(EXPIRED_EVENT)
+                        return
+                    yield ': keepalive\n\n'
+            elif event != last:
+                idle = 0
+                last = event
+                yield self.format_event(event)
+            if last and last.get('stage') in FINAL_STAGES:
+                break
+
+    @staticmethod
+    def format_event(event):
+        return 'event: progress\ndata: {data}\n\n'.format(data=json.dumps(event))
@@ -14,14 +14,20 @@
 # under the License.
 
 
+import hashlib
+import os
+
 from django.conf import settings
 
 from django.contrib.auth.decorators import login_required
+from django.contrib import messages
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
@@ -29,9 +35,65 @@ from idgo_admin.shortcuts import user_and_profile
 from idgo_resource.models import Resource
 
 
+# Durée de conservation des fragments de gabarit des pages des ressources
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'RESOURCE_FRAGMENT_CACHE_TIMEOUT', 60*60*24)
+
 decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
 
 
+def get_resource_stamp(resource):
+    """Calculer l'empreinte de l'état d'une ressource, utilisée comme clé de cache.
+
+    Outre la date de dernière modification de la ressource, les pages
+    dépendent de son jeu de données (liens construits à partir du slug,
+    fiche CKAN) et de son format.
+    """
+    dataset = resource.dataset
+    parts = [
+        resource.pk, resource.last_update and resource.last_update.isoformat(),
+        dataset.pk, dataset.slug, dataset.date_modification and dataset.date_modification.isoformat(),
+        resource.format_type_id,
+    ]
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def get_resource_etag(request, resource, related=None):
+    """Calculer l'ETag de la page d'une ressource.
+
+    Il dépend de l'empreinte de la ressource (cf. `get_resource_stamp`), de
+    l'état du fichier lié et de l'utilisateur (l'en-tête de page lui est propre).
+    """
+    parts = [get_resource_stamp(resource), request.user.pk]
+    if related and related.file_path:
+        parts.append(related.file_path.name)
+        try:
+            st = os.stat(related.file_path.path)
+        except (OSError, NotImplementedError):
+            pass
+        else:
+            parts.extend([st.st_size, st.st_mtime_ns])
+    return '"{}"'.format(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+
+def render_conditional(request, resource, related, render):
+    """Rendre la page d'une ressource, ou répondre 304 si le client en possède la dernière version."""
+    etag = get_resource_etag(request, resource, related)
+    last_modified = resource.last_update and int(resource.last_update.timestamp())
+
+    response = None
+    # Les messages en attente doivent être affichés : la page est rendue
+    if not len(messages.get_messages(request)):
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render()
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @method_decorator(decorators, name='dispatch')
 class ShowResource(View):
     """Voir une resource."""
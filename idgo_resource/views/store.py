@@ -0,0 +1,116 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+import os.path
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db import transaction
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.utils.html import format_html
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
+
+from idgo_admin.models import Dataset
+from idgo_admin.shortcuts import get_object_or_404_extended
+from idgo_admin.shortcuts import render_with_info_profile
+from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.forms import IngestArchiveForm
+from idgo_resource.models import Resource
+from idgo_resource.models import StorageResource
+from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource.tasks import ingest_archive
+from idgo_resource.usage import validate_quota
+
+
+LOGIN_URL = settings.LOGIN_URL
+decorators = [csrf_exempt, login_required(login_url=LOGIN_URL)]
+
+
+@method_decorator(decorators, name='dispatch')
+class IngestResourceStore(View):
+    """Alimenter le répertoire d'une ressource magasin par une archive ZIP.
+
+    L'archive est téléversée (et enregistrée dans la `StorageResource`) ou
+    sélectionnée parmi les fichiers déposés sur le FTP ; l'extraction est
+    confiée à Celery et son avancement suivi dans le tableau de bord.
+    """
+
+    template = 'resource/store/ingest.html'
+
+    def get_instances(self, user, dataset_id, resource_id):
+        dataset = get_object_or_404_extended(Dataset, user, include={'id': dataset_id})
+        resource = get_object_or_404(Resource, pk=resource_id, dataset=dataset)
+        storage_resource = get_object_or_404(StorageResource, resource=resource)
+        return dataset, resource, storage_resource
+
+    def render_form(self, request, form, dataset, resource):
+        context = {'form': form, 'extensions': form.extensions, 'dataset': dataset, 'resource': resource}
+        return render_with_info_profile(request, self.template, context)
+
+    def get(self, request, dataset_id, resource_id, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset, resource, storage_resource = self.get_instances(user, dataset_id, resource_id)
+        form = IngestArchiveForm(user=user)
+        return self.render_form(request, form, dataset, resource)
+
+    @transaction.atomic
+    def post(self, request, dataset_id, resource_id, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset, resource, storage_resource = self.get_instances(user, dataset_id, resource_id)
+        form = IngestArchiveForm(data=request.POST, files=request.FILES, user=user)
+
+        if not form.is_valid():
+            return self.render_form(request, form, dataset, resource)
+
+        archive = form.cleaned_data['archive']
+        field = archive and 'archive' or 'ftp_file'
+        clear = form.cleaned_data['clear']
+        # L'espace déjà imputé à la ressource n'est libéré que si ses fichiers sont supprimés
+        if not validate_quota(form, dataset, resource=clear and resource or None, field=field):
+            return self.render_form(request, form, dataset, resource)
+
+        if archive:
+            # L'archive est extraite depuis la `StorageResource` (cf. `archive.ingest`)
+            storage_resource.file_path.save(os.path.basename(archive.name), archive)
+            source = None
+        else:
+            source = form.cleaned_data['ftp_file']
+
+        redis_key = RedisHandler().create(user=user.pk, resource_pk=resource.pk)
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: ingest_archive.delay(
+            resource.pk, source=source, user_pk=user.pk, clear=clear, redis_key=redis_key))
+
+        msg = format_html(
+            "Extraction de l'archive dans la ressource <strong>{title}</strong> en cours d'execution. "
+            '<a href="{url}?key={key}">Suivre l\'avancement du traitement</a>.',
+            title=resource.title,
+            url=reverse('idgo_resource:dashboard', kwargs={'dataset_id': dataset.pk}),
+            key=redis_key,
+        )
+        messages.success(request, msg)
+
+        url = '{base_url}?id={dataset_id}#resources'.format(
+            base_url=reverse('idgo_admin:dataset'), dataset_id=dataset.pk)
+        return HttpResponseRedirect(url)
@@ -32,13 +32,25 @@ from django.urls import reverse
 from idgo_admin.models import Dataset
 from idgo_admin.shortcuts import render_with_info_profile
 from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.bulk import create_upload_resources
+from idgo_resource.forms import BulkEmitResourceUploadForm
 from idgo_resource.forms import CreateResourceUploadForm
 from idgo_resource.forms import EditResourceUploadForm
 from idgo_resource.forms import EmitResourceUploadForm
 from idgo_resource.forms import UpdateResourceUploadForm
 from idgo_resource.models import ResourceFormats
 from idgo_resource.models import Resource
+from idgo_resource import metrics
 from idgo_resource.redis_client import Handler as RedisHandler
+from idgo_resource.storage import is_shared
+from idgo_resource.storage import set_node_cookie
+from idgo_resource.storage import staging
+from idgo_resource.tasks import process_resource
+from idgo_resource.tasks import process_resources
+from idgo_resource.usage import validate_quota
+from idgo_resource.views.resource import FRAGMENT_CACHE_TIMEOUT
+from idgo_resource.views.resource import get_resource_stamp
+from idgo_resource.views.resource import render_conditional
 
 
 LOGIN_URL = settings.LOGIN_URL
@@ -57,17 +69,19 @@ class ResourceUploadBaseView(View):
     def post(self, *args, **kwargs):
         raise NotImplementedError
 
+    @metrics.timer('stage_duration_seconds', stage='emit_redis')
     def redis_create_key(self, user, instance, instance_pk, content_type):
         return RedisHandler().create(
             user=user.pk,
             content_type=content_type,
             name=instance.file_path.name,
             size=instance.file_path.size,
-            filename=instance.file_path.path,
             related_pk=instance_pk,
-            related_model=type(instance).__name__
+            related_model=type(instance).__name__,
+            **staging(instance.file_path)
         )
 
+    @metrics.timer('stage_duration_seconds', stage='emit_format')
     def init_resource_form(self, instance, title, content_type, redis_key, resource=None):
 
         filters = [
@@ -113,11 +127,13 @@ class EmitResourceUpload(ResourceUploadBaseView):
         dataset = get_object_or_404(Dataset, pk=dataset_id)
         form = self.EmitResourceForm(data=request.POST, files=request.FILES)
 
-        if not form.is_valid():
+        if not form.is_valid() or not validate_quota(form, dataset):
             context = {'form': form, 'dataset': dataset}
             return render_with_info_profile(request, self.template_emit, context)
 
-        instance = form.save()
+        with metrics.timer('stage_duration_seconds', stage='emit_save'):
+            instance = form.save()
+        metrics.increment('bytes_total', instance.file_path.size, direction='uploaded')
 
         content_type = request.FILES.get('file_path').content_type
         title = request.FILES.get('file_path').name
@@ -131,7 +147,60 @@ class EmitResourceUpload(ResourceUploadBaseView):
         messages.info(request, msg)
 
         context = {'form': resource_form, 'dataset': dataset}
-        return render_with_info_profile(request, self.template_create, context)
+        response = render_with_info_profile(request, self.template_create, context)
+        if not is_shared(instance.file_path.storage):
+            set_node_cookie(response)
+        return response
+
+
+class BulkEmitResourceUpload(ResourceUploadBaseView):
+    """Emettre plusieurs fichiers pour créer en lot des ressources de type Upload."""
+
+    EmitResourceForm = BulkEmitResourceUploadForm
+    template_emit = 'resource/upload/bulk_emit.html'
+
+    def get(self, request, dataset_id=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset = get_object_or_404(Dataset, pk=dataset_id)
+        form = self.EmitResourceForm()
+
+        context = {'form': form, 'extensions': form.extensions, 'dataset': dataset}
+        return render_with_info_profile(request, self.template_emit, context)
+
+    @transaction.atomic
+    def post(self, request, dataset_id=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        dataset = get_object_or_404(Dataset, pk=dataset_id)
+        form = self.EmitResourceForm(data=request.POST, files=request.FILES)
+
+        if not form.is_valid() or not validate_quota(form, dataset):
+            context = {'form': form, 'extensions': form.extensions, 'dataset': dataset}
+            return render_with_info_profile(request, self.template_emit, context)
+
+        resources = create_upload_resources(
+            dataset, form.cleaned_data['file_path'], resource_type=self.default_resource_type)
+
+        # Une seule entrée REDIS suit le traitement de l'ensemble du lot
+        redis_key = RedisHandler().create(
+            user=user.pk, resource_pks=[resource.pk for resource in resources])
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resources.delay(redis_key))
+
+        msg = (
+            "Création de {count} ressources en cours d'execution. "
+            '<a href="{url}?key={key}">Suivre l\'avancement du traitement</a>.'
+        ).format(
+            count=len(resources),
+            url=reverse('idgo_resource:dashboard', kwargs={'dataset_id': dataset.pk}),
+            key=redis_key,
+        )
+        messages.success(request, msg)
+
+        url = '{base_url}?id={dataset_id}#resources'.format(
+            base_url=reverse('idgo_admin:dataset'), dataset_id=dataset.pk)
+        return HttpResponseRedirect(url)
 
 
 class UpdateResourceUpload(ResourceUploadBaseView):
@@ -168,7 +237,7 @@ class UpdateResourceUpload(ResourceUploadBaseView):
         form = self.UpdateResourceForm(
             data=request.POST, files=request.FILES, instance=instance)
 
-        if not form.is_valid():
+        if not form.is_valid() or not validate_quota(form, dataset, resource=resource):
             context = {
                 'form': form,
                 'dataset': dataset,
@@ -197,7 +266,10 @@ class UpdateResourceUpload(ResourceUploadBaseView):
             'resource': resource,
             'upload': updated_upload,
         }
-        return render_with_info_profile(request, self.template_edit, context)
+        response = render_with_info_profile(request, self.template_edit, context)
+        if not is_shared(updated_upload.file_path.storage):
+            set_node_cookie(response)
+        return response
 
 
 @method_decorator(decorators, name='dispatch')
@@ -245,7 +317,13 @@ class CreateResourceUpload(View):
         # return HttpResponseRedirect(url)
         ###
 
-        msg = "Création de la ressource en cours d'execution.".format(id=resource.pk)
+        msg = (
+            "Création de la ressource en cours d'execution. "
+            '<a href="{url}?key={key}">Suivre l\'avancement du traitement</a>.'
+        ).format(
+            url=reverse('idgo_resource:dashboard', kwargs={'dataset_id': dataset.pk}),
+            key=redis_key,
+        )
         messages.success(request, msg)
 
         # url = reverse('idgo_resource:dashboard', kwargs={'dataset_id': dataset.pk})
@@ -256,7 +334,8 @@ class CreateResourceUpload(View):
         return HttpResponseRedirect(url)
 
     def run_asynchronous_tasks(self, redis_key, *args, **kwargs):
-        raise NotImplementedError('TODO')
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resource.delay(redis_key))
 
 
 @method_decorator(decorators, name='dispatch')
@@ -328,7 +407,8 @@ class EditResourceUpload(View):
         return HttpResponseRedirect(url)
 
     def run_asynchronous_tasks(self, redis_key, *args, **kwargs):
-        raise NotImplementedError('TODO')
+        RedisHandler().publish(redis_key, stage='queued', progress=0)
+        transaction.on_commit(lambda: process_resource.delay(redis_key))
 
 
 @method_decorator(decorators, name='dispatch')
@@ -338,16 +418,25 @@ class ShowResourceUpload(View):
     template_show = 'resource/upload/show.html'
 
     def get_context(self, dataset, resource):
-        return {'dataset': dataset, 'resource': resource}
+        return {
+            'dataset': dataset,
+            'resource': resource,
+            'fragment_timeout': FRAGMENT_CACHE_TIMEOUT,
+            'fragment_key': get_resource_stamp(resource),
+        }
 
     def get(self, request, dataset_id, resource_id, *args, **kwargs):
         user, profile = user_and_profile(request)
 
-        dataset = get_object_or_404(Dataset, pk=dataset_id)
-        resource = get_object_or_404(Resource, pk=resource_id)
+        queryset = Resource.objects.select_related('dataset', 'format_type', 'upload')
+        resource = get_object_or_404(queryset, pk=resource_id, dataset_id=dataset_id)
+        dataset = resource.dataset
+
+        def render():
+            context = self.get_context(dataset, resource)
+            return render_with_info_profile(request, self.template_show, context)
 
-        context = self.get_context(dataset, resource)
-        return render_with_info_profile(request, self.template_show, context)
+        return render_conditional(request, resource, getattr(resource, 'upload', None), render)
 
 
 @method_decorator(decorators, name='dispatch')
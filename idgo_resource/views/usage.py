@@ -0,0 +1,53 @@
+# Copyright (c) 2017-2020 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+
+from idgo_admin.models import Dataset
+from idgo_admin.shortcuts import get_object_or_404_extended
+from idgo_admin.shortcuts import user_and_profile
+from idgo_resource.usage import scopes
+from idgo_resource.usage import summary
+
+
+decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
+
+
+@method_decorator(decorators, name='dispatch')
+class StorageUsageView(View):
+    """Renvoyer en JSON l'espace de stockage utilisé et les quotas.
+
+    Les valeurs sont lues dans les compteurs tenus à jour à l'enregistrement
+    des fichiers : aucun parcours du disque n'est effectué. L'utilisation
+    d'un jeu de données n'est visible que des utilisateurs habilités à l'éditer.
+    """
+
+    def get(self, request, dataset_id=None, *args, **kwargs):
+        user, profile = user_and_profile(request)
+
+        if dataset_id:
+            dataset = get_object_or_404_extended(Dataset, user, include={'id': dataset_id})
+            keys = scopes(dataset)
+        else:
+            keys = [('user', user.pk)]
+
+        return JsonResponse(summary(keys))